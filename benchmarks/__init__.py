@@ -0,0 +1 @@
+"""Benchmarks of flatexpy on synthetic LaTeX corpora."""
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Generate reproducible synthetic LaTeX corpora for benchmarking.
+
+Every corpus stresses one aspect of flattening:
+
+- ``wide``: a main file including many small chapters
+- ``deep``: a long chain of nested includes
+- ``huge``: a single large file with few commands
+- ``figures``: many figures spread over several graphics directories
+- ``comments``: files where half the lines, including commands, are comments
+
+The same kind, scale and seed always produce byte-identical files.
+"""
+
+import argparse
+import os
+import random
+from typing import Callable, Dict, List
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua theorem lemma proof "
+    "equation figure table section result method model data analysis"
+).split()
+
+# Bytes of a fake graphics file
+FIGURE_DATA = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+def _count(base: int, scale: float) -> int:
+    """Scale a file or line count, keeping at least one."""
+    return max(1, int(base * scale))
+
+
+def _paragraph(rng: random.Random, words: int = 60) -> str:
+    """Make a paragraph of random words."""
+    return " ".join(rng.choice(WORDS) for _ in range(words)) + ".\n\n"
+
+
+def _write(directory: str, name: str, content: str) -> None:
+    """Write a text file, creating its directory."""
+    path = os.path.join(directory, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        f.write(content)
+
+
+def _document(body: str) -> str:
+    """Wrap a body in a minimal document."""
+    return (
+        "\\documentclass{article}\n\\usepackage{graphicx}\n"
+        "\\begin{document}\n" + body + "\\end{document}\n"
+    )
+
+
+def make_wide(directory: str, scale: float, rng: random.Random) -> str:
+    """Main file including many small chapters."""
+    names = [f"chapters/ch{i:04d}" for i in range(_count(2000, scale))]
+    for name in names:
+        _write(directory, name + ".tex", _paragraph(rng) * 4)
+    _write(
+        directory, "main.tex", _document("".join(f"\\input{{{n}}}\n" for n in names))
+    )
+    return os.path.join(directory, "main.tex")
+
+
+def make_deep(directory: str, scale: float, rng: random.Random) -> str:
+    """Chain of files, each including the next one."""
+    depth = _count(1000, scale)
+    for level in range(depth):
+        child = f"\\input{{levels/l{level + 1:04d}}}\n" if level + 1 < depth else ""
+        _write(directory, f"levels/l{level:04d}.tex", _paragraph(rng) + child)
+    _write(directory, "main.tex", _document("\\input{levels/l0000}\n"))
+    return os.path.join(directory, "main.tex")
+
+
+def make_huge(directory: str, scale: float, rng: random.Random) -> str:
+    """Single large file, with a command every few paragraphs."""
+    parts: List[str] = []
+    for index in range(_count(100000, scale)):
+        parts.append(_paragraph(rng, 12))
+        if index % 500 == 0:
+            parts.append(f"\\section{{Part {index}}}\n\\label{{sec:{index}}}\n")
+    _write(directory, "main.tex", _document("".join(parts)))
+    return os.path.join(directory, "main.tex")
+
+
+def make_figures(directory: str, scale: float, rng: random.Random) -> str:
+    """Sections including figures found through \\graphicspath."""
+    figure_dirs = [f"figures/set{i}" for i in range(5)]
+    body = ["\\graphicspath{" + "".join(f"{{{d}/}}" for d in figure_dirs) + "}\n"]
+    for section in range(_count(100, scale)):
+        lines = [f"\\section{{Results {section}}}\n", _paragraph(rng, 30)]
+        for index in range(4):
+            name = f"fig{section:03d}_{index}"
+            with_ext = rng.random() < 0.5
+            figure_dir = os.path.join(directory, rng.choice(figure_dirs))
+            os.makedirs(figure_dir, exist_ok=True)
+            with open(os.path.join(figure_dir, name + ".png"), "wb") as f:
+                f.write(FIGURE_DATA)
+            target = name + ".png" if with_ext else name
+            lines.append(f"\\includegraphics[width=0.4\\textwidth]{{{target}}}\n")
+        _write(directory, f"sections/s{section:03d}.tex", "".join(lines))
+        body.append(f"\\input{{sections/s{section:03d}}}\n")
+    _write(directory, "main.tex", _document("".join(body)))
+    return os.path.join(directory, "main.tex")
+
+
+def make_comments(directory: str, scale: float, rng: random.Random) -> str:
+    """Files where half the lines are comments, some hiding commands."""
+    body: List[str] = []
+    for chapter in range(_count(400, scale)):
+        lines: List[str] = []
+        for _ in range(200):
+            if rng.random() < 0.5:
+                hidden = rng.choice(
+                    ["\\input{missing}", "\\includegraphics{missing}", "draft text"]
+                )
+                lines.append(f"% {hidden} {rng.choice(WORDS)}\n")
+            else:
+                lines.append(" ".join(rng.choice(WORDS) for _ in range(10)) + "\n")
+        _write(directory, f"notes/n{chapter:03d}.tex", "".join(lines))
+        body.append(f"\\input{{notes/n{chapter:03d}}} % chapter {chapter}\n")
+    _write(directory, "main.tex", _document("".join(body)))
+    return os.path.join(directory, "main.tex")
+
+
+CORPORA: Dict[str, Callable[[str, float, random.Random], str]] = {
+    "wide": make_wide,
+    "deep": make_deep,
+    "huge": make_huge,
+    "figures": make_figures,
+    "comments": make_comments,
+}
+
+
+def generate(kind: str, directory: str, scale: float = 1.0, seed: int = 0) -> str:
+    """Generate a corpus.
+
+    Args:
+        kind: Name of the corpus, a key of CORPORA.
+        directory: Directory to create the files in.
+        scale: Multiplier of the number of files, lines or figures.
+        seed: Seed of the random content.
+
+    Returns:
+        Path of the main file of the corpus.
+    """
+    return CORPORA[kind](directory, scale, random.Random(f"{kind}:{seed}"))
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Generate a benchmark corpus")
+    parser.add_argument("kind", choices=sorted(CORPORA), help="Corpus to generate")
+    parser.add_argument("directory", help="Directory to create the corpus in")
+    parser.add_argument("--scale", type=float, default=1.0, help="Size multiplier")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the content")
+    args = parser.parse_args()
+
+    main_file = generate(args.kind, args.directory, args.scale, args.seed)
+    print(f"Generated {args.kind} corpus: {main_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Run the flatexpy benchmarks and compare them against a baseline.
+
+Every corpus is flattened in a process of its own, so peak RSS is that of
+one corpus. For each corpus the runner reports the best wall time of a flatten
+over the repeats, throughput in MB/s and files/s, peak RSS, and the number
+of file system calls made from Python (open, stat, lstat, scandir, listdir)
+during one flatten. Each repeat flattens the corpus as many times as fit in
+MIN_SAMPLE_SECONDS, so that timer and scheduler noise stay small against
+the measured time, and worker counts are pinned by COPY_WORKERS and
+DISCOVERY_WORKERS rather than left to the defaults. Repeats are interleaved
+across the corpora, each measured in a process of its own, and corpora are
+generated under WORK_ROOT, memory-backed where the system has /dev/shm.
+
+Usage:
+    python -m benchmarks.run --save benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json
+
+Compared to a baseline, a corpus regresses when its throughput drops or its
+peak RSS grows by more than --tolerance, or when it makes more file system
+calls than --count-tolerance allows. Regressions exit with status 1.
+"""
+
+import argparse
+import builtins
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None  # type: ignore[assignment]
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.corpus import CORPORA, generate  # noqa: E402
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander  # noqa: E402
+
+# Minimum duration of a timed repeat, in seconds
+MIN_SAMPLE_SECONDS = 0.5
+
+# Worker counts of every measured flatten, independent of defaults and CPUs
+COPY_WORKERS = 1
+DISCOVERY_WORKERS = 1
+
+# Directory of the generated corpora: memory-backed where available, so that
+# disk write-back does not swamp the time of corpora that copy many files
+WORK_ROOT = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# File system calls counted during a flatten, as (module, attribute)
+COUNTED_CALLS = (
+    (builtins, "open"),
+    (os, "stat"),
+    (os, "lstat"),
+    (os, "scandir"),
+    (os, "listdir"),
+)
+
+
+@contextmanager
+def count_calls() -> Iterator[Dict[str, int]]:
+    """Count the file system calls made from Python in the enclosed block.
+
+    Yields:
+        Number of calls of each function, filled as the block runs.
+    """
+    counts = {name: 0 for _, name in COUNTED_CALLS}
+    lock = threading.Lock()
+    originals = [
+        (module, name, getattr(module, name)) for module, name in COUNTED_CALLS
+    ]
+
+    def counting(name: str, function: Callable[..., Any]) -> Callable[..., Any]:
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with lock:
+                counts[name] += 1
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    for module, name, function in originals:
+        setattr(module, name, counting(name, function))
+    try:
+        yield counts
+    finally:
+        for module, name, function in originals:
+            setattr(module, name, function)
+
+
+def _peak_rss_kb() -> Optional[int]:
+    """Peak resident set size of this process in KiB, None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class CorpusRun:
+    """A generated corpus, flattened on demand by one expander."""
+
+    def __init__(self, kind: str, scale: float) -> None:
+        """Generate a corpus and flatten it once, counting file system calls.
+
+        The counted flatten is not timed, as counting slows the calls down.
+        The working directory is the corpus directory until close.
+
+        Args:
+            kind: Name of the corpus.
+            scale: Size multiplier of the corpus.
+        """
+        self.kind = kind
+        self.scale = scale
+        self.work_dir = tempfile.mkdtemp(
+            prefix=f"flatexpy-bench-{kind}-", dir=WORK_ROOT
+        )
+        self.original_cwd = os.getcwd()
+        self.main_file = generate(kind, os.path.join(self.work_dir, "src"), scale)
+        self.sources = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(os.path.dirname(self.main_file))
+            for name in names
+            if name.endswith(".tex")
+        ]
+        # \graphicspath entries are relative to the working directory
+        os.chdir(os.path.dirname(self.main_file))
+        self.expander = LatexExpander(
+            LatexExpandConfig(
+                root_directory=".",
+                copy_workers=COPY_WORKERS,
+                discovery_workers=DISCOVERY_WORKERS,
+            )
+        )
+        self.runs = 0
+        self.times: List[float] = []
+        with count_calls() as counts:
+            self._flatten()
+        self.calls = dict(counts)
+        self.output_bytes = os.path.getsize(
+            os.path.join(self.work_dir, "out0", "main.tex")
+        )
+
+    def _flatten(self) -> float:
+        """Flatten the corpus into a fresh output directory, and time it."""
+        # A fresh output directory, so graphics are copied every time
+        output_dir = os.path.join(self.work_dir, f"out{self.runs}")
+        self.runs += 1
+        os.makedirs(output_dir)
+        start = time.perf_counter()
+        self.expander.flatten_latex(
+            self.main_file,
+            os.path.join(output_dir, "main.tex"),
+            return_content=False,
+        )
+        return time.perf_counter() - start
+
+    def sample(self, min_seconds: float = MIN_SAMPLE_SECONDS) -> float:
+        """Time one repeat: flatten until min_seconds are spent.
+
+        Args:
+            min_seconds: Minimum duration of the repeat.
+
+        Returns:
+            Mean time of a flatten in the repeat, also kept in times.
+        """
+        number = 0
+        elapsed = 0.0
+        while number == 0 or elapsed < min_seconds:
+            elapsed += self._flatten()
+            shutil.rmtree(os.path.join(self.work_dir, f"out{self.runs - 1}"))
+            number += 1
+        self.times.append(elapsed / number)
+        return self.times[-1]
+
+    def result(self) -> Dict[str, Any]:
+        """Measurements of the corpus, from its best repeat."""
+        input_bytes = sum(os.path.getsize(path) for path in self.sources)
+        seconds = min(self.times)
+        return {
+            "corpus": self.kind,
+            "scale": self.scale,
+            "files": len(self.sources),
+            "input_bytes": input_bytes,
+            "output_bytes": self.output_bytes,
+            "seconds": seconds,
+            "mb_per_s": input_bytes / 1e6 / seconds,
+            "files_per_s": len(self.sources) / seconds,
+            "peak_rss_kb": _peak_rss_kb(),
+            "calls": self.calls,
+        }
+
+    def close(self) -> None:
+        """Restore the working directory and remove the corpus."""
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def measure(
+    kind: str,
+    scale: float,
+    repeat: int,
+    min_seconds: float = MIN_SAMPLE_SECONDS,
+) -> Dict[str, Any]:
+    """Generate a corpus and flatten it repeatedly, in this process.
+
+    Args:
+        kind: Name of the corpus.
+        scale: Size multiplier of the corpus.
+        repeat: Number of timed repeats; the best one is reported.
+        min_seconds: Minimum duration of a repeat, which flattens the corpus
+            again until it is reached and is divided by the flattens made.
+
+    Returns:
+        Measurements of the corpus.
+    """
+    run = CorpusRun(kind, scale)
+    try:
+        for _ in range(repeat):
+            run.sample(min_seconds)
+        return run.result()
+    finally:
+        run.close()
+
+
+# Corpus of a worker process of run_all
+_worker_run: Optional[CorpusRun] = None
+
+
+def _start_worker(kind: str, scale: float) -> None:
+    """Generate the corpus of a worker process, keeping flatexpy quiet."""
+    global _worker_run
+    logging.getLogger("flatexpy.flatexpy_core").setLevel(logging.WARNING)
+    _worker_run = CorpusRun(kind, scale)
+
+
+def _sample_worker(min_seconds: float) -> float:
+    """Time one repeat of the corpus of a worker process."""
+    assert _worker_run is not None
+    return _worker_run.sample(min_seconds)
+
+
+def _finish_worker() -> Dict[str, Any]:
+    """Report and remove the corpus of a worker process."""
+    assert _worker_run is not None
+    try:
+        return _worker_run.result()
+    finally:
+        _worker_run.close()
+
+
+def run_all(kinds: List[str], scale: float, repeat: int) -> List[Dict[str, Any]]:
+    """Measure every corpus, each in a process of its own.
+
+    Repeats are interleaved across the corpora, one repeat of every corpus
+    after the other, so that a slow spell of the machine does not hit all
+    the repeats of one corpus.
+
+    Args:
+        kinds: Names of the corpora.
+        scale: Size multiplier of the corpora.
+        repeat: Number of timed repeats per corpus.
+
+    Returns:
+        Measurements of every corpus.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ExitStack() as stack:
+        executors = [
+            stack.enter_context(
+                ProcessPoolExecutor(
+                    max_workers=1,
+                    mp_context=context,
+                    initializer=_start_worker,
+                    initargs=(kind, scale),
+                )
+            )
+            for kind in kinds
+        ]
+        for _ in range(repeat):
+            for executor in executors:
+                executor.submit(_sample_worker, MIN_SAMPLE_SECONDS).result()
+        return [executor.submit(_finish_worker).result() for executor in executors]
+
+
+def compare(
+    results: List[Dict[str, Any]],
+    baseline: Dict[str, Any],
+    tolerance: float,
+    count_tolerance: float,
+) -> List[str]:
+    """Find the regressions of results against a baseline.
+
+    Args:
+        results: Measurements of the current run.
+        baseline: Saved report of a previous run.
+        tolerance: Allowed relative drop of throughput and growth of RSS.
+        count_tolerance: Allowed relative growth of file system calls.
+
+    Returns:
+        Description of every regression, empty if there is none.
+    """
+    previous = {result["corpus"]: result for result in baseline["results"]}
+    regressions: List[str] = []
+    for result in results:
+        base = previous.get(result["corpus"])
+        if base is None or base["scale"] != result["scale"]:
+            continue
+        name = result["corpus"]
+        for metric in ("mb_per_s", "files_per_s"):
+            if result[metric] < base[metric] * (1 - tolerance):
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.2f} < {base[metric]:.2f}"
+                )
+        if result["peak_rss_kb"] and base["peak_rss_kb"]:
+            if result["peak_rss_kb"] > base["peak_rss_kb"] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: peak_rss_kb {result['peak_rss_kb']} > "
+                    f"{base['peak_rss_kb']}"
+                )
+        for call, count in result["calls"].items():
+            allowed = base["calls"].get(call, 0) * (1 + count_tolerance)
+            if count > allowed:
+                regressions.append(
+                    f"{name}: {call} calls {count} > {base['calls'].get(call, 0)}"
+                )
+    return regressions
+
+
+def format_results(results: List[Dict[str, Any]]) -> str:
+    """Format measurements as a table."""
+    lines = [
+        f"{'corpus':<10} {'files':>6} {'MB':>8} {'seconds':>9} {'MB/s':>8} "
+        f"{'files/s':>9} {'RSS MiB':>8} {'open':>6} {'stat':>6} {'scandir':>8}"
+    ]
+    for result in results:
+        rss = result["peak_rss_kb"]
+        calls = result["calls"]
+        lines.append(
+            f"{result['corpus']:<10} {result['files']:>6} "
+            f"{result['input_bytes'] / 1e6:>8.2f} {result['seconds']:>9.4f} "
+            f"{result['mb_per_s']:>8.2f} {result['files_per_s']:>9.1f} "
+            f"{(rss / 1024 if rss else 0):>8.1f} {calls['open']:>6} "
+            f"{calls['stat'] + calls['lstat']:>6} {calls['scandir']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Benchmark flatexpy")
+    parser.add_argument(
+        "--corpus",
+        nargs="+",
+        choices=sorted(CORPORA),
+        default=list(CORPORA),
+        help="Corpora to measure (default: all)",
+    )
+    parser.add_argument("--scale", type=float, default=1.0, help="Size multiplier")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timed repeats per corpus (default: 5)"
+    )
+    parser.add_argument("--save", metavar="PATH", help="Save the report as JSON")
+    parser.add_argument(
+        "--compare", metavar="PATH", help="Fail on regressions against a baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.3,
+        help="Allowed relative drop of throughput or growth of RSS (default: 0.3)",
+    )
+    parser.add_argument(
+        "--count-tolerance",
+        type=float,
+        default=0.1,
+        help="Allowed relative growth of file system calls (default: 0.1)",
+    )
+    args = parser.parse_args()
+
+    results = run_all(args.corpus, args.scale, args.repeat)
+    print(format_results(results))
+
+    if args.save:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "min_sample_seconds": MIN_SAMPLE_SECONDS,
+            "copy_workers": COPY_WORKERS,
+            "discovery_workers": DISCOVERY_WORKERS,
+            "work_root": WORK_ROOT,
+            "results": results,
+        }
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"Saved report to {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.count_tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regression against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Measure how long importing flatexpy takes, and enforce a budget.
+
+The import is timed with ``python -X importtime`` in fresh interpreters,
+after a first run has written the bytecode cache, and the best of the runs
+is reported. Modules needed only by some commands (the server, batch mode,
+the asyncio API, the command line itself) must not be imported by it.
+
+Usage:
+    python -m benchmarks.startup --budget-ms 100
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict
+
+MODULE = "flatexpy.flatexpy_core"
+
+# Cumulative import time allowed for MODULE, in milliseconds
+STARTUP_BUDGET_MS = 100.0
+
+# Modules that importing MODULE must leave to the code paths needing them
+DEFERRED_MODULES = (
+    "argparse",
+    "asyncio",
+    "concurrent.futures",
+    "flatexpy.flatexpy_batch",
+    "flatexpy.flatexpy_server",
+    "getpass",
+    "hashlib",
+    "json",
+    "pathlib",
+    "shutil",
+    "socket",
+    "socketserver",
+    "tempfile",
+)
+
+
+def import_times(module: str = MODULE, pycache_dir: str = "") -> Dict[str, int]:
+    """Import a module in a fresh interpreter and time every import.
+
+    Args:
+        module: Module to import.
+        pycache_dir: Directory of the bytecode cache, the default one if empty.
+
+    Returns:
+        Cumulative import time in microseconds of every imported module.
+    """
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    if pycache_dir:
+        env["PYTHONPYCACHEPREFIX"] = pycache_dir
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times: Dict[str, int] = {}
+    for line in completed.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure_startup(repeat: int = 5, module: str = MODULE) -> Dict[str, int]:
+    """Time the import of a module, keeping the fastest run.
+
+    Args:
+        repeat: Number of timed runs, after one warm-up run.
+        module: Module to import.
+
+    Returns:
+        Import times of the fastest run, see import_times.
+    """
+    with tempfile.TemporaryDirectory() as pycache_dir:
+        import_times(module, pycache_dir)
+        runs = [import_times(module, pycache_dir) for _ in range(repeat)]
+    return min(runs, key=lambda times: times[module])
+
+
+def main() -> None:
+    """Main function."""
+    parser = argparse.ArgumentParser(description="Measure the import of flatexpy")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=STARTUP_BUDGET_MS,
+        help=f"Allowed import time in ms (default: {STARTUP_BUDGET_MS:g})",
+    )
+    args = parser.parse_args()
+
+    times = measure_startup(args.repeat)
+    total_ms = times[MODULE] / 1000
+    print(f"import {MODULE}: {total_ms:.1f} ms (budget {args.budget_ms:g} ms)")
+    imported = sorted(name for name in DEFERRED_MODULES if name in times)
+    failed = False
+    if imported:
+        print(f"FAIL imported at startup: {', '.join(imported)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print("FAIL over budget")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
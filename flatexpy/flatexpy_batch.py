@@ -0,0 +1,194 @@
+"""Batch mode of flatexpy: flatten many documents with worker processes.
+
+Imported by ``flatexpy --batch`` and by applications calling flatten_batch,
+so that importing flatexpy.flatexpy_core stays fast.
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, List, Optional
+
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    _create_output_dir,
+    _FlattenContext,
+    _flattened_file_name,
+)
+
+if TYPE_CHECKING:
+    import argparse
+
+
+@dataclass
+class BatchJob:
+    """A document to flatten in a batch."""
+
+    input_file: str
+    output_dir: str
+
+
+@dataclass
+class BatchResult:
+    """Outcome of flattening one document of a batch."""
+
+    input_file: str
+    output_file: str
+    ok: bool
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
+
+def load_batch_manifest(manifest_file: str) -> List[BatchJob]:
+    """Read the documents of a batch from a JSON manifest.
+
+    The manifest is a list of ``{"input": ..., "output": ...}`` objects.
+    output defaults to a ``flattened`` directory next to the input file, and
+    relative paths are relative to the manifest.
+
+    Args:
+        manifest_file: Path to the manifest.
+
+    Returns:
+        Documents of the batch, in order.
+
+    Raises:
+        LatexExpandError: If the manifest cannot be read or is malformed.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    try:
+        with open(manifest_file, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if not isinstance(entries, list):
+            raise ValueError("expected a list of documents")
+        jobs: List[BatchJob] = []
+        for entry in entries:
+            input_file = os.path.join(base_dir, entry["input"])
+            output_dir = entry.get(
+                "output", os.path.join(os.path.dirname(input_file), "flattened")
+            )
+            jobs.append(BatchJob(input_file, os.path.join(base_dir, output_dir)))
+        return jobs
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        raise LatexExpandError(f"Invalid batch manifest {manifest_file}: {e}") from e
+
+
+# Expander reused by all documents a batch worker process flattens
+_batch_expander: Optional[LatexExpander] = None
+
+
+def _init_batch_worker(config: LatexExpandConfig) -> None:
+    """Create the expander of a batch worker process."""
+    global _batch_expander
+    _batch_expander = LatexExpander(config)
+
+
+def _run_batch_job(job: BatchJob, overwrite: bool) -> BatchResult:
+    """Flatten one document of a batch in a worker.
+
+    Args:
+        job: Document to flatten.
+        overwrite: Whether an existing output directory may be reused.
+
+    Returns:
+        Outcome of the document; errors are reported, not raised.
+    """
+    assert _batch_expander is not None
+    output_file = _flattened_file_name(job.input_file, job.output_dir)
+    # Each document resolves its includes from its own directory
+    ctx = _FlattenContext(os.path.dirname(job.input_file) or ".", job.output_dir)
+    start = time.perf_counter()
+    try:
+        _create_output_dir(job.output_dir, overwrite)
+        _batch_expander._flatten_latex(ctx, job.input_file, output_file, False)
+    except (LatexExpandError, OSError) as e:
+        return BatchResult(
+            job.input_file, output_file, False, str(e), time.perf_counter() - start
+        )
+    return BatchResult(
+        job.input_file, output_file, True, None, time.perf_counter() - start
+    )
+
+
+def flatten_batch(
+    jobs: List[BatchJob],
+    config: Optional[LatexExpandConfig] = None,
+    processes: Optional[int] = None,
+    overwrite: bool = False,
+) -> List[BatchResult]:
+    """Flatten many documents, spread across a pool of worker processes.
+
+    Each worker reuses one LatexExpander for all its documents. A failing
+    document does not stop the batch; its error is part of its result.
+
+    Args:
+        jobs: Documents to flatten.
+        config: Configuration shared by all documents; root_directory is
+            replaced by the directory of each input file.
+        processes: Number of worker processes, the CPU count if None. With 1,
+            documents are flattened in the calling process.
+        overwrite: Whether existing output directories may be reused.
+
+    Returns:
+        Outcome of every document, in the order of jobs.
+    """
+    config = config or LatexExpandConfig()
+    for name in ("manifest_file", "trace_file"):
+        if getattr(config, name):
+            raise ValueError(f"{name} cannot be shared by the documents of a batch")
+    processes = processes or os.cpu_count() or 1
+
+    if processes <= 1 or len(jobs) <= 1:
+        _init_batch_worker(config)
+        return [_run_batch_job(job, overwrite) for job in jobs]
+
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(jobs)),
+        initializer=_init_batch_worker,
+        initargs=(config,),
+    ) as executor:
+        return list(
+            executor.map(
+                _run_batch_job,
+                jobs,
+                [overwrite] * len(jobs),
+                chunksize=max(1, len(jobs) // (processes * 4)),
+            )
+        )
+
+
+def _run_batch(args: "argparse.Namespace", config: LatexExpandConfig) -> None:
+    """Run the --batch command line mode.
+
+    Args:
+        args: Parsed command line arguments.
+        config: Configuration shared by all documents.
+    """
+    try:
+        jobs = load_batch_manifest(args.batch)
+    except LatexExpandError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    results = flatten_batch(jobs, config, args.jobs, args.force)
+    failed = [result for result in results if not result.ok]
+    for result in failed:
+        print(f"Error: {result.input_file}: {result.error}")
+    print(f"Flattened {len(results) - len(failed)} of {len(results)} documents")
+
+    if args.report:
+        report = {
+            "documents": len(results),
+            "succeeded": len(results) - len(failed),
+            "failed": len(failed),
+            "results": [asdict(result) for result in results],
+        }
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if failed:
+        sys.exit(1)
@@ -5,19 +5,48 @@ processing `input` and `include` commands, copying referenced graphics, and
 producing a single consolidated LaTeX file.
 """
 
-import argparse
+import codecs
+import contextlib
+import errno
+import io
 import logging
 import os
 import re
-import shutil
 import sys
-from dataclasses import dataclass, field
-from pathlib import Path
-from typing import List, Optional, Set, Tuple
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ContextManager,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+# Modules needed only by some commands are imported where they are used, so
+# that importing flatexpy and starting the command line stay fast
+if TYPE_CHECKING:
+    import argparse
+    import mmap
+    from concurrent.futures import Future, ThreadPoolExecutor
+    from pathlib import Path
 
 
 def _setup_logger() -> logging.Logger:
-    """Set up logging configuration."""
+    """Set up logging configuration of the command line.
+
+    As a library, flatexpy leaves handlers and levels to the application.
+    """
     _logger = logging.getLogger(__name__)
     _logger.setLevel(logging.INFO)
 
@@ -32,7 +61,16 @@ def _setup_logger() -> logging.Logger:
     return _logger
 
 
-logger = _setup_logger()
+logger = logging.getLogger(__name__)
+
+# Ways of materializing graphics files in the output directory
+GRAPHICS_MODES = ("copy", "hardlink", "reflink", "symlink")
+
+# How an existing destination is checked before copying a graphics file again
+SKIP_UNCHANGED_MODES = ("never", "mtime", "digest")
+
+# ioctl request cloning a file on copy-on-write filesystems (Linux FICLONE)
+_FICLONE = 0x40049409
 
 
 @dataclass
@@ -45,6 +83,671 @@ class LatexExpandConfig:
     ignore_commented_lines: bool = True
     root_directory: str = "."
     output_encoding: str = "utf-8"
+    copy_workers: int = 4
+    discovery_workers: int = 1
+    graphics_mode: str = "copy"
+    skip_unchanged: str = "mtime"
+    manifest_file: Optional[str] = None
+    cache_dir: Optional[str] = None
+    cache_max_bytes: int = 64 * 1024 * 1024
+    cache_max_age_days: float = 30.0
+    cache_min_bytes: int = 64 * 1024
+    trace_file: Optional[str] = None
+    mmap_threshold: int = 0
+    verbatim_patterns: List[str] = field(default_factory=list)
+    verbatim_min_bytes: int = 0
+
+    def __post_init__(self) -> None:
+        """Validate configuration values."""
+        if self.graphics_mode not in GRAPHICS_MODES:
+            raise ValueError(
+                f"graphics_mode should be one of {GRAPHICS_MODES} "
+                f":: got {self.graphics_mode}"
+            )
+        if self.skip_unchanged not in SKIP_UNCHANGED_MODES:
+            raise ValueError(
+                f"skip_unchanged should be one of {SKIP_UNCHANGED_MODES} "
+                f":: got {self.skip_unchanged}"
+            )
+        for name in ("cache_min_bytes", "mmap_threshold", "verbatim_min_bytes"):
+            if getattr(self, name) < 0:
+                raise ValueError(
+                    f"{name} should not be negative :: got {getattr(self, name)}"
+                )
+
+
+_Writer = Callable[[str], Any]
+"""Sink receiving the flattened document chunk by chunk."""
+
+
+# Version of the dependency manifest written for incremental runs
+_MANIFEST_VERSION = 2
+
+# Bytes of a memory-mapped file decoded at a time
+_MAPPED_CHUNK = 1 << 20
+
+# Encodings (by codec name) where every ASCII byte is the ASCII character, so
+# that commands can be found in the raw bytes of a file; ISO 8859 parts too
+_ASCII_COMPATIBLE_ENCODINGS = frozenset({"ascii", "utf-8", "cp1252"})
+
+# Whitespace str.lstrip() removes from the start of a line, in ASCII
+_LINE_INDENT_PATTERN = re.compile(rb"[ \t\x0b\x0c\x1c-\x1f]*")
+
+
+class _MappedText:
+    """A memory-mapped source file, decoded only span by span.
+
+    Offsets are byte offsets into the file. Spans are decoded with the
+    newline translation of files opened in text mode, so they read the same
+    as the corresponding part of the decoded file.
+    """
+
+    def __init__(
+        self,
+        data: "mmap.mmap",
+        encoding: str,
+        path: str = "",
+        stat: Optional[os.stat_result] = None,
+    ) -> None:
+        self.data = data
+        self.encoding = encoding
+        # File and state that was mapped, to copy spans from it in the kernel
+        self.path = path
+        self.stat = stat
+
+    def chunks(self, start: int, end: Optional[int] = None) -> Iterator[str]:
+        """Decode a span of the file a bounded chunk at a time.
+
+        Args:
+            start: Offset of the span.
+            end: End offset of the span, the end of the file if None.
+
+        Yields:
+            Decoded text of the span, in order.
+        """
+        end = len(self.data) if end is None else end
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(self.encoding)(), translate=True
+        )
+        for offset in range(start, end, _MAPPED_CHUNK):
+            stop = min(offset + _MAPPED_CHUNK, end)
+            text = decoder.decode(self.data[offset:stop], final=stop == end)
+            if text:
+                yield text
+
+    def decode(self, start: int, end: int) -> str:
+        """Decode a short span of the file."""
+        return "".join(self.chunks(start, end))
+
+    def newline_length(self, offset: int) -> int:
+        """Number of bytes of the line break at offset, 0 if there is none."""
+        if self.data[offset : offset + 2] == b"\r\n":
+            return 2
+        return 1 if self.data[offset : offset + 1] in (b"\n", b"\r") else 0
+
+    def line_start(self, offset: int) -> int:
+        """Offset of the start of the line containing offset."""
+        start = self.data.rfind(b"\n", 0, offset) + 1
+        # Look for a lone carriage return within the line only
+        return self.data.rfind(b"\r", start, offset) + 1 or start
+
+
+class _MappedMatch:
+    """A command found in the bytes of a memory-mapped file.
+
+    start() and end() of the whole match are byte offsets into the file, for
+    the include walker to cut the file around the command. Groups come from
+    the decoded command, so handlers see the same arguments and the same
+    offsets relative to the start of the command as with a decoded file.
+    """
+
+    def __init__(self, command: "re.Match[str]", start: int, end: int) -> None:
+        self.command = command
+        self.lastgroup = command.lastgroup
+        self._start = start
+        self._end = end
+
+    def start(self, group: Union[int, str] = 0) -> int:
+        """Offset of the command, or of a group shifted by it."""
+        return self._start + self.command.start(group)
+
+    def end(self, group: Union[int, str] = 0) -> int:
+        """End offset of the command, or of a group shifted by its start."""
+        if group == 0:
+            return self._end
+        return self._start + self.command.end(group)
+
+    def group(self, *groups: Union[int, str]) -> Any:
+        """Groups of the decoded command, as re.Match.group."""
+        return self.command.group(*groups)
+
+
+_CommandMatch = Union["re.Match[str]", _MappedMatch]
+"""A command found in a decoded buffer or in a memory-mapped file."""
+
+_RawWriter = Callable[[_MappedText, int, int], Any]
+"""Sink receiving a span of a memory-mapped file, copied without decoding."""
+
+# Buffers passed to one os.writev call, at most IOV_MAX on common systems
+_IOV_MAX = 1024
+
+# Bytes queued before they are written
+_SINK_FLUSH_BYTES = 1 << 20
+
+# Spans of mapped files at least this large are copied file to file
+_KERNEL_COPY_MIN = 1 << 16
+
+# Errors of os.copy_file_range and os.sendfile meaning "not for these files"
+_KERNEL_COPY_UNSUPPORTED = frozenset(
+    {
+        errno.EBADF,
+        errno.EINVAL,
+        errno.ENOSYS,
+        errno.ENOTSOCK,
+        errno.EOPNOTSUPP,
+        errno.EXDEV,
+    }
+)
+
+
+class _FileSink:
+    """Binary output file fed with text and with spans of mapped files.
+
+    Encoded text and short spans, as views of the mapping, are queued and
+    written together with os.writev. Long spans are copied from the source
+    file by the kernel with os.copy_file_range or os.sendfile, falling back
+    to plain writes where neither works.
+    """
+
+    def __init__(self, fd: int, encoding: str) -> None:
+        self._fd = fd
+        self._encoding = encoding
+        self._pending: List[Union[bytes, memoryview]] = []
+        self._pending_bytes = 0
+        self._kernel_copies = [
+            name for name in ("copy_file_range", "sendfile") if hasattr(os, name)
+        ]
+
+    def write(self, text: str) -> None:
+        """Queue encoded text."""
+        if text:
+            self._queue(text.encode(self._encoding))
+
+    def write_span(self, source: _MappedText, start: int, end: int) -> None:
+        """Write a span of a mapped file as it is."""
+        if end - start >= _KERNEL_COPY_MIN and self._kernel_copies:
+            self.flush()
+            if self._copy_from_file(source, start, end):
+                return
+        self._queue(memoryview(source.data)[start:end])
+
+    def _queue(self, data: Union[bytes, memoryview]) -> None:
+        self._pending.append(data)
+        self._pending_bytes += len(data)
+        if len(self._pending) >= _IOV_MAX or self._pending_bytes >= _SINK_FLUSH_BYTES:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write everything queued, in order."""
+        pending = self._pending
+        while pending:
+            written = os.writev(self._fd, pending[:_IOV_MAX])
+            # Drop what was written, keeping the rest of a partial buffer
+            while pending and written >= len(pending[0]):
+                written -= len(pending.pop(0))
+            if written:
+                pending[0] = memoryview(pending[0])[written:]
+        self._pending_bytes = 0
+
+    def _copy_from_file(self, source: _MappedText, start: int, end: int) -> bool:
+        """Copy a span from the file of a mapping, inside the kernel.
+
+        Args:
+            source: Mapped file.
+            start: Offset of the span.
+            end: End offset of the span.
+
+        Returns:
+            False if the span must be written from the mapping instead,
+            because the file cannot be opened again or changed since it
+            was mapped.
+        """
+        try:
+            in_fd = os.open(source.path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            stat = os.fstat(in_fd)
+            mapped = source.stat
+            if mapped is None or (stat.st_ino, stat.st_dev, stat.st_mtime_ns) != (
+                mapped.st_ino,
+                mapped.st_dev,
+                mapped.st_mtime_ns,
+            ):
+                return False
+            self._copy_span(source, in_fd, start, end)
+            return True
+        finally:
+            os.close(in_fd)
+
+    def _copy_span(self, source: _MappedText, in_fd: int, start: int, end: int) -> None:
+        """Copy a span of an open source file, falling back on failures.
+
+        Args:
+            source: Mapped file.
+            in_fd: Source file, opened again.
+            start: Offset of the span.
+            end: End offset of the span.
+        """
+        offset = start
+        while offset < end:
+            if not self._kernel_copies:
+                self._queue(memoryview(source.data)[offset:end])
+                return
+            try:
+                copied = self._kernel_copy(in_fd, offset, end)
+            except OSError as e:
+                if e.errno not in _KERNEL_COPY_UNSUPPORTED:
+                    raise
+                # Not for these files, use the next way from here on
+                self._kernel_copies.pop(0)
+                continue
+            if copied == 0:
+                raise LatexExpandError(f"{source.path} was truncated while copied")
+            offset += copied
+
+    def _kernel_copy(self, in_fd: int, start: int, end: int) -> int:
+        """Copy part of a span with the first working kernel copy.
+
+        Returns:
+            Number of bytes copied, 0 at the end of the file.
+        """
+        if self._kernel_copies[0] == "copy_file_range":
+            return os.copy_file_range(in_fd, self._fd, end - start, start)
+        return os.sendfile(self._fd, in_fd, start, end - start)
+
+
+@dataclass
+class _FileRecord:
+    """Output and dependencies of one flattened file, kept in the manifest.
+
+    pieces is the file's own output, with ``{"include": path}`` placeholders
+    where included files are spliced in and ``{"span": [start, end]}`` for
+    byte spans of a mapped file passed through as they are, which are read
+    from the file again when the record is reused. includes and graphics
+    record every lookup the output depends on, with its result.
+    """
+
+    path: str
+    size: int
+    mtime_ns: int
+    graphics_paths_in: List[str]
+    visited_in: int
+    graphics_paths_out: List[str] = field(default_factory=list)
+    pieces: List[Union[str, Dict[str, Any]]] = field(default_factory=list)
+    includes: List[Tuple[str, Optional[str]]] = field(default_factory=list)
+    graphics: List[Tuple[str, List[str], Optional[str]]] = field(default_factory=list)
+
+    def children(self) -> List[str]:
+        """Paths of the files spliced into this file, in order."""
+        return [
+            piece["include"]
+            for piece in self.pieces
+            if isinstance(piece, dict) and "include" in piece
+        ]
+
+
+@dataclass
+class _IncludeFrame:
+    """A source buffer on the include walker's stack."""
+
+    text: Union[str, _MappedText]
+    matches: Iterator[_CommandMatch]
+    closing: str = ""
+    pos: int = 0
+    record: Optional[_FileRecord] = None
+    # File of the buffer and when it was opened, for tracing
+    path: str = ""
+    started: float = 0.0
+
+    def emit(self, write: _Writer, text: str) -> None:
+        """Write output of this buffer, recording it for incremental runs."""
+        write(text)
+        if self.record is not None:
+            self.record.pieces.append(text)
+
+    def emit_until(self, ctx: "_FlattenContext", end: Optional[int] = None) -> None:
+        """Write the buffer from pos up to end, or up to its end if None.
+
+        Spans of a mapped file go to the raw sink of the context as they
+        are, unless they need newline translation, and are recorded by
+        their offsets.
+        """
+        text = self.text
+        if isinstance(text, str):
+            self.emit(ctx.write, text[self.pos : end])
+            return
+        end = len(text.data) if end is None else end
+        if ctx.write_raw is not None and text.data.find(b"\r", self.pos, end) < 0:
+            if end > self.pos:
+                ctx.write_raw(text, self.pos, end)
+                if self.record is not None:
+                    self.record.pieces.append({"span": [self.pos, end]})
+            return
+        for chunk in text.chunks(self.pos, end):
+            self.emit(ctx.write, chunk)
+
+    def skip_newline(self) -> None:
+        """Move pos past a line break, if the buffer has one at pos."""
+        if isinstance(self.text, str):
+            if self.text.startswith("\n", self.pos):
+                self.pos += 1
+        else:
+            self.pos += self.text.newline_length(self.pos)
+
+
+@dataclass
+class _DirectoryListing:
+    """Entries of a directory, to find graphics without a stat per candidate.
+
+    Names are matched exactly. A name differing from an entry only in case,
+    a symbolic link, which may dangle, and any name in a directory that
+    could not be listed are checked with os.path.exists instead, so lookups
+    resolve as probing every candidate did, on case-insensitive file
+    systems too.
+    """
+
+    names: FrozenSet[str] = frozenset()
+    links: FrozenSet[str] = frozenset()
+    readable: bool = True
+    folded: FrozenSet[str] = field(init=False)
+
+    def __post_init__(self) -> None:
+        self.folded = frozenset(name.casefold() for name in self.names)
+
+    def exists(self, directory: str, name: str) -> bool:
+        """Whether name exists in directory, as os.path.exists tells."""
+        if not self.readable:
+            return os.path.exists(os.path.join(directory, name))
+        if name in self.names:
+            return name not in self.links or os.path.exists(
+                os.path.join(directory, name)
+            )
+        return name.casefold() in self.folded and os.path.exists(
+            os.path.join(directory, name)
+        )
+
+
+@dataclass
+class _ScanResult:
+    """Commands found in a source file, as kept in the scan cache."""
+
+    offsets: List[int] = field(default_factory=list)
+    # Arguments of \\input and \\include, as written
+    includes: List[str] = field(default_factory=list)
+    graphics: List[str] = field(default_factory=list)
+    graphics_paths: List[str] = field(default_factory=list)
+
+
+@dataclass
+class _SourceFile:
+    """A source file read and scanned once, by discovery or by the walker."""
+
+    # Taken before the read; None when no feature needs it
+    stat: Optional[os.stat_result]
+    content: Union[str, _MappedText]
+    matches: Sequence[_CommandMatch]
+    scan: _ScanResult
+    # Include targets that exist, resolved by the discovery phase
+    includes: List[str] = field(default_factory=list)
+
+
+@dataclass
+class FlattenStats:
+    """Counters and timers of one flatten call, times in seconds.
+
+    Stages run by thread pools (discovery reads, graphics copies) add up the
+    time of every thread, so their time may exceed total_time.
+    """
+
+    total_time: float = 0.0
+    files_read: int = 0
+    files_mapped: int = 0
+    files_verbatim: int = 0
+    bytes_read: int = 0
+    read_time: float = 0.0
+    files_scanned: int = 0
+    scan_cache_hits: int = 0
+    scan_time: float = 0.0
+    files_reused: int = 0
+    includes_resolved: int = 0
+    includes_missing: int = 0
+    include_time: float = 0.0
+    graphics_lookups: int = 0
+    graphics_missing: int = 0
+    directory_scans: int = 0
+    lookup_time: float = 0.0
+    graphics_copied: int = 0
+    graphics_up_to_date: int = 0
+    bytes_copied: int = 0
+    copy_time: float = 0.0
+    output_writes: int = 0
+    chars_written: int = 0
+    bytes_passed_through: int = 0
+    write_time: float = 0.0
+
+    def summary(self) -> str:
+        """Format the statistics as a human-readable report."""
+        rows = [
+            ("Total", f"{self.total_time:.3f} s"),
+            (
+                "File reads",
+                f"{self.files_read} files ({self.files_mapped} mapped, "
+                f"{self.files_verbatim} verbatim), "
+                f"{self.bytes_read} bytes, "
+                f"{self.read_time:.3f} s",
+            ),
+            (
+                "Scanning",
+                f"{self.files_scanned} files ({self.scan_cache_hits} from cache), "
+                f"{self.scan_time:.3f} s",
+            ),
+            ("Reused files", f"{self.files_reused} files"),
+            (
+                "Includes",
+                f"{self.includes_resolved} resolved, {self.includes_missing} "
+                f"missing, {self.include_time:.3f} s",
+            ),
+            (
+                "Graphics lookups",
+                f"{self.graphics_lookups} lookups ({self.graphics_missing} "
+                f"missing), {self.directory_scans} directory scans, "
+                f"{self.lookup_time:.3f} s",
+            ),
+            (
+                "Graphics copies",
+                f"{self.graphics_copied} copied ({self.graphics_up_to_date} up to "
+                f"date), {self.bytes_copied} bytes, {self.copy_time:.3f} s",
+            ),
+            (
+                "Output writes",
+                f"{self.output_writes} writes, {self.chars_written} characters, "
+                f"{self.bytes_passed_through} bytes passed through, "
+                f"{self.write_time:.3f} s",
+            ),
+        ]
+        return "\n".join(f"{name:<17} {value}" for name, value in rows)
+
+
+@dataclass
+class FlattenResult:
+    """Outcome of a flatten call, with its statistics."""
+
+    output_file: str
+    content: str
+    stats: FlattenStats
+
+
+class _Tracer:
+    """Spans of a flatten call, saved in the Chrome trace event format.
+
+    Traces open in chrome://tracing, Perfetto or speedscope. Every span is a
+    complete ("X") event on the thread that ran it; the spans of a thread
+    nest by time, so files appear nested by include depth and graphics
+    copies show up on the threads of the copy pool.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty trace starting now."""
+        self._origin = time.perf_counter()
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Set[int] = set()
+        self._lock = threading.Lock()
+
+    def complete(
+        self,
+        name: str,
+        category: str,
+        start: float,
+        args: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Record a span ending now on the current thread.
+
+        Args:
+            name: Name of the span.
+            category: Category of the span, to filter in the viewer.
+            start: time.perf_counter() when the span started.
+            args: Details shown when the span is selected.
+        """
+        end = time.perf_counter()
+        thread_id = threading.get_native_id()
+        event: Dict[str, Any] = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": (start - self._origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": thread_id,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            if thread_id not in self._threads:
+                self._threads.add(thread_id)
+                self._events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": os.getpid(),
+                        "tid": thread_id,
+                        "args": {"name": threading.current_thread().name},
+                    }
+                )
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args: Any) -> Iterator[None]:
+        """Record the enclosed block as a span.
+
+        Args:
+            name: Name of the span.
+            category: Category of the span.
+            args: Details shown when the span is selected.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, args)
+
+    def save(self, trace_file: str) -> None:
+        """Write the trace to a JSON file.
+
+        Args:
+            trace_file: Path of the trace file.
+        """
+        import json
+
+        with self._lock:
+            trace = {"traceEvents": list(self._events), "displayTimeUnit": "ms"}
+        tmp_file = _create_temp_file(trace_file)
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(trace, f)
+            os.replace(tmp_file, trace_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+        logger.info("Trace written to: %s", trace_file)
+
+
+@dataclass
+class _FlattenContext:
+    """State of one flatten call.
+
+    Each call creates its own context and passes it down explicitly, so one
+    LatexExpander, which only holds configuration and compiled patterns,
+    can serve concurrent calls.
+    """
+
+    root_dir: str = "."
+    output_dir: str = "."
+    write: _Writer = field(default=lambda text: None)
+    # Output of spans of mapped files, when the sink takes raw bytes
+    write_raw: Optional[_RawWriter] = None
+    # Absolute path of the document, which is never verbatim
+    input_path: str = ""
+    visited_files: Set[str] = field(default_factory=set)
+    visited_digest: int = 0
+    graphics_paths: List[str] = field(default_factory=list)
+    collected_graphics: Set[str] = field(default_factory=set)
+    # Directory listings used to resolve graphics, filled lazily
+    dir_index: Dict[str, _DirectoryListing] = field(default_factory=dict)
+    # Listings kept across calls by a server, with the directory mtime_ns
+    shared_dir_index: Optional[Dict[str, Tuple[int, _DirectoryListing]]] = None
+    # Graphics copies running in the background, keyed by destination
+    copy_executor: Optional["ThreadPoolExecutor"] = None
+    pending_copies: Dict[str, Tuple[str, "Future[None]"]] = field(default_factory=dict)
+    # Graphics copies left to an asyncio caller, as (source, destination dir)
+    deferred_copies: Optional[List[Tuple[str, str]]] = None
+    # Incremental runs: records of the previous run and of the current one
+    keep_records: bool = False
+    previous_records: Dict[str, _FileRecord] = field(default_factory=dict)
+    records: Optional[Dict[str, _FileRecord]] = None
+    current_record: Optional[_FileRecord] = None
+    # Files read and scanned by the discovery phase
+    prefetched: Dict[str, _SourceFile] = field(default_factory=dict)
+    # Counters and timers, only collected when requested
+    stats: Optional[FlattenStats] = None
+    stats_lock: threading.Lock = field(default_factory=threading.Lock)
+    # Spans of the call, only collected when a trace file is configured
+    tracer: Optional[_Tracer] = None
+
+    def trace(self, name: str, category: str, **args: Any) -> ContextManager[None]:
+        """Record the enclosed block as a span, if the call is traced.
+
+        Args:
+            name: Name of the span.
+            category: Category of the span.
+            args: Details shown when the span is selected.
+        """
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, category, **args)
+
+    def add_stats(self, **amounts: float) -> None:
+        """Add to the statistics of the call, if they are collected.
+
+        Args:
+            amounts: Amount to add to each named FlattenStats field.
+        """
+        if self.stats is None:
+            return
+        # Discovery and copy workers update the statistics concurrently
+        with self.stats_lock:
+            for name, amount in amounts.items():
+                setattr(self.stats, name, getattr(self.stats, name) + amount)
 
 
 class LatexExpandError(Exception):
@@ -55,8 +758,34 @@ class GraphicsNotFoundError(LatexExpandError):
     """Raised when a graphics file cannot be found."""
 
 
+class GraphicsCopyError(LatexExpandError):
+    """Raised when one or more graphics files could not be copied."""
+
+    def __init__(self, failures: List[Tuple[str, BaseException]]) -> None:
+        """Initialize the error.
+
+        Args:
+            failures: Source path and error of every failed copy.
+        """
+        lines = [f"  {source}: {error}" for source, error in failures]
+        super().__init__(
+            f"Failed to copy {len(failures)} graphics file(s):\n" + "\n".join(lines)
+        )
+        self.failures = failures
+
+
+def _flattened_file_name(input_file: str, output_dir: str) -> str:
+    """Name the flattened file of a document in its output directory."""
+    from pathlib import Path
+
+    input_path = Path(input_file)
+    return os.path.join(output_dir, f"{input_path.stem}_flattened{input_path.suffix}")
+
+
 def _create_output_dir(output_dir: str, is_overwrite: bool) -> None:
     """create output directory if not exists"""
+    from pathlib import Path
+
     path = Path(output_dir)
     if is_overwrite or (not path.exists()):
         os.makedirs(path, exist_ok=True)
@@ -64,6 +793,328 @@ def _create_output_dir(output_dir: str, is_overwrite: bool) -> None:
         raise FileExistsError(f" Directory exists: {output_dir} :: {is_overwrite}")
 
 
+# Names tried for a temporary output file before giving up
+_TEMP_FILE_ATTEMPTS = 100
+
+
+def _create_temp_file(path: str) -> str:
+    """Create an empty file next to path, to be written and renamed over it.
+
+    The name is unique, so concurrent writers of one path never share a
+    temporary file. The file gets the permissions of the file it replaces,
+    or, like any new file, 0o666 less the umask, which the kernel applies
+    without the process umask being read or changed.
+
+    Args:
+        path: Path the temporary file is renamed to once written.
+
+    Returns:
+        Path of the temporary file.
+
+    Raises:
+        FileExistsError: If no unused name was found.
+    """
+    directory, name = os.path.split(path)
+    try:
+        mode: Optional[int] = os.stat(path).st_mode & 0o7777
+    except OSError:
+        mode = None
+    for _ in range(_TEMP_FILE_ATTEMPTS):
+        tmp_path = os.path.join(directory, f".{name}.{os.urandom(6).hex()}.part")
+        try:
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        except FileExistsError:
+            continue
+        os.close(fd)
+        if mode is not None:
+            try:
+                os.chmod(tmp_path, mode)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+        return tmp_path
+    raise FileExistsError(errno.EEXIST, "No unused temporary file name", path)
+
+
+def _default_cache_dir() -> str:
+    """Return the per-user scan cache directory ($XDG_CACHE_HOME/flatexpy)."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "flatexpy")
+
+
+# Version of the scan cache entries, part of every key
+_SCAN_CACHE_VERSION = 1
+
+
+@dataclass
+class ScanCacheStats:
+    """Contents of a scan cache directory and how an expander used it."""
+
+    directory: str
+    entries: int
+    total_bytes: int
+    # Lookups of the expander since it was created
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+# Age in seconds after which leftover temporary and lock files are removed
+_SCAN_CACHE_LEFTOVER_AGE = 60 * 60
+
+# Seconds between two updates of the last use time of an entry, so that most
+# hits only read the entry
+_SCAN_CACHE_TOUCH_INTERVAL = 60 * 60
+
+
+class _ScanCache:
+    """Scan results of source files persisted across runs.
+
+    Entries are JSON files keyed by the absolute path, size and modification
+    time of a source, so an edited file simply misses. Several processes may
+    share one directory: entries are written to a temporary file and renamed
+    into place, so readers never see a partial entry, and a file missing from
+    the cache is scanned under a lock of its own entry, so concurrent jobs
+    scan it once without serializing on a global lock. Entries are evicted by
+    age and then, oldest used first, by total size; the last use of an entry
+    is recorded at most once per _SCAN_CACHE_TOUCH_INTERVAL.
+    """
+
+    def __init__(
+        self, directory: str, max_bytes: int, max_age_days: float, fingerprint: str
+    ) -> None:
+        """Initialize the cache.
+
+        Args:
+            directory: Directory holding the entries, created on first store.
+            max_bytes: Total size above which the oldest entries are evicted.
+            max_age_days: Age in days after which an unused entry is evicted.
+            fingerprint: Everything besides the file that the scan depends on.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60
+        self._fingerprint = fingerprint
+        self._lock = threading.Lock()
+        self._stored = 0
+        self._counts: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0}
+
+    def count(self, name: str) -> None:
+        """Count a hit or a miss for the statistics."""
+        with self._lock:
+            self._counts[name] += 1
+
+    def _entry_path(self, abs_path: str, stat: os.stat_result) -> str:
+        """Path of the entry of a file in the state described by stat."""
+        import hashlib
+
+        parts = (self._fingerprint, abs_path, stat.st_size, stat.st_mtime_ns)
+        key = hashlib.sha256(
+            "\0".join(map(str, parts)).encode("utf-8", "surrogateescape")
+        ).hexdigest()
+        return os.path.join(self.directory, key[:2], key + ".json")
+
+    def load(self, abs_path: str, stat: os.stat_result) -> Optional[_ScanResult]:
+        """Look up the scan result of a file.
+
+        Args:
+            abs_path: Absolute path of the file.
+            stat: Stat of the file, taken before it was read.
+
+        Returns:
+            The cached scan result, or None on a miss or an unreadable entry.
+        """
+        import json
+
+        entry_path = self._entry_path(abs_path, stat)
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+                used = os.fstat(f.fileno()).st_mtime
+            if entry.pop("path") != abs_path:
+                return None
+            scan = _ScanResult(**entry)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logger.debug("Ignoring scan cache entry %s: %s", entry_path, e)
+            return None
+        if used < time.time() - _SCAN_CACHE_TOUCH_INTERVAL:
+            try:
+                # Mark the entry as recently used for size-based eviction
+                os.utime(entry_path)
+            except OSError:
+                pass
+        return scan
+
+    @contextlib.contextmanager
+    def entry_lock(self, abs_path: str, stat: os.stat_result) -> Iterator[None]:
+        """Hold the lock of a file's entry, across threads and processes.
+
+        Locking is best effort: without fcntl (Windows) or when the lock file
+        cannot be created, the caller goes on unlocked, which at worst scans
+        a file twice. The lock file is removed on release, once the entry it
+        guards is stored: jobs still waiting on it find the entry, and later
+        jobs find the entry before they lock.
+
+        Args:
+            abs_path: Absolute path of the file.
+            stat: Stat of the file, taken before it was read.
+        """
+        if sys.platform == "win32":
+            yield
+            return
+        import fcntl
+
+        lock_path = self._entry_path(abs_path, stat)[: -len(".json")] + ".lock"
+        fd: Optional[int] = None
+        try:
+            os.makedirs(os.path.dirname(lock_path), exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.debug("Failed to open scan cache lock %s: %s", lock_path, e)
+        try:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            if fd is not None:
+                self._remove_lock(lock_path, fd)
+                # closing the descriptor releases the lock
+                os.close(fd)
+
+    @staticmethod
+    def _remove_lock(lock_path: str, fd: int) -> None:
+        """Remove a held lock file, unless a later job already replaced it."""
+        try:
+            if os.path.samestat(os.stat(lock_path), os.fstat(fd)):
+                os.remove(lock_path)
+        except OSError:
+            pass
+
+    def store(self, abs_path: str, stat: os.stat_result, scan: _ScanResult) -> None:
+        """Save the scan result of a file, ignoring any error.
+
+        Args:
+            abs_path: Absolute path of the file.
+            stat: Stat of the file, taken before it was read.
+            scan: Scan result to save.
+        """
+        import json
+        import tempfile
+
+        entry_path = self._entry_path(abs_path, stat)
+        entry = {"path": abs_path, **asdict(scan)}
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(entry_path), suffix=".part"
+            )
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, entry_path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.debug("Failed to write scan cache entry %s: %s", entry_path, e)
+            return
+        with self._lock:
+            self._stored += 1
+            self._counts["stores"] += 1
+
+    def _files(self) -> Tuple[List[Tuple[float, int, str]], List[Tuple[float, str]]]:
+        """List the files of the cache directory.
+
+        Returns:
+            Last use time, size and path of every entry, and modification
+            time and path of every temporary or lock file.
+        """
+        entries: List[Tuple[float, int, str]] = []
+        leftovers: List[Tuple[float, str]] = []
+        try:
+            shards = [shard.path for shard in os.scandir(self.directory)]
+        except OSError:
+            return entries, leftovers
+        for shard in shards:
+            try:
+                files = [(entry, entry.stat()) for entry in os.scandir(shard)]
+            except OSError:
+                # removed by a concurrent eviction
+                continue
+            for entry, stat in files:
+                if entry.name.endswith(".json"):
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                elif entry.name.endswith((".part", ".lock")):
+                    leftovers.append((stat.st_mtime, entry.path))
+        return entries, leftovers
+
+    @staticmethod
+    def _remove(path: str) -> bool:
+        """Remove a cache file, which a concurrent job may have removed."""
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+    def evict(self, force: bool = False) -> int:
+        """Remove expired entries, then the least recently used ones until the
+        cache fits in max_bytes.
+
+        Args:
+            force: Also run if no entry was stored since the last eviction,
+                and remove temporary and lock files left behind by crashed
+                or finished jobs.
+
+        Returns:
+            Number of entries removed.
+        """
+        with self._lock:
+            if not (self._stored or force):
+                return 0
+            self._stored = 0
+        entries, leftovers = self._files()
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        now = time.time()
+        removed = 0
+        for used, size, path in entries:
+            if used >= now - self.max_age and total <= self.max_bytes:
+                break
+            if self._remove(path):
+                total -= size
+                removed += 1
+        if force:
+            for changed, path in leftovers:
+                if changed < now - _SCAN_CACHE_LEFTOVER_AGE:
+                    self._remove(path)
+        if removed:
+            logger.debug("Evicted %d scan cache entries", removed)
+        return removed
+
+    def stats(self) -> ScanCacheStats:
+        """Describe the cache directory and the lookups made so far."""
+        entries, _ = self._files()
+        with self._lock:
+            counts = dict(self._counts)
+        return ScanCacheStats(
+            self.directory,
+            len(entries),
+            sum(size for _, size, _ in entries),
+            **counts,
+        )
+
+
 class LatexExpander:
     """Handles LaTeX document flattening and graphics collection."""
 
@@ -73,21 +1124,54 @@ class LatexExpander:
         Args:
             config: Configuration object. If None, uses default configuration.
         """
+        import json
+
         self.config = config or LatexExpandConfig()
 
-        # Compiled regex patterns for better performance
-        self._input_pattern = re.compile(r"\\(input|include)\{([^}]+)\}")
-        self._graphicspath_pattern = re.compile(r"\\graphicspath\{((\{[^}]+\})+)\}")
-        self._includegraphics_pattern = re.compile(
-            r"\\includegraphics(?:\[[^\]]*\])?\{([^}]+)\}"
+        # Single compiled pattern matching every command flatexpy rewrites, so
+        # each source is scanned once. The named argument group of each
+        # alternative doubles as the handler key (see ``match.lastgroup``).
+        self._command_pattern = re.compile(
+            r"\\(?:includegraphics(?:\[[^\]]*\])?\{(?P<graphic>[^}]+)\}"
+            r"|graphicspath\{(?P<graphicspath>(?:\{[^}]+\})+)\}"
+            r"|(?P<cmd>input|include)\{(?P<include>[^}]+)\})"
         )
+        # The same pattern for the raw bytes of memory-mapped files
+        self._byte_pattern: Optional["re.Pattern[bytes]"] = None
+        codec_name = codecs.lookup(self.config.output_encoding).name
+        self._ascii_compatible = (
+            codec_name in _ASCII_COMPATIBLE_ENCODINGS
+            or codec_name.startswith("iso8859-")
+        )
+        if self.config.mmap_threshold and self._ascii_compatible:
+            self._byte_pattern = re.compile(
+                self._command_pattern.pattern.encode("ascii")
+            )
+        # \\input and \\include are structural and handled by the walker itself
+        self._handlers: Dict[
+            str, Callable[[_FlattenContext, _CommandMatch], Optional[str]]
+        ] = {
+            "graphicspath": self._handle_graphicspath,
+            "graphic": self._handle_includegraphics,
+        }
+        self._scan_cache: Optional[_ScanCache] = None
+        if self.config.cache_dir:
+            fingerprint = json.dumps(
+                [
+                    _SCAN_CACHE_VERSION,
+                    self._command_pattern.pattern,
+                    self.config.ignore_commented_lines,
+                    self.config.output_encoding,
+                ]
+            )
+            self._scan_cache = _ScanCache(
+                os.path.expanduser(self.config.cache_dir),
+                self.config.cache_max_bytes,
+                self.config.cache_max_age_days,
+                fingerprint,
+            )
 
-        # State tracking
-        self._visited_files: Set[str] = set()
-        self._graphics_paths: List[str] = []
-        self._collected_graphics: Set[str] = set()
-
-    def _resolve_file_path(self, file_path: str) -> Path:
+    def _resolve_file_path(self, file_path: str) -> "Path":
         """Resolve file path and check existence.
 
         Args:
@@ -99,6 +1183,8 @@ class LatexExpander:
         Raises:
             FileNotFoundError: If file doesn't exist.
         """
+        from pathlib import Path
+
         path = Path(file_path)
         if not path.exists():
             # Try adding .tex extension
@@ -121,20 +1207,15 @@ class LatexExpander:
         """
         return line.lstrip().startswith("%")
 
-    def _extract_graphics_paths(self, line: str) -> List[str]:
-        """Extract graphics paths from \\graphicspath command.
+    def _extract_graphics_paths(self, paths_str: str) -> List[str]:
+        """Extract graphics paths from the argument of \\graphicspath.
 
         Args:
-            line: Line to parse.
+            paths_str: Argument of the command, e.g. ``{figures/}{images/}``.
 
         Returns:
             List of extracted paths.
         """
-        match = self._graphicspath_pattern.search(line)
-        if not match:
-            return []
-
-        paths_str = match.group(1)
         paths = re.findall(r"\{([^}]+)\}", paths_str)
         return [os.path.normpath(path) for path in paths]
 
@@ -157,239 +1238,2091 @@ class LatexExpander:
             candidate_with_ext = filename
         return candidate_with_ext
 
-    def _find_graphics_file(self, graphic_name: str, search_dir: str) -> Optional[str]:
-        """Find graphics file with possible extensions.
+    def _list_directory(
+        self, ctx: _FlattenContext, directory: str
+    ) -> _DirectoryListing:
+        """List the entries of a directory, scanning it once per run.
 
         Args:
-            graphic_name: Name of graphics file (may be without extension).
-            search_dir: Directory to search in.
+            ctx: State of the flatten call.
+            directory: Directory to list.
 
         Returns:
-            Full path to graphics file if found, None otherwise.
+            Entries of the directory, no entries if it does not exist.
         """
-        search_paths: List[str] = [search_dir] + self._graphics_paths
-
-        for search_path in search_paths:
-            candidate = os.path.join(search_path, graphic_name)
-            for ext in self.config.graphic_extensions:
-                candidate_with_ext = self._add_extension_to_filename(candidate, ext)
-                if os.path.exists(candidate_with_ext):
-                    return candidate_with_ext
-        logger.warning("No graphic file found :: %s", graphic_name)
-        return None
-
-    def _copy_graphics_file(self, source_path: str, dest_dir: str) -> None:
-        """Copy graphics file to root directory.
+        key = os.path.normpath(directory)
+        entries = ctx.dir_index.get(key)
+        if entries is None:
+            entries = self._scan_directory(ctx, key)
+            ctx.dir_index[key] = entries
+        return entries
+
+    def _scan_directory(
+        self, ctx: _FlattenContext, directory: str
+    ) -> _DirectoryListing:
+        """List the entries of a directory, reusing a listing shared across
+        calls while the directory's mtime is unchanged.
 
         Args:
-            source_path: Source path of graphics file.
-            dest_dir: Destination directory to copy to.
-        """
-        if source_path in self._collected_graphics:
-            return
-
-        filename: str = os.path.basename(source_path)
-        dest_path: str = os.path.join(dest_dir, filename)
+            ctx: State of the flatten call.
+            directory: Normalized directory to list.
 
+        Returns:
+            Entries of the directory, no entries if it does not exist, and
+            an unreadable listing if it cannot be listed for another reason.
+        """
+        shared = ctx.shared_dir_index
+        mtime_ns: Optional[int] = None
         try:
-            shutil.copy2(source_path, dest_path)
-            self._collected_graphics.add(source_path)
-            logger.info("Copied graphics: %s -> %s", source_path, dest_path)
-        except IOError as e:
-            raise LatexExpandError(f"Failed to copy graphics file: {e}") from e
-
-    def _process_includegraphics(
-        self, line: str, root_dir: str, output_dir: str
-    ) -> str:
-        """Process \\includegraphics commands in a line.
-
-        Args:
-            line: Line to process.
-            current_dir: Current directory context.
-            output_dir: Output directory for copying files.
-        """
-        match = self._includegraphics_pattern.search(line)
-        if not match:
-            return line
-        graphic_name: str = match.group(1)
-        graphics_path = self._find_graphics_file(graphic_name, root_dir)
-        if graphics_path:
-            filename: str = os.path.basename(graphics_path)
-            self._copy_graphics_file(graphics_path, output_dir)
-            line = line.replace(graphic_name, filename)
-            return line
-        logger.warning("Graphics file not found: \\includegraphics{%s}", graphic_name)
-        return line
-
-    def _process_input_include(
-        self,
-        line: str,
-        root_dir: str,
-        output_dir: str,
-    ) -> Tuple[str, bool]:
-        """Process \\input or \\include commands.
+            if shared is not None:
+                # stat before listing, so a concurrent change invalidates it
+                mtime_ns = os.stat(directory).st_mtime_ns
+                cached = shared.get(directory)
+                if cached is not None and cached[0] == mtime_ns:
+                    return cached[1]
+            ctx.add_stats(directory_scans=1)
+            names: Set[str] = set()
+            links: Set[str] = set()
+            with os.scandir(directory) as it:
+                for entry in it:
+                    names.add(entry.name)
+                    if entry.is_symlink():
+                        links.add(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return _DirectoryListing()
+        except OSError:
+            return _DirectoryListing(readable=False)
+        listing = _DirectoryListing(frozenset(names), frozenset(links))
+        if shared is not None and mtime_ns is not None:
+            shared[directory] = (mtime_ns, listing)
+        return listing
+
+    def _lookup_graphics(
+        self, ctx: _FlattenContext, graphic_name: str, search_paths: List[str]
+    ) -> Optional[str]:
+        """Look a graphics file up in the directory index.
 
         Args:
-            line: Line to process.
-            root_dir: Root directory.
-            output_dir: Output directory.
+            ctx: State of the flatten call.
+            graphic_name: Name of graphics file (may be without extension).
+            search_paths: Directories to search in, by priority.
 
         Returns:
-            Tuple of (processed_content, was_processed).
+            Full path to graphics file if found, None otherwise.
         """
-        match = self._input_pattern.search(line)
-        if not match:
-            return line, False
-
-        cmd, relative_path = match.groups()
-        include_path = os.path.join(root_dir, relative_path)
+        for search_path in search_paths:
+            candidate = os.path.join(search_path, graphic_name)
+            directory, stem = os.path.split(candidate)
+            listing = self._list_directory(ctx, directory)
+            for ext in self.config.graphic_extensions:
+                if listing.exists(
+                    directory, self._add_extension_to_filename(stem, ext)
+                ):
+                    return self._add_extension_to_filename(candidate, ext)
+        return None
 
-        if not include_path.endswith(".tex"):
-            include_path += ".tex"
+    def _find_graphics_file(
+        self, ctx: _FlattenContext, graphic_name: str, search_dir: str
+    ) -> Optional[str]:
+        """Find graphics file with possible extensions.
 
-        try:
-            resolved_path = self._resolve_file_path(include_path)
-            logger.info("Processing %s: %s", cmd, include_path)
+        Candidates are looked up in an index of directory listings instead of
+        being checked with one stat call each, see _DirectoryListing.
 
-            included_content = self._flatten_file(
-                str(resolved_path), root_dir, output_dir
-            )
+        Args:
+            ctx: State of the flatten call.
+            graphic_name: Name of graphics file (may be without extension).
+            search_dir: Directory to search in.
 
-            result = (
-                f"% >>> {cmd}{{{relative_path}}} >>>\n"
-                f"{included_content}"
-                f"% <<< {cmd}{{{relative_path}}} <<<\n"
+        Returns:
+            Full path to graphics file if found, None otherwise.
+        """
+        start = time.perf_counter()
+        search_paths: List[str] = [search_dir] + ctx.graphics_paths
+        with ctx.trace(f"lookup {graphic_name}", "graphics", paths=search_paths):
+            graphics_path = self._lookup_graphics(ctx, graphic_name, search_paths)
+        ctx.add_stats(
+            graphics_lookups=1,
+            graphics_missing=graphics_path is None,
+            lookup_time=time.perf_counter() - start,
+        )
+        if ctx.current_record is not None:
+            ctx.current_record.graphics.append(
+                (graphic_name, search_paths, graphics_path)
             )
-            return result, True
-
-        except FileNotFoundError:
-            logger.warning(" Failed to process input, File not found: %s", include_path)
-            return line, False
+        if graphics_path is None:
+            logger.warning("No graphic file found :: %s", graphic_name)
+        return graphics_path
 
-    def _read_file(self, file_path: str) -> List[str]:
-        """Read a file to list of lines
+    def _file_digest(self, file_path: str) -> str:
+        """Compute the SHA-256 digest of a file.
 
         Args:
-            file_path: File path to be read.
+            file_path: File to hash.
 
         Returns:
-            List of lines.
+            Hex digest of the content.
         """
-        try:
-            with open(file_path, "r", encoding=self.config.output_encoding) as f:
-                lines = f.readlines()
-        except IOError as e:
-            raise LatexExpandError(f"Failed to read file {file_path}: {e}") from e
-        return lines
+        import hashlib
+
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _is_graphics_up_to_date(self, source_path: str, dest_path: str) -> bool:
+        """Check whether dest_path already holds source_path, like rsync.
 
-    def _update_graphics_path(self, line: str) -> None:
-        """Update self._graphics_path from line.
+        Links are up to date when they point to the source. Copies are
+        compared by size plus modification time, or by content digest.
 
         Args:
-            line: Content to be parsed.
+            source_path: Source path of graphics file.
+            dest_path: Destination path.
 
         Returns:
-            None
+            True if copying again can be skipped.
         """
-        new_graphics_paths = self._extract_graphics_paths(line)
-        for path in new_graphics_paths:
-            if path not in self._graphics_paths:
-                self._graphics_paths.append(path)
-        if new_graphics_paths:
-            logger.info("Updated graphics paths: %s", self._graphics_paths)
-
-    def _flatten_file(self, file_path: str, root_dir: str, output_dir: str) -> str:
-        """Flatten a single LaTeX file.
+        check = self.config.skip_unchanged
+        if check == "never":
+            return False
+        try:
+            if self.config.graphics_mode == "symlink":
+                return os.readlink(dest_path) == os.path.abspath(source_path)
+            if self.config.graphics_mode == "hardlink":
+                return os.path.samefile(source_path, dest_path)
+            if os.path.islink(dest_path):
+                return False
+            source_stat = os.stat(source_path)
+            dest_stat = os.stat(dest_path)
+            # A hard link left by another mode is not a copy, it follows edits
+            if os.path.samestat(source_stat, dest_stat):
+                return False
+            if source_stat.st_size != dest_stat.st_size:
+                return False
+            if check == "mtime":
+                return source_stat.st_mtime_ns == dest_stat.st_mtime_ns
+            return self._file_digest(source_path) == self._file_digest(dest_path)
+        except OSError:
+            return False
+
+    def _reflink_file(self, source_path: str, dest_path: str) -> bool:
+        """Clone a file on a copy-on-write filesystem.
 
         Args:
-            file_path: Path to file to flatten.
-            root_dir: Root directory.
-            output_dir: Output directory.
+            source_path: Source path of graphics file.
+            dest_path: Destination path.
 
         Returns:
-            Flattened content as string.
+            True if the file was cloned, False if cloning is unsupported.
         """
-        abs_path: str = os.path.abspath(file_path)
-        if abs_path in self._visited_files:
-            logger.info("Skipping already included file: %s", file_path)
-            return ""
-        self._visited_files.add(abs_path)
+        import shutil
 
-        # read a file
-        lines = self._read_file(file_path)
+        if not sys.platform.startswith("linux"):
+            return False
+        import fcntl
 
-        flattened_content: List[str] = []
+        try:
+            with open(source_path, "rb") as src, open(dest_path, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        except OSError:
+            return False
+        shutil.copystat(source_path, dest_path)
+        return True
 
-        for line in lines:
-            # Skip commented lines if configured
-            if self.config.ignore_commented_lines and self._is_line_commented(line):
-                flattened_content.append(line)
-                continue
+    @staticmethod
+    def _replace_with_copy(source_path: str, dest_path: str) -> None:
+        """Copy a file to a temporary name and rename it over dest_path.
 
-            # Process graphics paths
-            self._update_graphics_path(line)
+        A symlink or hard link at dest_path, left by another graphics mode,
+        is replaced instead of written through, so the file it points to
+        is never modified.
 
-            # Process includegraphics and update line
-            line = self._process_includegraphics(line, root_dir, output_dir)
+        Args:
+            source_path: Source path of graphics file.
+            dest_path: Destination path.
+        """
+        import shutil
+        import tempfile
 
-            # Process input/include
-            processed_line, _ = self._process_input_include(line, root_dir, output_dir)
-            flattened_content.append(processed_line)
+        directory, name = os.path.split(dest_path)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f".{name}.", suffix=".part", dir=directory or "."
+        )
+        os.close(fd)
+        try:
+            shutil.copy2(source_path, tmp_path)
+            os.replace(tmp_path, dest_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
 
-        return "".join(flattened_content)
+    def _materialize_graphics_file(self, source_path: str, dest_path: str) -> None:
+        """Make a graphics file available at dest_path per graphics_mode.
 
-    def flatten_latex(self, input_file: str, output_file: str) -> str:
-        """Flatten a LaTeX document.
+        Links and clones fall back to a plain copy when the filesystem does
+        not support them. Whatever was at dest_path is replaced, never
+        written through.
 
         Args:
-            input_file: Path to input LaTeX file.
-            output_file: Path to output file. If None, returns content only.
-
-        Returns:
-            Flattened LaTeX content.
-
-        Raises:
-            LatexExpandError: If flattening fails.
+            source_path: Source path of graphics file.
+            dest_path: Destination path.
         """
-        try:
-            input_path = self._resolve_file_path(input_file)
-            root_dir = self.config.root_directory
-            output_dir: str = os.path.split(output_file)[0]
+        mode = self.config.graphics_mode
+        if mode == "copy":
+            self._replace_with_copy(source_path, dest_path)
+            return
 
-            # Reset state for new operation
-            self._visited_files.clear()
-            self._graphics_paths.clear()
-            self._collected_graphics.clear()
+        if os.path.lexists(dest_path):
+            source_dir, name = os.path.split(source_path)
+            dest_dir, dest_name = os.path.split(dest_path)
+            if name == dest_name and os.path.samefile(
+                source_dir or ".", dest_dir or "."
+            ):
+                # The output directory holds the source itself
+                return
+            os.remove(dest_path)
+
+        if mode == "symlink":
+            os.symlink(os.path.abspath(source_path), dest_path)
+            return
+        if mode == "hardlink":
+            try:
+                os.link(source_path, dest_path)
+                return
+            except OSError as e:
+                logger.debug("Hard link failed, copying instead: %s", e)
+        elif self._reflink_file(source_path, dest_path):
+            return
+        self._replace_with_copy(source_path, dest_path)
+
+    def _copy_graphics_file(
+        self, ctx: _FlattenContext, source_path: str, dest_dir: str
+    ) -> None:
+        """Copy graphics file to root directory.
+
+        Depending on graphics_mode the file is copied, hard linked, cloned
+        or symlinked.
+
+        Args:
+            ctx: State of the flatten call.
+            source_path: Source path of graphics file.
+            dest_dir: Destination directory to copy to.
+        """
+        if source_path in ctx.collected_graphics:
+            return
+
+        filename: str = os.path.basename(source_path)
+        dest_path: str = os.path.join(dest_dir, filename)
+
+        with ctx.trace(f"copy {filename}", "graphics", source=source_path):
+            self._copy_to_destination(ctx, source_path, dest_path)
+
+    def _copy_to_destination(
+        self, ctx: _FlattenContext, source_path: str, dest_path: str
+    ) -> None:
+        """Materialize a graphics file unless its destination is up to date.
+
+        Args:
+            ctx: State of the flatten call.
+            source_path: Source path of graphics file.
+            dest_path: Destination path.
+        """
+        start = time.perf_counter()
+        if self._is_graphics_up_to_date(source_path, dest_path):
+            ctx.collected_graphics.add(source_path)
+            ctx.add_stats(graphics_up_to_date=1, copy_time=time.perf_counter() - start)
+            logger.info("Graphics up to date: %s", dest_path)
+            return
+
+        try:
+            self._materialize_graphics_file(source_path, dest_path)
+            ctx.collected_graphics.add(source_path)
+            if ctx.stats is not None:
+                ctx.add_stats(
+                    graphics_copied=1,
+                    bytes_copied=os.path.getsize(source_path),
+                    copy_time=time.perf_counter() - start,
+                )
+            logger.info(
+                "Copied graphics (%s): %s -> %s",
+                self.config.graphics_mode,
+                source_path,
+                dest_path,
+            )
+        except IOError as e:
+            raise LatexExpandError(f"Failed to copy graphics file: {e}") from e
+
+    def _schedule_graphics_copy(
+        self, ctx: _FlattenContext, source_path: str, dest_dir: str
+    ) -> None:
+        """Copy a graphics file, in the background if a worker pool is running.
+
+        Args:
+            ctx: State of the flatten call.
+            source_path: Source path of graphics file.
+            dest_dir: Destination directory to copy to.
+        """
+        if ctx.deferred_copies is not None:
+            ctx.deferred_copies.append((source_path, dest_dir))
+            return
+        if ctx.copy_executor is None:
+            self._copy_graphics_file(ctx, source_path, dest_dir)
+            return
+
+        dest_path = os.path.join(dest_dir, os.path.basename(source_path))
+        pending = ctx.pending_copies.get(dest_path)
+        if pending is not None:
+            if pending[0] == source_path:
+                return
+            # Another source with the same name: keep the document order
+            pending[1].exception()
+        future = ctx.copy_executor.submit(
+            self._copy_graphics_file, ctx, source_path, dest_dir
+        )
+        ctx.pending_copies[dest_path] = (source_path, future)
+
+    def _wait_for_graphics_copies(self, ctx: _FlattenContext) -> None:
+        """Wait for background graphics copies to finish.
+
+        Args:
+            ctx: State of the flatten call.
+
+        Raises:
+            GraphicsCopyError: If any of the copies failed.
+        """
+        failures: List[Tuple[str, BaseException]] = []
+        for source_path, future in ctx.pending_copies.values():
+            error = future.exception()
+            if error is not None:
+                failures.append((source_path, error))
+        ctx.pending_copies.clear()
+        if failures:
+            raise GraphicsCopyError(failures)
+
+    def _handle_includegraphics(
+        self, ctx: _FlattenContext, match: _CommandMatch
+    ) -> Optional[str]:
+        """Handle a matched \\includegraphics command.
+
+        Args:
+            ctx: State of the flatten call.
+            match: Match of the command.
+
+        Returns:
+            Command with the graphics name rewritten, or None if not found.
+        """
+        graphic_name: str = match.group("graphic")
+        graphics_path = self._find_graphics_file(ctx, graphic_name, ctx.root_dir)
+        if not graphics_path:
+            logger.warning(
+                "Graphics file not found: \\includegraphics{%s}", graphic_name
+            )
+            return None
+        filename: str = os.path.basename(graphics_path)
+        self._schedule_graphics_copy(ctx, graphics_path, ctx.output_dir)
+        start = match.start("graphic") - match.start()
+        end = match.end("graphic") - match.start()
+        command = match.group(0)
+        return command[:start] + filename + command[end:]
+
+    def _include_path(self, ctx: _FlattenContext, relative_path: str) -> str:
+        """Build the path of the file targeted by \\input or \\include.
+
+        Args:
+            ctx: State of the flatten call.
+            relative_path: Argument of the command.
+
+        Returns:
+            Path of the included file, with the .tex extension.
+        """
+        include_path = os.path.join(ctx.root_dir, relative_path)
+        if not include_path.endswith(".tex"):
+            include_path += ".tex"
+        return include_path
+
+    def _resolve_include(
+        self, ctx: _FlattenContext, match: _CommandMatch
+    ) -> Optional[str]:
+        """Resolve the file targeted by a matched \\input or \\include command.
+
+        Args:
+            ctx: State of the flatten call.
+            match: Match of the command.
+
+        Returns:
+            Path of the included file, or None if not found.
+        """
+        start = time.perf_counter()
+        cmd, relative_path = match.group("cmd", "include")
+        include_path = self._include_path(ctx, relative_path)
+
+        try:
+            resolved_path: Optional[str] = str(self._resolve_file_path(include_path))
+        except FileNotFoundError:
+            resolved_path = None
+        ctx.add_stats(
+            includes_resolved=resolved_path is not None,
+            includes_missing=resolved_path is None,
+            include_time=time.perf_counter() - start,
+        )
+        if ctx.current_record is not None:
+            ctx.current_record.includes.append((include_path, resolved_path))
+
+        if resolved_path is None:
+            logger.warning(" Failed to process input, File not found: %s", include_path)
+            return None
+        logger.info("Processing %s: %s", cmd, include_path)
+        return resolved_path
+
+    def _read_file(self, file_path: str) -> str:
+        """Read a whole file into a single buffer.
+
+        Args:
+            file_path: File path to be read.
+
+        Returns:
+            Content of the file.
+        """
+        try:
+            with open(file_path, "r", encoding=self.config.output_encoding) as f:
+                content = f.read()
+        except IOError as e:
+            raise LatexExpandError(f"Failed to read file {file_path}: {e}") from e
+        return content
+
+    def _handle_graphicspath(
+        self, ctx: _FlattenContext, match: _CommandMatch
+    ) -> Optional[str]:
+        """Update the graphics paths from a matched \\graphicspath command.
+
+        Args:
+            ctx: State of the flatten call.
+            match: Match of the command.
+
+        Returns:
+            None, the command is kept as is.
+        """
+        new_graphics_paths = self._extract_graphics_paths(match.group("graphicspath"))
+        for path in new_graphics_paths:
+            if path not in ctx.graphics_paths:
+                ctx.graphics_paths.append(path)
+        if new_graphics_paths:
+            logger.info("Updated graphics paths: %s", ctx.graphics_paths)
+        return None
+
+    def _scan_commands(self, text: str) -> Iterator["re.Match[str]"]:
+        """Find the commands to process in a whole buffer.
+
+        Args:
+            text: Content to scan.
+
+        Yields:
+            Matches of the command pattern, in order of appearance.
+        """
+        for match in self._command_pattern.finditer(text):
+            if self.config.ignore_commented_lines:
+                line_start = text.rfind("\n", 0, match.start()) + 1
+                if self._is_line_commented(text[line_start : match.start()]):
+                    continue
+            yield match
+
+    def _open_file_frame(
+        self, ctx: _FlattenContext, file_path: str, closing: str
+    ) -> Optional[_IncludeFrame]:
+        """Read a file and prepare it for the include walker.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to flatten.
+            closing: Text written once the file is fully expanded.
+
+        Returns:
+            Frame of the file, or None if it was already included.
+        """
+        abs_path: str = os.path.abspath(file_path)
+        if abs_path in ctx.visited_files:
+            logger.info("Skipping already included file: %s", file_path)
+            return None
+
+        started = time.perf_counter()
+        source = ctx.prefetched.pop(abs_path, None)
+        if source is None:
+            source = self._read_source(ctx, file_path)
+        record: Optional[_FileRecord] = None
+        if ctx.records is not None:
+            assert source.stat is not None
+            record = _FileRecord(
+                abs_path,
+                source.stat.st_size,
+                source.stat.st_mtime_ns,
+                list(ctx.graphics_paths),
+                ctx.visited_digest,
+            )
+        self._mark_visited(ctx, abs_path)
+
+        # expand the file as a single buffer
+        return _IncludeFrame(
+            source.content,
+            iter(source.matches),
+            closing,
+            0,
+            record,
+            file_path,
+            started,
+        )
+
+    def _read_source(self, ctx: _FlattenContext, file_path: str) -> _SourceFile:
+        """Read a file and find the commands to process in it.
+
+        The scan is taken from the scan cache when the file did not change
+        since it was stored there.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to read.
+
+        Returns:
+            The read and scanned file.
+        """
+        stat: Optional[os.stat_result] = None
+        if any(x is not None for x in (ctx.records, self._scan_cache, ctx.stats)) or (
+            self._byte_pattern is not None or self.config.verbatim_min_bytes
+        ):
+            # stat before reading, so a concurrent edit invalidates the record
+            stat = os.stat(file_path)
+        if self._is_verbatim(ctx, file_path, stat):
+            return self._read_verbatim(ctx, file_path, stat)
+        if stat is not None and self._is_mapped(stat):
+            return self._read_mapped_source(ctx, file_path, stat)
+        start = time.perf_counter()
+        with ctx.trace("read", "io", path=file_path):
+            content = self._read_file(file_path)
+        read = time.perf_counter()
+        matches: Sequence[_CommandMatch]
+        with ctx.trace("scan", "scan", path=file_path):
+            if (
+                self._scan_cache is None
+                or stat is None
+                or stat.st_size < self.config.cache_min_bytes
+            ):
+                matches = list(self._scan_commands(content))
+                scan = self._summarize_scan(matches)
+            else:
+                matches, scan = self._scan_with_cache(ctx, file_path, stat, content)
+        ctx.add_stats(
+            files_read=1,
+            bytes_read=stat.st_size if stat is not None else 0,
+            read_time=read - start,
+            files_scanned=1,
+            scan_time=time.perf_counter() - read,
+        )
+        return _SourceFile(stat, content, matches, scan)
+
+    def _is_mapped(self, stat: os.stat_result) -> bool:
+        """Whether a file is large enough to be memory-mapped."""
+        return (
+            self._byte_pattern is not None
+            and stat.st_size >= self.config.mmap_threshold
+        )
+
+    def _read_mapped_source(
+        self, ctx: _FlattenContext, file_path: str, stat: os.stat_result
+    ) -> _SourceFile:
+        """Memory-map a large file and find the commands in its raw bytes.
+
+        Only the commands are decoded here, the text around them is decoded
+        chunk by chunk as it is written. Mapped files bypass the scan cache,
+        whose offsets count characters.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to map.
+            stat: Stat of the file, taken before it was mapped.
+
+        Returns:
+            The mapped and scanned file.
+        """
+        start = time.perf_counter()
+        with ctx.trace("map", "io", path=file_path):
+            content = self._map_file(file_path, stat)
+        read = time.perf_counter()
+        with ctx.trace("scan", "scan", path=file_path):
+            matches: List[_CommandMatch] = list(self._scan_mapped(content))
+            scan = self._summarize_scan(matches)
+        ctx.add_stats(
+            files_read=1,
+            files_mapped=1,
+            bytes_read=stat.st_size,
+            read_time=read - start,
+            files_scanned=1,
+            scan_time=time.perf_counter() - read,
+        )
+        return _SourceFile(stat, content, matches, scan)
+
+    def _map_file(self, file_path: str, stat: os.stat_result) -> _MappedText:
+        """Memory-map a file for reading.
+
+        Args:
+            file_path: Path to file to map.
+            stat: Stat of the file, taken before it was mapped.
+
+        Returns:
+            The mapped file.
+        """
+        import mmap
+
+        try:
+            with open(file_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            raise LatexExpandError(f"Failed to read file {file_path}: {e}") from e
+        return _MappedText(data, self.config.output_encoding, file_path, stat)
+
+    def _is_verbatim(
+        self, ctx: _FlattenContext, file_path: str, stat: Optional[os.stat_result]
+    ) -> bool:
+        """Whether an included file is spliced in as is, without scanning it.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to the file.
+            stat: Stat of the file, if taken.
+
+        Returns:
+            True if the file is at least verbatim_min_bytes large, or its
+            path relative to the root directory matches a verbatim pattern.
+        """
+        import fnmatch
+
+        config = self.config
+        if not (config.verbatim_patterns or config.verbatim_min_bytes):
+            return False
+        abs_path = os.path.abspath(file_path)
+        if abs_path == ctx.input_path:
+            return False
+        if config.verbatim_min_bytes and stat is not None:
+            if stat.st_size >= config.verbatim_min_bytes:
+                return True
+        if not config.verbatim_patterns:
+            return False
+        relative_path = os.path.relpath(abs_path, os.path.abspath(ctx.root_dir))
+        relative_path = relative_path.replace(os.sep, "/")
+        return any(
+            fnmatch.fnmatch(relative_path, pattern)
+            for pattern in config.verbatim_patterns
+        )
+
+    def _read_verbatim(
+        self, ctx: _FlattenContext, file_path: str, stat: Optional[os.stat_result]
+    ) -> _SourceFile:
+        """Read a verbatim file, mapping it when its encoding allows.
+
+        A mapped verbatim file is copied to an output file without decoding,
+        see _FileSink.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to read.
+            stat: Stat of the file, if taken.
+
+        Returns:
+            The file, with no command to process.
+        """
+        stat = stat or os.stat(file_path)
+        start = time.perf_counter()
+        content: Union[str, _MappedText]
+        with ctx.trace("read verbatim", "io", path=file_path):
+            if self._ascii_compatible and stat.st_size:
+                content = self._map_file(file_path, stat)
+            else:
+                content = self._read_file(file_path)
+        ctx.add_stats(
+            files_read=1,
+            files_mapped=isinstance(content, _MappedText),
+            files_verbatim=1,
+            bytes_read=stat.st_size,
+            read_time=time.perf_counter() - start,
+        )
+        return _SourceFile(stat, content, [], _ScanResult())
+
+    def _scan_mapped(self, content: _MappedText) -> Iterator[_MappedMatch]:
+        """Find the commands to process in the raw bytes of a mapped file.
+
+        Args:
+            content: Mapped file to scan.
+
+        Yields:
+            Matches of the command pattern, in order of appearance.
+        """
+        assert self._byte_pattern is not None
+        for match in self._byte_pattern.finditer(content.data):
+            start, end = match.span()
+            if self.config.ignore_commented_lines and self._is_mapped_line_commented(
+                content, start
+            ):
+                continue
+            command = self._command_pattern.match(content.decode(start, end))
+            assert command is not None
+            yield _MappedMatch(command, start, end)
+
+    def _is_mapped_line_commented(self, content: _MappedText, offset: int) -> bool:
+        """Check if the line of a mapped file is commented out before offset.
+
+        Args:
+            content: Mapped file.
+            offset: Offset of a command.
+
+        Returns:
+            True if the text before offset on its line is commented.
+        """
+        line_start = content.line_start(offset)
+        first = _LINE_INDENT_PATTERN.match(content.data, line_start, offset)
+        assert first is not None
+        if first.end() == offset:
+            return False
+        byte = content.data[first.end()]
+        if byte < 0x80:
+            return byte == ord("%")
+        # Non-ASCII whitespace may precede a comment, decode the line
+        return self._is_line_commented(content.decode(line_start, offset))
+
+    def _scan_with_cache(
+        self, ctx: _FlattenContext, file_path: str, stat: os.stat_result, content: str
+    ) -> Tuple[List["re.Match[str]"], _ScanResult]:
+        """Take the scan of a file from the scan cache, or scan and store it.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to the file.
+            stat: Stat of the file, taken before it was read.
+            content: Content of the file.
+
+        Returns:
+            Matches of the command pattern and the scan result.
+        """
+        cache = self._scan_cache
+        assert cache is not None
+        abs_path = os.path.abspath(file_path)
+        cached = self._load_cached_scan(abs_path, stat, content)
+        if cached is None:
+            with cache.entry_lock(abs_path, stat):
+                # another job may have scanned the file while this one waited
+                cached = self._load_cached_scan(abs_path, stat, content)
+                if cached is None:
+                    cache.count("misses")
+                    matches = list(self._scan_commands(content))
+                    scan = self._summarize_scan(matches)
+                    cache.store(abs_path, stat, scan)
+                    return matches, scan
+        cache.count("hits")
+        ctx.add_stats(scan_cache_hits=1)
+        return cached
+
+    def _load_cached_scan(
+        self, abs_path: str, stat: os.stat_result, content: str
+    ) -> Optional[Tuple[List["re.Match[str]"], _ScanResult]]:
+        """Take the scan of a file from the scan cache.
+
+        Args:
+            abs_path: Absolute path of the file.
+            stat: Stat of the file, taken before it was read.
+            content: Content of the file.
+
+        Returns:
+            Matches at the cached offsets and the cached scan, or None if the
+            file is not cached or its entry does not match the content.
+        """
+        assert self._scan_cache is not None
+        scan = self._scan_cache.load(abs_path, stat)
+        if scan is None:
+            return None
+        matches: List["re.Match[str]"] = []
+        for offset in scan.offsets:
+            match = self._command_pattern.match(content, offset)
+            if match is None:
+                logger.debug("Stale scan cache entry for %s", abs_path)
+                return None
+            matches.append(match)
+        return matches, scan
+
+    def _summarize_scan(self, matches: Sequence[_CommandMatch]) -> _ScanResult:
+        """Describe the commands found in a file.
+
+        Args:
+            matches: Matches of the command pattern in the file.
+
+        Returns:
+            Offsets of the matches and the files and graphics they reference.
+        """
+        scan = _ScanResult()
+        for match in matches:
+            scan.offsets.append(match.start())
+            kind = match.lastgroup
+            if kind == "include":
+                scan.includes.append(match.group("include"))
+            elif kind == "graphic":
+                scan.graphics.append(match.group("graphic"))
+            elif kind == "graphicspath":
+                scan.graphics_paths.extend(
+                    self._extract_graphics_paths(match.group("graphicspath"))
+                )
+        return scan
+
+    def _mark_visited(self, ctx: _FlattenContext, abs_path: str) -> None:
+        """Mark a file as included and update the digest of the visited set.
+
+        The digest is a sum of per-file hashes, so it does not depend on the
+        order in which files were visited. It is only kept by incremental
+        runs, which compare it with the records of the previous run.
+
+        Args:
+            ctx: State of the flatten call.
+            abs_path: Absolute path of the file.
+        """
+        import hashlib
+
+        ctx.visited_files.add(abs_path)
+        if ctx.records is None and not ctx.previous_records:
+            return
+        file_hash = hashlib.sha1(abs_path.encode("utf-8")).digest()
+        ctx.visited_digest = (
+            ctx.visited_digest + int.from_bytes(file_hash[:8], "big")
+        ) % (1 << 64)
+
+    def _store_record(self, ctx: _FlattenContext, record: _FileRecord) -> None:
+        """Finish the record of a file once its subtree has been flattened.
+
+        Args:
+            ctx: State of the flatten call.
+            record: Record of the file.
+        """
+        assert ctx.records is not None
+        pieces: List[Union[str, Dict[str, str]]] = []
+        for piece in record.pieces:
+            if isinstance(piece, str) and pieces and isinstance(pieces[-1], str):
+                pieces[-1] = pieces[-1] + piece
+            elif piece:
+                pieces.append(piece)
+        record.pieces = pieces
+        record.graphics_paths_out = list(ctx.graphics_paths)
+        ctx.records[record.path] = record
+
+    def _is_record_current(self, ctx: _FlattenContext, record: _FileRecord) -> bool:
+        """Check whether a file and the lookups it depends on are unchanged.
+
+        Args:
+            ctx: State of the flatten call.
+            record: Record of the file from the previous run.
+
+        Returns:
+            True if flattening the file again would give the same output.
+        """
+        try:
+            stat = os.stat(record.path)
+        except OSError:
+            return False
+        if (stat.st_size, stat.st_mtime_ns) != (record.size, record.mtime_ns):
+            return False
+        for include_path, resolved_path in record.includes:
+            try:
+                current: Optional[str] = str(self._resolve_file_path(include_path))
+            except FileNotFoundError:
+                current = None
+            if current != resolved_path:
+                return False
+        for graphic_name, search_paths, graphics_path in record.graphics:
+            if self._lookup_graphics(ctx, graphic_name, search_paths) != graphics_path:
+                return False
+        return True
+
+    def _replay_cached_file(
+        self,
+        ctx: _FlattenContext,
+        file_path: str,
+        parent: Optional[_IncludeFrame],
+    ) -> bool:
+        """Write a file's flattened subtree from the previous run's manifest.
+
+        The subtree is reused only if it is entered in the same state as
+        before (graphics paths and already included files) and none of its
+        files or lookups changed.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to flatten.
+            parent: Frame of the including file, None for the input file.
+
+        Returns:
+            True if the subtree was written, False if it must be flattened.
+        """
+        abs_path = os.path.abspath(file_path)
+        record = ctx.previous_records.get(abs_path)
+        if (
+            record is None
+            or abs_path in ctx.visited_files
+            or record.graphics_paths_in != ctx.graphics_paths
+            or record.visited_in != ctx.visited_digest
+        ):
+            return False
+
+        # Validate the whole subtree before writing anything
+        subtree = self._current_subtree(ctx, record)
+        if subtree is None:
+            return False
+
+        logger.info("Reusing unchanged subtree: %s", file_path)
+        ctx.add_stats(files_reused=len(subtree))
+        with ctx.trace(f"reuse {os.path.basename(file_path)}", "file", path=abs_path):
+            self._write_cached_subtree(ctx, record)
+        for current in subtree:
+            self._mark_visited(ctx, current.path)
+            for _, _, graphics_path in current.graphics:
+                if graphics_path is not None:
+                    self._schedule_graphics_copy(ctx, graphics_path, ctx.output_dir)
+            if ctx.records is not None:
+                ctx.records[current.path] = current
+        ctx.graphics_paths[:] = record.graphics_paths_out
+        if parent is not None and parent.record is not None:
+            parent.record.pieces.append({"include": abs_path})
+        return True
+
+    def _current_subtree(
+        self, ctx: _FlattenContext, record: _FileRecord
+    ) -> Optional[List[_FileRecord]]:
+        """Collect the records of a subtree if none of them is outdated.
+
+        Args:
+            ctx: State of the flatten call.
+            record: Record of the subtree's top file.
+
+        Returns:
+            Records of the subtree, None if any of them is outdated or missing.
+        """
+        subtree: List[_FileRecord] = []
+        pending = [record]
+        while pending:
+            current = pending.pop()
+            if not self._is_record_current(ctx, current):
+                return None
+            subtree.append(current)
+            for child_path in current.children():
+                child = ctx.previous_records.get(child_path)
+                if child is None:
+                    return None
+                pending.append(child)
+        return subtree
+
+    def _write_cached_subtree(self, ctx: _FlattenContext, record: _FileRecord) -> None:
+        """Write the recorded output of a subtree, splicing in included files.
+
+        Args:
+            ctx: State of the flatten call.
+            record: Record of the subtree's top file.
+        """
+        stack: List[Tuple[_FileRecord, int]] = [(record, 0)]
+        mapped: Dict[str, _MappedText] = {}
+        while stack:
+            current, index = stack.pop()
+            for index in range(index, len(current.pieces)):
+                piece = current.pieces[index]
+                if isinstance(piece, str):
+                    ctx.write(piece)
+                elif "include" in piece:
+                    stack.append((current, index + 1))
+                    stack.append((ctx.previous_records[piece["include"]], 0))
+                    break
+                else:
+                    if current.path not in mapped:
+                        mapped[current.path] = self._map_recorded_file(current)
+                    self._write_span(ctx, mapped[current.path], *piece["span"])
+
+    def _map_recorded_file(self, record: _FileRecord) -> _MappedText:
+        """Map the file of a record to write its recorded spans again.
+
+        Args:
+            record: Record of the file, checked to be current.
+
+        Returns:
+            The mapped file.
+
+        Raises:
+            LatexExpandError: If the file changed since it was checked.
+        """
+        stat = os.stat(record.path)
+        if (stat.st_size, stat.st_mtime_ns) != (record.size, record.mtime_ns):
+            raise LatexExpandError(f"{record.path} changed while it was reused")
+        return self._map_file(record.path, stat)
+
+    @staticmethod
+    def _write_span(
+        ctx: _FlattenContext, source: _MappedText, start: int, end: int
+    ) -> None:
+        """Write a span of a mapped file, as it is if the sink takes bytes.
+
+        Args:
+            ctx: State of the flatten call.
+            source: Mapped file.
+            start: Offset of the span.
+            end: End offset of the span.
+        """
+        if ctx.write_raw is not None:
+            ctx.write_raw(source, start, end)
+            return
+        for chunk in source.chunks(start, end):
+            ctx.write(chunk)
+
+    def _manifest_header(self, ctx: _FlattenContext, input_file: str) -> Dict[str, Any]:
+        """Describe what a manifest's records are valid for.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+
+        Returns:
+            Header of the manifest.
+        """
+        return {
+            "version": _MANIFEST_VERSION,
+            "input": os.path.abspath(input_file),
+            "output_dir": os.path.abspath(ctx.output_dir),
+            "config": {
+                "graphic_extensions": self.config.graphic_extensions,
+                "ignore_commented_lines": self.config.ignore_commented_lines,
+                "root_directory": ctx.root_dir,
+                "output_encoding": self.config.output_encoding,
+            },
+        }
+
+    def _load_manifest(
+        self, manifest_file: str, header: Dict[str, Any]
+    ) -> Dict[str, _FileRecord]:
+        """Load the file records of a previous run.
+
+        Args:
+            manifest_file: Path to the manifest.
+            header: Header the manifest must match.
+
+        Returns:
+            Records by absolute path, empty if there is no usable manifest.
+        """
+        import json
+
+        try:
+            with open(manifest_file, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            if manifest["header"] != header:
+                logger.info("Manifest is outdated, flattening from scratch")
+                return {}
+            return {
+                path: _FileRecord(**data) for path, data in manifest["files"].items()
+            }
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning("Ignoring unreadable manifest %s: %s", manifest_file, e)
+            return {}
+
+    def _save_manifest(
+        self,
+        ctx: _FlattenContext,
+        manifest_file: str,
+        header: Dict[str, Any],
+        root_path: str,
+    ) -> None:
+        """Write the include tree, file records and graphics of this run.
+
+        Args:
+            ctx: State of the flatten call.
+            manifest_file: Path to the manifest.
+            header: Header of the manifest.
+            root_path: Path of the input file.
+        """
+        import json
+
+        assert ctx.records is not None
+        graphics: Dict[str, Dict[str, int]] = {}
+        for record in ctx.records.values():
+            for _, _, graphics_path in record.graphics:
+                if graphics_path is not None and graphics_path not in graphics:
+                    stat = os.stat(graphics_path)
+                    graphics[graphics_path] = {
+                        "size": stat.st_size,
+                        "mtime_ns": stat.st_mtime_ns,
+                    }
+        manifest = {
+            "header": header,
+            "root": os.path.abspath(root_path),
+            "files": {path: asdict(rec) for path, rec in ctx.records.items()},
+            "graphics": graphics,
+        }
+        tmp_file = _create_temp_file(manifest_file)
+        try:
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp_file, manifest_file)
+        except BaseException:
+            os.remove(tmp_file)
+            raise
+        logger.info("Manifest written to: %s", manifest_file)
+
+    def _discover_file(
+        self, ctx: _FlattenContext, file_path: str
+    ) -> Optional[_SourceFile]:
+        """Read a file and find the files and graphics it references.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to read.
+
+        Returns:
+            The scanned file, None if it cannot be read (the rendering pass
+            then reports the error).
+        """
+        try:
+            found = self._read_source(ctx, file_path)
+        except (OSError, LatexExpandError):
+            return None
+        for relative_path in found.scan.includes:
+            include_path = self._include_path(ctx, relative_path)
+            try:
+                found.includes.append(str(self._resolve_file_path(include_path)))
+            except FileNotFoundError:
+                continue
+        return found
+
+    def _discover_include_tree(self, ctx: _FlattenContext, input_file: str) -> None:
+        """Read and scan every reachable file in parallel, before rendering.
+
+        Files are read by a thread pool in breadth-first order, each one as
+        soon as the file including it has been scanned, so the wall time is
+        bounded by the deepest include chain rather than the sum of all
+        reads. The directories graphics may be looked up in are listed the
+        same way. The rendering pass then only works from memory.
+
+        This pays off where reads have a high latency, as on network file
+        systems, at the cost of holding every source in memory until it is
+        rendered. On a local disk reading each file when it is reached is
+        faster, which is why discovery_workers defaults to 1.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+        """
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        graphics: Set[str] = set()
+        search_paths: List[str] = [ctx.root_dir]
+        with ThreadPoolExecutor(
+            max_workers=self.config.discovery_workers,
+            thread_name_prefix="flatexpy-discover",
+        ) as executor:
+            seen: Set[str] = {os.path.abspath(input_file)}
+            pending: Dict["Future[Optional[_SourceFile]]", str] = {
+                executor.submit(self._discover_file, ctx, input_file): input_file
+            }
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    abs_path = os.path.abspath(pending.pop(future))
+                    found = future.result()
+                    if found is None:
+                        continue
+                    self._keep_discovered(ctx, abs_path, found, graphics, search_paths)
+                    for include_path in found.includes:
+                        if os.path.abspath(include_path) not in seen:
+                            seen.add(os.path.abspath(include_path))
+                            child = executor.submit(
+                                self._discover_file, ctx, include_path
+                            )
+                            pending[child] = include_path
+
+            for directory in self._graphics_directories(search_paths, graphics):
+                executor.submit(self._list_directory, ctx, directory)
+        logger.debug(
+            "Discovered %d files and %d graphics", len(ctx.prefetched), len(graphics)
+        )
+
+    @staticmethod
+    def _keep_discovered(
+        ctx: _FlattenContext,
+        abs_path: str,
+        found: _SourceFile,
+        graphics: Set[str],
+        search_paths: List[str],
+    ) -> None:
+        """Keep a discovered file for the walker and note its graphics.
+
+        Args:
+            ctx: State of the flatten call.
+            abs_path: Absolute path of the file.
+            found: The read and scanned file.
+            graphics: Names of the graphics found so far, updated.
+            search_paths: Directories graphics are searched in, updated.
+        """
+        ctx.prefetched[abs_path] = found
+        graphics.update(found.scan.graphics)
+        for path in found.scan.graphics_paths:
+            if path not in search_paths:
+                search_paths.append(path)
+
+    @staticmethod
+    def _graphics_directories(search_paths: List[str], graphics: Set[str]) -> Set[str]:
+        """List every directory a graphics lookup of a document may scan.
+
+        Args:
+            search_paths: Directories graphics are searched in.
+            graphics: Names of the graphics, as written.
+
+        Returns:
+            Directories of every candidate path.
+        """
+        return {
+            os.path.dirname(os.path.join(search_path, graphic_name))
+            for search_path in search_paths
+            for graphic_name in graphics
+        }
+
+    def _walk(self, ctx: _FlattenContext, frame: _IncludeFrame) -> None:
+        """Expand a buffer and everything it includes, depth first.
+
+        Included files are pushed on an explicit stack instead of recursing,
+        so the nesting depth is not bounded by the Python recursion limit.
+
+        Args:
+            ctx: State of the flatten call.
+            frame: Frame of the top-level buffer.
+        """
+        write = ctx.write
+        stack: List[_IncludeFrame] = [frame]
+        while stack:
+            frame = stack[-1]
+            ctx.current_record = frame.record
+            match = next(frame.matches, None)
+            if match is None:
+                frame.emit_until(ctx)
+                stack.pop()
+                if ctx.tracer is not None and frame.path:
+                    ctx.tracer.complete(
+                        os.path.basename(frame.path),
+                        "file",
+                        frame.started,
+                        {"path": frame.path, "depth": len(stack)},
+                    )
+                if frame.record is not None:
+                    self._store_record(ctx, frame.record)
+                if stack:
+                    stack[-1].emit(write, frame.closing)
+                else:
+                    write(frame.closing)
+                continue
+
+            kind = match.lastgroup
+            if kind == "include":
+                child = self._enter_include(ctx, frame, match)
+                if child is not None:
+                    stack.append(child)
+                continue
+
+            assert kind is not None
+            replacement = self._handlers[kind](ctx, match)
+            if replacement is not None:
+                frame.emit_until(ctx, match.start())
+                frame.emit(write, replacement)
+                frame.pos = match.end()
+        ctx.current_record = None
+
+    def _enter_include(
+        self, ctx: _FlattenContext, frame: _IncludeFrame, match: _CommandMatch
+    ) -> Optional[_IncludeFrame]:
+        """Write the opening marker of an include and open the included file.
+
+        Args:
+            ctx: State of the flatten call.
+            frame: Frame of the including buffer.
+            match: Match of the include command.
+
+        Returns:
+            Frame of the included file, None if there is nothing to expand.
+        """
+        include_path = self._resolve_include(ctx, match)
+        if include_path is None:
+            return None
+        cmd, relative_path = match.group("cmd", "include")
+        frame.emit_until(ctx, match.start())
+        frame.emit(ctx.write, f"% >>> {cmd}{{{relative_path}}} >>>\n")
+        frame.pos = match.end()
+        # The closing include marker already ends the line
+        frame.skip_newline()
+        closing = f"% <<< {cmd}{{{relative_path}}} <<<\n"
+        if not self._replay_cached_file(ctx, include_path, frame):
+            child = self._open_file_frame(ctx, include_path, closing)
+            if child is not None:
+                if frame.record is not None and child.record is not None:
+                    frame.record.pieces.append({"include": child.record.path})
+                return child
+        frame.emit(ctx.write, closing)
+        return None
+
+    def _expand_commands(self, ctx: _FlattenContext, text: str) -> None:
+        """Expand every command in text in a single sweep.
+
+        Args:
+            ctx: State of the flatten call.
+            text: Content to process.
+        """
+        self._walk(ctx, _IncludeFrame(text, self._scan_commands(text)))
+
+    def _flatten_file(self, ctx: _FlattenContext, file_path: str) -> None:
+        """Flatten a single LaTeX file.
+
+        Args:
+            ctx: State of the flatten call.
+            file_path: Path to file to flatten.
+        """
+        if self._replay_cached_file(ctx, file_path, None):
+            return
+        frame = self._open_file_frame(ctx, file_path, closing="")
+        if frame is not None:
+            self._walk(ctx, frame)
+
+    def _flatten_to_writer(self, ctx: _FlattenContext, input_file: str) -> None:
+        """Flatten a LaTeX document into the output sink of a context.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+        """
+        start = time.perf_counter()
+        if ctx.stats is not None:
+            ctx.write = self._timed_writer(ctx, ctx.write)
+            if ctx.write_raw is not None:
+                ctx.write_raw = self._timed_raw_writer(ctx, ctx.write_raw)
+        # asyncio calls trace, and save, their prefetch and copies as well
+        trace_file = self.config.trace_file if ctx.tracer is None else None
+        if trace_file:
+            ctx.tracer = _Tracer()
+        try:
+            with ctx.trace("flatten", "flatten", input=input_file):
+                self._flatten_tree(ctx, input_file)
+        finally:
+            # A trace of a failed call shows how far it went
+            if ctx.tracer is not None and trace_file:
+                ctx.tracer.save(trace_file)
+        ctx.add_stats(total_time=time.perf_counter() - start)
+
+    def _flatten_tree(self, ctx: _FlattenContext, input_file: str) -> None:
+        """Flatten the include tree of a document into the context's sink.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        input_path = self._resolve_file_path(input_file)
+        ctx.input_path = os.path.abspath(input_path)
+        manifest_file = self.config.manifest_file
+
+        header = self._manifest_header(ctx, str(input_path))
+        if manifest_file:
+            ctx.previous_records = self._load_manifest(manifest_file, header)
+        if manifest_file or ctx.keep_records:
+            ctx.records = {}
+        # Incremental runs only read changed files, discovery would read all;
+        # asyncio calls prefetch the include tree themselves
+        if (
+            self.config.discovery_workers > 1
+            and not ctx.previous_records
+            and ctx.deferred_copies is None
+        ):
+            with ctx.trace("discovery", "discovery"):
+                self._discover_include_tree(ctx, str(input_path))
+
+        if self.config.copy_workers <= 1 or ctx.deferred_copies is not None:
+            self._flatten_file(ctx, str(input_path))
+        else:
+            # Parsing goes on while graphics are copied by the worker pool
+            with ThreadPoolExecutor(
+                max_workers=self.config.copy_workers,
+                thread_name_prefix="flatexpy-copy",
+            ) as executor:
+                ctx.copy_executor = executor
+                try:
+                    self._flatten_file(ctx, str(input_path))
+                finally:
+                    ctx.copy_executor = None
+            self._wait_for_graphics_copies(ctx)
+
+        if manifest_file:
+            self._save_manifest(ctx, manifest_file, header, str(input_path))
+        if self._scan_cache is not None:
+            self._scan_cache.evict()
+
+    @staticmethod
+    def _timed_writer(ctx: _FlattenContext, write: _Writer) -> _Writer:
+        """Wrap the output sink of a context to count and time the writes.
+
+        Args:
+            ctx: State of the flatten call.
+            write: Output sink to wrap.
+
+        Returns:
+            Output sink adding every write to the statistics.
+        """
+
+        def timed_write(text: str) -> Any:
+            start = time.perf_counter()
+            result = write(text)
+            ctx.add_stats(
+                output_writes=1,
+                chars_written=len(text),
+                write_time=time.perf_counter() - start,
+            )
+            return result
+
+        return timed_write
+
+    @staticmethod
+    def _timed_raw_writer(ctx: _FlattenContext, write_raw: _RawWriter) -> _RawWriter:
+        """Wrap the raw sink of a context to count and time the writes.
+
+        Args:
+            ctx: State of the flatten call.
+            write_raw: Raw sink to wrap.
+
+        Returns:
+            Raw sink adding every write to the statistics.
+        """
+
+        def timed_write_raw(source: _MappedText, start: int, end: int) -> Any:
+            started = time.perf_counter()
+            result = write_raw(source, start, end)
+            ctx.add_stats(
+                output_writes=1,
+                bytes_passed_through=end - start,
+                write_time=time.perf_counter() - started,
+            )
+            return result
+
+        return timed_write_raw
+
+    def _new_context(self, output_dir: str) -> _FlattenContext:
+        """Create the state of a flatten call writing graphics to output_dir."""
+        return _FlattenContext(self.config.root_directory, output_dir)
+
+    def flatten_latex(
+        self, input_file: str, output_file: str, return_content: bool = True
+    ) -> str:
+        """Flatten a LaTeX document.
+
+        The output file is written chunk by chunk as the include tree is
+        walked, and only replaces output_file once flattening succeeded.
+        Every call has its own state, so concurrent calls may share one
+        expander.
+
+        Args:
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file. If empty, returns content only.
+            return_content: Whether to also collect and return the content.
+                Pass False to keep memory bounded on large documents.
+
+        Returns:
+            Flattened LaTeX content, or an empty string if return_content
+            is False.
+
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        ctx = self._new_context(os.path.split(output_file)[0])
+        return self._flatten_latex(ctx, input_file, output_file, return_content)
+
+    def flatten_with_stats(
+        self, input_file: str, output_file: str, return_content: bool = True
+    ) -> FlattenResult:
+        """Flatten a LaTeX document and report where the time was spent.
+
+        Same as flatten_latex, also counting and timing file reads, scanning,
+        include resolution, graphics lookups and copies, and output writes.
+
+        Args:
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file. If empty, returns content only.
+            return_content: Whether to also collect and return the content.
 
+        Returns:
+            Flattened content, output file and statistics of the call.
+
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        ctx = self._new_context(os.path.split(output_file)[0])
+        ctx.stats = FlattenStats()
+        content = self._flatten_latex(ctx, input_file, output_file, return_content)
+        return FlattenResult(output_file, content, ctx.stats)
+
+    def _flatten_latex(
+        self,
+        ctx: _FlattenContext,
+        input_file: str,
+        output_file: str,
+        return_content: bool,
+    ) -> str:
+        """Flatten a LaTeX document with the given call state.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file. If empty, returns content only.
+            return_content: Whether to also collect and return the content.
+
+        Returns:
+            Flattened LaTeX content, or an empty string if return_content
+            is False.
+
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        try:
             logger.info("Starting LaTeX flattening: %s to %s", input_file, output_file)
-            flattened_content = self._flatten_file(
-                str(input_path), root_dir, output_dir
+            if not output_file:
+                return self._render(ctx, input_file, "", True)
+
+            tmp_file = _create_temp_file(output_file)
+            try:
+                content = self._render(ctx, input_file, tmp_file, return_content)
+                os.replace(tmp_file, output_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+            logger.info("Flattened LaTeX written to: %s", output_file)
+
+            return content
+
+        except Exception as e:
+            raise LatexExpandError(f"Failed to flatten LaTeX: {e}") from e
+
+    def _render(
+        self, ctx: _FlattenContext, input_file: str, tmp_file: str, return_content: bool
+    ) -> str:
+        """Flatten a LaTeX document into a temporary file or into memory.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+            tmp_file: File to write, renamed by the caller once flattening
+                succeeded. If empty, the document is only collected.
+            return_content: Whether to also collect and return the content.
+
+        Returns:
+            Flattened LaTeX content, or an empty string if return_content
+            is False.
+        """
+        chunks: List[str] = []
+        if not tmp_file:
+            ctx.write = chunks.append
+            self._flatten_to_writer(ctx, input_file)
+            return "".join(chunks)
+
+        if self._uses_file_sink(return_content):
+            self._flatten_to_file_sink(ctx, input_file, tmp_file)
+            return ""
+        with open(tmp_file, "w", encoding=self.config.output_encoding) as f:
+            if return_content:
+
+                def write(chunk: str) -> None:
+                    f.write(chunk)
+                    chunks.append(chunk)
+
+                ctx.write = write
+            else:
+                ctx.write = f.write
+            self._flatten_to_writer(ctx, input_file)
+        return "".join(chunks)
+
+    def _uses_file_sink(self, return_content: bool) -> bool:
+        """Whether an output file is written through a _FileSink.
+
+        Only mapped files have spans to pass through, and the file sink
+        writes no newline translation, as text files do on Windows.
+        """
+        config = self.config
+        return (
+            not return_content
+            and self._ascii_compatible
+            and bool(
+                config.mmap_threshold
+                or config.verbatim_patterns
+                or config.verbatim_min_bytes
             )
+            and os.linesep == "\n"
+            and hasattr(os, "writev")
+        )
+
+    def _flatten_to_file_sink(
+        self, ctx: _FlattenContext, input_file: str, tmp_file: str
+    ) -> None:
+        """Flatten a LaTeX document into a binary file through a _FileSink.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+            tmp_file: Path of the file to write.
+        """
+        with open(tmp_file, "wb", buffering=0) as f:
+            sink = _FileSink(f.fileno(), self.config.output_encoding)
+            ctx.write = sink.write
+            ctx.write_raw = sink.write_span
+            self._flatten_to_writer(ctx, input_file)
+            sink.flush()
+
+    def flatten_latex_to_stream(
+        self, input_file: str, stream: IO[str], output_dir: str = "."
+    ) -> None:
+        """Flatten a LaTeX document into any writable text stream.
+
+        Chunks are written as the include tree is walked, so the flattened
+        document is never held in memory as a whole.
+
+        Args:
+            input_file: Path to input LaTeX file.
+            stream: Writable text stream, e.g. an open file or sys.stdout.
+            output_dir: Output directory for graphics files.
 
-            if output_file:
-                with open(output_file, "w", encoding=self.config.output_encoding) as f:
-                    f.write(flattened_content)
-                logger.info("Flattened LaTeX written to: %s", output_file)
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        try:
+            logger.info("Starting LaTeX flattening: %s to stream", input_file)
+            ctx = self._new_context(output_dir)
+            ctx.write = stream.write
+            self._flatten_to_writer(ctx, input_file)
+        except Exception as e:
+            raise LatexExpandError(f"Failed to flatten LaTeX: {e}") from e
+
+    async def aflatten_latex(
+        self, input_file: str, output_file: str, return_content: bool = True
+    ) -> str:
+        """Flatten a LaTeX document without blocking the event loop.
 
-            return flattened_content
+        Files of the include tree are read concurrently, each one as soon as
+        the file including it has been read. The document is then assembled
+        in document order and written in one worker thread, and its graphics
+        are copied concurrently. The output is the same as flatten_latex's.
+
+        All blocking work runs in the event loop's default executor, one
+        short task per file read, graphics copy or directory listing plus
+        one for assembling the document, so concurrent calls share its
+        threads; a call starts no thread of its own, discovery_workers and
+        copy_workers do not apply.
+
+        Args:
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file. If empty, returns content only.
+            return_content: Whether to also collect and return the content.
+
+        Returns:
+            Flattened LaTeX content, or an empty string if return_content
+            is False.
+
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        import asyncio
 
+        ctx = self._new_context(os.path.split(output_file)[0])
+        ctx.deferred_copies = []
+        trace_file = self.config.trace_file
+        if trace_file:
+            ctx.tracer = _Tracer()
+        try:
+            logger.info("Starting LaTeX flattening: %s to %s", input_file, output_file)
+            try:
+                return await self._aflatten(
+                    ctx, input_file, output_file, return_content
+                )
+            finally:
+                # A trace of a failed call shows how far it went
+                if ctx.tracer is not None and trace_file:
+                    await asyncio.to_thread(ctx.tracer.save, trace_file)
         except Exception as e:
             raise LatexExpandError(f"Failed to flatten LaTeX: {e}") from e
 
+    async def _aflatten(
+        self,
+        ctx: _FlattenContext,
+        input_file: str,
+        output_file: str,
+        return_content: bool,
+    ) -> str:
+        """Prefetch, assemble and write a document for aflatten_latex.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file. If empty, returns content only.
+            return_content: Whether to also collect and return the content.
+
+        Returns:
+            Flattened LaTeX content, or an empty string if return_content
+            is False.
+        """
+        import asyncio
+
+        # Incremental runs only read changed files, prefetching would read all
+        if not self.config.manifest_file:
+            with ctx.trace("prefetch", "discovery"):
+                await self._prefetch_include_tree(ctx, input_file)
+        if not output_file:
+            content = await asyncio.to_thread(self._render, ctx, input_file, "", True)
+            await self._copy_deferred_graphics(ctx)
+            return content
+
+        tmp_file = await asyncio.to_thread(_create_temp_file, output_file)
+        try:
+            content = await asyncio.to_thread(
+                self._render, ctx, input_file, tmp_file, return_content
+            )
+            await self._copy_deferred_graphics(ctx)
+            await asyncio.to_thread(os.replace, tmp_file, output_file)
+        finally:
+            await asyncio.to_thread(self._remove_leftover, tmp_file)
+        logger.info("Flattened LaTeX written to: %s", output_file)
+        return content
+
+    async def _prefetch_include_tree(
+        self, ctx: _FlattenContext, input_file: str
+    ) -> None:
+        """Read and scan the include tree concurrently, off the event loop.
+
+        Like the discovery phase, but driven by the event loop: every file is
+        read in a task of the default executor as soon as the file including
+        it has been scanned, then the directories graphics may be looked up
+        in are listed.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+        """
+        import asyncio
+
+        try:
+            input_path = await asyncio.to_thread(self._resolve_file_path, input_file)
+        except FileNotFoundError:
+            return  # reported when the document is assembled
+        # Prefetching reads the document before _flatten_tree, which sets it too
+        ctx.input_path = os.path.abspath(input_path)
+        graphics: Set[str] = set()
+        search_paths: List[str] = [ctx.root_dir]
+        seen: Set[str] = set()
+        pending: Dict["asyncio.Future[Optional[_SourceFile]]", str] = {}
+
+        def schedule(file_path: str) -> None:
+            abs_path = os.path.abspath(file_path)
+            if abs_path not in seen:
+                seen.add(abs_path)
+                task = asyncio.ensure_future(
+                    asyncio.to_thread(self._discover_file, ctx, file_path)
+                )
+                pending[task] = abs_path
+
+        schedule(str(input_path))
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                abs_path = pending.pop(task)
+                found = task.result()
+                if found is None:
+                    continue
+                self._keep_discovered(ctx, abs_path, found, graphics, search_paths)
+                for include_path in found.includes:
+                    schedule(include_path)
+
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(self._list_directory, ctx, directory)
+                for directory in self._graphics_directories(search_paths, graphics)
+            )
+        )
+
+    async def _copy_deferred_graphics(self, ctx: _FlattenContext) -> None:
+        """Copy the graphics of an asyncio call concurrently, off the event loop.
+
+        Copies to the same destination run one after the other, in document
+        order, so the last one wins as with flatten_latex.
+
+        Args:
+            ctx: State of the flatten call.
+
+        Raises:
+            GraphicsCopyError: If any of the copies failed.
+        """
+        import asyncio
+
+        by_destination: Dict[str, List[Tuple[str, str]]] = {}
+        for source_path, dest_dir in ctx.deferred_copies or []:
+            dest_path = os.path.join(dest_dir, os.path.basename(source_path))
+            by_destination.setdefault(dest_path, []).append((source_path, dest_dir))
+        failures: List[Tuple[str, BaseException]] = []
+
+        async def copy_in_order(copies: List[Tuple[str, str]]) -> None:
+            for source_path, dest_dir in copies:
+                try:
+                    await asyncio.to_thread(
+                        self._copy_graphics_file, ctx, source_path, dest_dir
+                    )
+                except Exception as e:
+                    failures.append((source_path, e))
+
+        await asyncio.gather(*map(copy_in_order, by_destination.values()))
+        if failures:
+            raise GraphicsCopyError(failures)
+
+    @staticmethod
+    def _remove_leftover(tmp_file: str) -> None:
+        """Remove a temporary output file, if it is still there."""
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+    def _watched_paths(self, ctx: _FlattenContext, input_file: str) -> Set[str]:
+        """List the files and directories a flatten call depended on.
+
+        Directories of include and graphics lookups are watched as well, so
+        that a newly created file which would change a lookup is noticed.
+
+        Args:
+            ctx: State of the flatten call.
+            input_file: Path to input LaTeX file.
+
+        Returns:
+            Paths to poll for changes.
+        """
+        paths: Set[str] = {os.path.abspath(input_file)}
+        paths.update(ctx.visited_files)
+        for record in (ctx.records or {}).values():
+            for include_path, resolved_path in record.includes:
+                paths.add(os.path.abspath(os.path.dirname(include_path)))
+                if resolved_path is not None:
+                    paths.add(os.path.abspath(resolved_path))
+            for graphic_name, search_paths, graphics_path in record.graphics:
+                for search_path in search_paths:
+                    candidate = os.path.join(search_path, graphic_name)
+                    paths.add(os.path.abspath(os.path.dirname(candidate)))
+                if graphics_path is not None:
+                    paths.add(os.path.abspath(graphics_path))
+        return paths
+
+    @staticmethod
+    def _snapshot(paths: Set[str]) -> Dict[str, Optional[Tuple[int, int]]]:
+        """Take the size and modification time of every watched path.
+
+        Args:
+            paths: Paths to stat.
+
+        Returns:
+            Size and modification time by path, None for missing paths.
+        """
+        snapshot: Dict[str, Optional[Tuple[int, int]]] = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+            except OSError:
+                snapshot[path] = None
+        return snapshot
+
+    def watch(
+        self,
+        input_file: str,
+        output_file: str,
+        poll_interval: float = 0.5,
+        debounce: float = 0.2,
+        stop: Optional[threading.Event] = None,
+    ) -> None:
+        """Flatten a LaTeX document again whenever one of its sources changes.
+
+        The files and directories the document depends on are polled; after
+        a change, the rebuild waits until they stay unchanged for the
+        debounce delay. Rebuilds only re-read the parts of the include tree
+        that changed.
+
+        Args:
+            input_file: Path to input LaTeX file.
+            output_file: Path to output file.
+            poll_interval: Seconds between two polls.
+            debounce: Seconds the sources must stay unchanged before a rebuild.
+            stop: Event ending the watch when set; watches forever if None.
+        """
+        if stop is None:
+            stop = threading.Event()
+        output_dir = os.path.split(output_file)[0]
+        # Records of the last successful run, reused by the next one
+        previous_records: Dict[str, _FileRecord] = {}
+        while not stop.is_set():
+            ctx = self._new_context(output_dir)
+            ctx.keep_records = True
+            ctx.previous_records = previous_records
+            try:
+                self._flatten_latex(ctx, input_file, output_file, False)
+                previous_records = ctx.records or {}
+            except LatexExpandError as e:
+                logger.error("%s", e)
+
+            paths = self._watched_paths(ctx, input_file)
+            snapshot = self._snapshot(paths)
+            logger.info("Watching %d paths for changes", len(paths))
+            while not stop.wait(poll_interval):
+                if self._snapshot(paths) != snapshot:
+                    break
+            else:
+                return
+
+            # Let an editor or a batch of changes finish writing
+            snapshot = self._snapshot(paths)
+            while not stop.wait(debounce):
+                latest = self._snapshot(paths)
+                if latest == snapshot:
+                    break
+                snapshot = latest
+            logger.info("Change detected, flattening again")
+
     def show_config(self) -> None:
         """show configuration"""
         logger.info("graphic_extensions     :: %s", self.config.graphic_extensions)
         logger.info("ignore_commented_lines :: %s", self.config.ignore_commented_lines)
         logger.info("root_directory         :: %s", self.config.root_directory)
         logger.info("output_encoding        :: %s", self.config.output_encoding)
+        logger.info("copy_workers           :: %s", self.config.copy_workers)
+        logger.info("discovery_workers      :: %s", self.config.discovery_workers)
+        logger.info("graphics_mode          :: %s", self.config.graphics_mode)
+        logger.info("skip_unchanged         :: %s", self.config.skip_unchanged)
+        logger.info("manifest_file          :: %s", self.config.manifest_file)
+        logger.info("cache_dir              :: %s", self.config.cache_dir)
+        logger.info("cache_max_bytes        :: %s", self.config.cache_max_bytes)
+        logger.info("cache_max_age_days     :: %s", self.config.cache_max_age_days)
+        logger.info("cache_min_bytes        :: %s", self.config.cache_min_bytes)
+        logger.info("trace_file             :: %s", self.config.trace_file)
+        logger.info("mmap_threshold         :: %s", self.config.mmap_threshold)
+        logger.info("verbatim_patterns      :: %s", self.config.verbatim_patterns)
+        logger.info("verbatim_min_bytes     :: %s", self.config.verbatim_min_bytes)
+
+    def scan_cache_stats(self) -> ScanCacheStats:
+        """Describe the scan cache and how this expander used it.
+
+        Returns:
+            Number and total size of the entries, and the hits, misses and
+            stores of this expander.
+
+        Raises:
+            ValueError: If no cache_dir is configured.
+        """
+        if self._scan_cache is None:
+            raise ValueError("cache_dir is not configured")
+        return self._scan_cache.stats()
+
+    def clean_scan_cache(self) -> int:
+        """Evict expired and least recently used scan cache entries.
+
+        Temporary and lock files left behind by other jobs are removed too.
+        Safe to run while other processes use the cache.
+
+        Returns:
+            Number of entries removed.
+
+        Raises:
+            ValueError: If no cache_dir is configured.
+        """
+        if self._scan_cache is None:
+            raise ValueError("cache_dir is not configured")
+        return self._scan_cache.evict(force=True)
+
+
+def _flatten_document(
+    args: "argparse.Namespace", config: LatexExpandConfig, output_file: str
+) -> Optional[FlattenStats]:
+    """Flatten the input file of the command line, with a server if asked.
+
+    Args:
+        args: Parsed command line arguments.
+        config: Configuration of the document.
+        output_file: Path to output file.
+
+    Returns:
+        Statistics of the flatten, if served by a server or asked with --stats.
+    """
+    if args.connect:
+        from flatexpy.flatexpy_server import _flatten_with_server
+
+        stats = _flatten_with_server(args.socket, config, args.input_file, output_file)
+        if stats is not None:
+            return stats
+    expander = LatexExpander(config)
+    if args.stats:
+        return expander.flatten_with_stats(
+            args.input_file, output_file, return_content=False
+        ).stats
+    expander.flatten_latex(args.input_file, output_file, return_content=False)
+    return None
+
+
+def _print_stats(stats: FlattenStats, output_format: str) -> None:
+    """Print the statistics of a flatten as text or JSON."""
+    import json
+
+    if output_format == "json":
+        print(json.dumps(asdict(stats), indent=2))
+    else:
+        print(stats.summary())
+
+
+def _run_cache_command(args: "argparse.Namespace", config: LatexExpandConfig) -> None:
+    """Run the --cache-clean and --cache-stats command line modes.
+
+    Args:
+        args: Parsed command line arguments.
+        config: Configuration naming the cache directory.
+    """
+    expander = LatexExpander(config)
+    if args.cache_clean:
+        removed = expander.clean_scan_cache()
+        print(f"Removed {removed} scan cache entries")
+    stats = expander.scan_cache_stats()
+    if args.cache_stats:
+        print(f"Scan cache: {stats.directory}")
+        print(f"Entries: {stats.entries}")
+        print(f"Size: {stats.total_bytes} bytes (limit {config.cache_max_bytes})")
+
+
+def _check_args(parser: "argparse.ArgumentParser", args: "argparse.Namespace") -> None:
+    """Reject combinations of command line arguments, exiting with usage."""
+    if args.batch:
+        if any(
+            (args.input_file, args.watch, args.manifest, args.trace)
+            + (args.serve, args.connect)
+        ):
+            parser.error(
+                "--batch cannot be combined with input_file, --watch, --manifest, "
+                "--trace, --serve or --connect"
+            )
+    elif args.serve:
+        if args.input_file or args.watch or args.connect:
+            parser.error(
+                "--serve cannot be combined with input_file, --watch or --connect"
+            )
+    elif not (args.input_file or args.cache_stats or args.cache_clean):
+        parser.error("the following arguments are required: input_file")
 
 
 def main() -> None:
     """Main entry point for command-line usage."""
+    import argparse
+
     parser = argparse.ArgumentParser(
         description="Flatten LaTeX documents by inlining includes and copying graphics"
     )
-    parser.add_argument("input_file", help="Input LaTeX file to flatten")
+    parser.add_argument("input_file", nargs="?", help="Input LaTeX file to flatten")
     parser.add_argument(
         "--ignore-comments",
         action="store_true",
@@ -411,39 +3344,241 @@ def main() -> None:
     parser.add_argument(
         "-f", "--force", action="store_true", help="Overwrite existing diff files."
     )
+    parser.add_argument(
+        "--copy-workers",
+        type=int,
+        default=4,
+        help="Number of threads copying graphics files, 1 copies inline (default: 4)",
+    )
+    parser.add_argument(
+        "--discovery-workers",
+        type=int,
+        default=1,
+        help="Number of threads reading the include tree before it is rendered; "
+        "helps on network file systems, holds every source in memory "
+        "(default: 1, files are read one at a time as they are reached)",
+    )
+    parser.add_argument(
+        "--graphics-mode",
+        choices=GRAPHICS_MODES,
+        default="copy",
+        help="How graphics are written to the output directory; reflink clones "
+        "on copy-on-write filesystems and falls back to copy (default: copy)",
+    )
+    parser.add_argument(
+        "--skip-unchanged",
+        choices=SKIP_UNCHANGED_MODES,
+        default="mtime",
+        help="Skip graphics whose destination is up to date, compared by size "
+        "and modification time or by content digest (default: mtime)",
+    )
+    parser.add_argument(
+        "--manifest",
+        metavar="PATH",
+        help="Dependency manifest enabling incremental runs: unchanged parts of "
+        "the include tree are reused from the previous run",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="Keep the scan of every source file in a cache shared across runs, "
+        f"in {_default_cache_dir()} unless --cache-dir is given",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        help="Keep the scan cache in DIR; implies --cache",
+    )
+    parser.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print the number and size of scan cache entries and exit",
+    )
+    parser.add_argument(
+        "--cache-clean",
+        action="store_true",
+        help="Evict expired and least recently used scan cache entries and exit; "
+        "safe while other jobs use the cache",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run a server flattening documents for --connect clients, keeping "
+        "its caches warm between requests",
+    )
+    parser.add_argument(
+        "--serve-workers",
+        type=int,
+        default=4,
+        help="Number of documents the server flattens at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=32,
+        help="Number of distinct requests the server queues or runs before "
+        "rejecting new ones as overloaded (default: 32)",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        help="Seconds a server request waits for its result before failing "
+        "(default: no limit)",
+    )
+    parser.add_argument(
+        "--connect",
+        action="store_true",
+        help="Flatten with a running server, or in this process if none is running",
+    )
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Socket of the server for --serve and --connect (default: "
+        "flatexpy.sock in $XDG_RUNTIME_DIR, or a per-user socket in the "
+        "temporary directory)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="Print counters and timers of every stage of the flatten",
+    )
+    parser.add_argument(
+        "--stats-format",
+        choices=("text", "json"),
+        help="Print the statistics as a table or as JSON; implies --stats "
+        "(default: text)",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="PATH",
+        help="Write a Chrome trace event file of the flatten, with a span per "
+        "file, graphics lookup and copy, to open in chrome://tracing or Perfetto",
+    )
+    parser.add_argument(
+        "--mmap-threshold",
+        type=int,
+        default=0,
+        metavar="BYTES",
+        help="Memory-map source files of at least BYTES bytes and decode only "
+        "what is written, instead of reading them whole (default: 0, never)",
+    )
+    parser.add_argument(
+        "--verbatim",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Splice included files whose path relative to the root directory "
+        "matches the glob PATTERN as they are, without looking for commands in "
+        "them; may be repeated",
+    )
+    parser.add_argument(
+        "--verbatim-min-bytes",
+        type=int,
+        default=0,
+        metavar="BYTES",
+        help="Splice included files of at least BYTES bytes as they are "
+        "(default: 0, never)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and flatten again whenever a source file changes",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=0.5,
+        help="Seconds between two checks for changes in watch mode (default: 0.5)",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="MANIFEST",
+        help="Flatten every document listed in a JSON manifest of "
+        '{"input": ..., "output": ...} objects instead of input_file',
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Number of worker processes in batch mode (default: CPU count)",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="Write a JSON report of every document's outcome in batch mode",
+    )
 
     args = parser.parse_args()
+    _check_args(parser, args)
+    _setup_logger()
+    args.stats = args.stats or bool(args.stats_format)
+    cache_command = args.cache_stats or args.cache_clean
 
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
+    if args.serve:
+        from flatexpy.flatexpy_server import _run_server
+
+        _run_server(args)
+        return
 
     # Determine output file
-    input_path = Path(args.input_file)
     output_path = args.output
-    output_file = os.path.join(
-        output_path, f"{input_path.stem}_flattened{input_path.suffix}"
-    )
+    output_file = _flattened_file_name(args.input_file or "", output_path)
 
     # extract root dir
-    root_dir = os.path.dirname(args.input_file) or "./"
+    root_dir = os.path.dirname(args.input_file or "") or "./"
 
     # Create configuration
     config = LatexExpandConfig(
         graphic_extensions=args.graphics_exts,
         ignore_commented_lines=args.ignore_comments,
         root_directory=root_dir,
+        copy_workers=args.copy_workers,
+        discovery_workers=args.discovery_workers,
+        graphics_mode=args.graphics_mode,
+        skip_unchanged=args.skip_unchanged,
+        manifest_file=args.manifest,
+        cache_dir=args.cache_dir or (_default_cache_dir() if args.cache else None),
+        trace_file=args.trace,
+        mmap_threshold=args.mmap_threshold,
+        verbatim_patterns=args.verbatim,
+        verbatim_min_bytes=args.verbatim_min_bytes,
     )
 
+    if cache_command:
+        config.cache_dir = args.cache_dir or _default_cache_dir()
+        _run_cache_command(args, config)
+        return
+    if args.batch:
+        from flatexpy.flatexpy_batch import _run_batch
+
+        _run_batch(args, config)
+        return
+
     # Perform flattening
     try:
         _create_output_dir(output_path, args.force)
-        expander = LatexExpander(config)
-        expander.flatten_latex(args.input_file, output_file)
+        if args.watch:
+            print(f"Watching {args.input_file}, press Ctrl+C to stop")
+            expander = LatexExpander(config)
+            expander.watch(args.input_file, output_file, args.poll_interval)
+            return
+        stats = _flatten_document(args, config, output_file)
         print(f"Successfully flattened {args.input_file} to {output_file}")
+        if args.stats and stats is not None:
+            _print_stats(stats, args.stats_format or "text")
+    except KeyboardInterrupt:
+        print("Stopped watching")
     except (LatexExpandError, FileExistsError) as e:
         print(f"Error: {e}")
         sys.exit(1)
 
 
 if __name__ == "__main__":
-    main()
+    # Run main of the package module rather than of __main__, so that the
+    # server and batch modes share its classes, including LatexExpandError
+    if not __package__:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from flatexpy.flatexpy_core import main as _main
+
+    _main()
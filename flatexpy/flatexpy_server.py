@@ -0,0 +1,522 @@
+"""Server mode of flatexpy: flatten documents for clients of a Unix socket.
+
+Imported by ``flatexpy --serve`` and ``--connect`` and by applications using
+FlattenServer or request_flatten, so that importing flatexpy.flatexpy_core
+stays fast.
+"""
+
+import contextlib
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from flatexpy.flatexpy_core import (
+    FlattenStats,
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    _DirectoryListing,
+    _FileRecord,
+    _FlattenContext,
+    logger,
+)
+
+if TYPE_CHECKING:
+    import argparse
+
+
+def _default_socket_path() -> str:
+    """Return the per-user socket of the flatten server.
+
+    Without $XDG_RUNTIME_DIR, the socket is put in a directory of the
+    temporary directory that only the user can enter, created on first use,
+    so that other users can neither plant the socket nor take it over.
+
+    Raises:
+        LatexExpandError: If that directory cannot be created, or belongs to
+            another user or is open to others.
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "flatexpy.sock")
+    socket_dir = os.path.join(tempfile.gettempdir(), f"flatexpy-{os.getuid()}")
+    try:
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(socket_dir, 0o700)
+        dir_stat = os.lstat(socket_dir)
+    except OSError as e:
+        raise LatexExpandError(f"Cannot create socket directory: {e}") from e
+    if (
+        not stat.S_ISDIR(dir_stat.st_mode)
+        or dir_stat.st_uid != os.getuid()
+        or dir_stat.st_mode & 0o077
+    ):
+        raise LatexExpandError(
+            f"Socket directory {socket_dir} must be a directory only you can access"
+        )
+    return os.path.join(socket_dir, "flatexpy.sock")
+
+
+# Documents whose records a server keeps for incremental requests
+_SERVER_MAX_DOCUMENTS = 64
+
+# Characters of recorded output a server keeps, least recently used evicted
+_SERVER_MAX_RECORD_CHARS = 16 * 1024 * 1024
+
+# Configurations whose expander a server keeps, least recently used evicted
+_SERVER_MAX_CONFIGURATIONS = 16
+
+
+@dataclass
+class _Flight:
+    """A flatten running in a server, shared by identical requests."""
+
+    future: "Future[Dict[str, Any]]"
+    waiters: int = 1
+
+
+class FlattenServer:
+    """Flatten documents for clients of a Unix domain socket.
+
+    Requests and responses are JSON objects, one per line. Between requests
+    the server keeps an expander per configuration, with its compiled
+    patterns, the directory listings used to find graphics and, for
+    incremental requests, the records of the documents it served, from which
+    unchanged parts of an include tree are reused. Files are checked by size
+    and mtime, and directories by mtime, before anything is reused.
+
+    A flatten request has the keys ``input``, ``output`` (empty to only
+    return the content), ``config`` (fields of LatexExpandConfig) and
+    ``return_content``. Paths should be absolute, as they are resolved from
+    the server's working directory. With ``incremental`` the server records
+    the document, up to _SERVER_MAX_RECORD_CHARS of output for all
+    documents, and reuses its previous records. An optional ``timeout``
+    bounds, in seconds, how long the request waits for its result. A
+    ``{"command": "ping"}`` request checks that the server is alive.
+
+    Identical concurrent requests share one flatten (single flight) and one
+    response. Distinct flattens run on a pool of worker threads; once
+    max_pending of them are queued or running, new ones are rejected with an
+    ``overloaded`` response instead of piling up.
+    """
+
+    def __init__(
+        self,
+        socket_path: Optional[str] = None,
+        workers: int = 4,
+        max_pending: int = 32,
+        request_timeout: Optional[float] = None,
+    ) -> None:
+        """Initialize the server.
+
+        Args:
+            socket_path: Socket to listen on; defaults to a per-user socket
+                in $XDG_RUNTIME_DIR or in a private directory of the
+                temporary directory.
+            workers: Number of documents flattened at the same time.
+            max_pending: Number of distinct flattens queued or running above
+                which requests are rejected.
+            request_timeout: Default seconds a request waits for its result,
+                None waits until it is done.
+
+        Raises:
+            LatexExpandError: If the directory of the default socket is unsafe.
+        """
+        self.socket_path = socket_path or _default_socket_path()
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="flatexpy-serve"
+        )
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._expanders: "OrderedDict[str, LatexExpander]" = OrderedDict()
+        self._records: "OrderedDict[Tuple[str, str, str], Dict[str, _FileRecord]]" = (
+            OrderedDict()
+        )
+        self._record_chars: Dict[Tuple[str, str, str], int] = {}
+        self._dir_index: Dict[str, Tuple[int, _DirectoryListing]] = {}
+        self._server: Optional["socketserver.BaseServer"] = None
+
+    def _expander(self, config: LatexExpandConfig) -> Tuple[str, LatexExpander]:
+        """Get the expander of a configuration, creating it on first use.
+
+        Only the _SERVER_MAX_CONFIGURATIONS most recently used expanders are
+        kept, so clients varying their configuration cannot grow the server.
+
+        Args:
+            config: Configuration of the request.
+
+        Returns:
+            Key of the configuration and its expander.
+        """
+        # Each request brings its own root directory through its context
+        key = json.dumps({**asdict(config), "root_directory": None}, sort_keys=True)
+        with self._lock:
+            expander = self._expanders.get(key)
+            if expander is None:
+                expander = self._expanders[key] = LatexExpander(config)
+            self._expanders.move_to_end(key)
+            while len(self._expanders) > _SERVER_MAX_CONFIGURATIONS:
+                self._expanders.popitem(last=False)
+        return key, expander
+
+    def flatten(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten the document of a request.
+
+        Args:
+            request: Decoded flatten request.
+
+        Returns:
+            Response with the output file, and the content if requested.
+
+        Raises:
+            LatexExpandError: If flattening fails.
+        """
+        input_file = request["input"]
+        output_file = request.get("output", "")
+        config = LatexExpandConfig(**request.get("config", {}))
+        config_key, expander = self._expander(config)
+        output_dir = os.path.split(output_file)[0]
+        records_key = (
+            os.path.abspath(input_file),
+            os.path.abspath(output_dir),
+            config_key,
+        )
+
+        ctx = _FlattenContext(config.root_directory, output_dir)
+        ctx.shared_dir_index = self._dir_index
+        ctx.stats = FlattenStats()
+        ctx.keep_records = bool(request.get("incremental"))
+        if ctx.keep_records:
+            with self._lock:
+                ctx.previous_records = self._records.get(records_key, {})
+        content = expander._flatten_latex(
+            ctx, input_file, output_file, bool(request.get("return_content"))
+        )
+        if ctx.keep_records:
+            self._keep_records(records_key, ctx.records or {})
+
+        response: Dict[str, Any] = {
+            "ok": True,
+            "output": output_file,
+            "stats": asdict(ctx.stats),
+        }
+        if request.get("return_content"):
+            response["content"] = content
+        return response
+
+    def _keep_records(
+        self, key: Tuple[str, str, str], records: Dict[str, _FileRecord]
+    ) -> None:
+        """Keep the records of a document for its next incremental request.
+
+        Least recently used documents are dropped once more than
+        _SERVER_MAX_DOCUMENTS documents or _SERVER_MAX_RECORD_CHARS
+        characters of recorded output are kept.
+
+        Args:
+            key: Document, output directory and configuration.
+            records: Records of the document's files.
+        """
+        chars = sum(
+            len(piece)
+            for record in records.values()
+            for piece in record.pieces
+            if isinstance(piece, str)
+        )
+        with self._lock:
+            self._records.pop(key, None)
+            self._record_chars.pop(key, None)
+            if chars > _SERVER_MAX_RECORD_CHARS:
+                return
+            self._records[key] = records
+            self._record_chars[key] = chars
+            while (
+                len(self._records) > _SERVER_MAX_DOCUMENTS
+                or sum(self._record_chars.values()) > _SERVER_MAX_RECORD_CHARS
+            ):
+                dropped, _ = self._records.popitem(last=False)
+                del self._record_chars[dropped]
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Answer a request, reporting errors in the response.
+
+        Args:
+            request: Decoded request.
+
+        Returns:
+            Response to send back to the client.
+        """
+        if request.get("command", "flatten") == "ping":
+            return {"ok": True, "pid": os.getpid()}
+        start = time.perf_counter()
+        try:
+            timeout = request.get("timeout", self.request_timeout)
+            key = json.dumps(
+                [
+                    os.path.abspath(request["input"]),
+                    os.path.abspath(request.get("output", "")),
+                    request.get("config", {}),
+                    bool(request.get("return_content")),
+                    bool(request.get("incremental")),
+                ],
+                sort_keys=True,
+            )
+            response = self._join_flight(
+                key, request, None if timeout is None else float(timeout)
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            response = {"ok": False, "error": f"Invalid request: {e!r}"}
+        response["elapsed"] = time.perf_counter() - start
+        return response
+
+    def _join_flight(
+        self, key: str, request: Dict[str, Any], timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        """Wait for the flatten of a request, starting it if none is running.
+
+        Args:
+            key: Identity of the request; equal keys share one flatten.
+            request: Decoded flatten request.
+            timeout: Seconds to wait for the result, None waits until done.
+
+        Returns:
+            A copy of the shared response, or an overload or timeout error.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            coalesced = flight is not None
+            if flight is not None:
+                flight.waiters += 1
+            elif len(self._flights) >= self.max_pending:
+                logger.warning("Rejecting request, %d pending", len(self._flights))
+                return {
+                    "ok": False,
+                    "overloaded": True,
+                    "error": f"Server overloaded: {self.max_pending} requests pending",
+                }
+            else:
+                future = self._executor.submit(self._run_flight, key, request)
+                flight = self._flights[key] = _Flight(future)
+
+        try:
+            response = dict(flight.future.result(timeout))
+        except FutureTimeoutError:
+            with self._lock:
+                flight.waiters -= 1
+                # Nobody waits for a flatten that did not start yet, drop it
+                if flight.waiters == 0 and flight.future.cancel():
+                    del self._flights[key]
+            return {
+                "ok": False,
+                "timeout": True,
+                "error": f"Timed out after {timeout} seconds",
+            }
+        response["coalesced"] = coalesced
+        return response
+
+    def _run_flight(self, key: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Flatten the document of a request in a worker thread.
+
+        Args:
+            key: Identity of the request.
+            request: Decoded flatten request.
+
+        Returns:
+            Response shared by every request waiting for this flatten.
+        """
+        try:
+            return self.flatten(request)
+        except (LatexExpandError, OSError) as e:
+            return {"ok": False, "error": str(e)}
+        except (KeyError, TypeError, ValueError) as e:
+            return {"ok": False, "error": f"Invalid request: {e!r}"}
+        finally:
+            # Later requests flatten again, and see files changed meanwhile
+            with self._lock:
+                del self._flights[key]
+
+    def _remove_stale_socket(self) -> None:
+        """Remove the socket of a server that is gone.
+
+        Raises:
+            LatexExpandError: If a server is listening on the socket, or the
+                socket cannot be removed.
+        """
+        if not os.path.exists(self.socket_path):
+            return
+        try:
+            request_flatten({"command": "ping"}, self.socket_path, timeout=1.0)
+        except (OSError, ValueError):
+            try:
+                os.unlink(self.socket_path)
+            except OSError as e:
+                raise LatexExpandError(f"Cannot remove stale socket: {e}") from e
+            return
+        raise LatexExpandError(f"A server is already listening on {self.socket_path}")
+
+    def serve_forever(self) -> None:
+        """Listen on the socket and answer requests until shutdown.
+
+        Every connection is served by a thread of its own.
+
+        Raises:
+            LatexExpandError: If a server is already listening on the socket,
+                or the socket cannot be created.
+        """
+        self._remove_stale_socket()
+        try:
+            server = socketserver.ThreadingUnixStreamServer(
+                self.socket_path, _FlattenRequestHandler
+            )
+        except OSError as e:
+            raise LatexExpandError(f"Cannot listen on {self.socket_path}: {e}") from e
+        server.daemon_threads = True
+        setattr(server, "flatten_server", self)
+        self._server = server
+        logger.info("Serving on %s", self.socket_path)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            self._executor.shutdown(wait=True)
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+
+    def shutdown(self) -> None:
+        """Stop serve_forever, from another thread."""
+        if self._server is not None:
+            self._server.shutdown()
+
+
+class _FlattenRequestHandler(socketserver.StreamRequestHandler):
+    """Answer the JSON lines of one client connection."""
+
+    def handle(self) -> None:
+        """Read requests until the client closes the connection."""
+        flatten_server: FlattenServer = getattr(self.server, "flatten_server")
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("expected a JSON object")
+            except ValueError as e:
+                response: Dict[str, Any] = {
+                    "ok": False,
+                    "error": f"Invalid request: {e}",
+                }
+            else:
+                response = flatten_server.handle(request)
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+def request_flatten(
+    request: Dict[str, Any],
+    socket_path: Optional[str] = None,
+    timeout: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Send a request to a running flatten server.
+
+    Args:
+        request: Request to send, see FlattenServer.
+        socket_path: Socket of the server; defaults to the per-user socket.
+        timeout: Seconds to wait for the server, None waits forever.
+
+    Returns:
+        Response of the server.
+
+    Raises:
+        OSError: If no server answers on the socket.
+        LatexExpandError: If the directory of the default socket is unsafe.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path or _default_socket_path())
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The flatten server closed the connection")
+    response: Dict[str, Any] = json.loads(line)
+    return response
+
+
+def _flatten_with_server(
+    socket_path: Optional[str],
+    config: LatexExpandConfig,
+    input_file: str,
+    output_file: str,
+) -> Optional[FlattenStats]:
+    """Flatten a document with a running server, if there is one.
+
+    Args:
+        socket_path: Socket of the server; defaults to the per-user socket.
+        config: Configuration of the document.
+        input_file: Path to input LaTeX file.
+        output_file: Path to output file.
+
+    Returns:
+        Statistics of the server's flatten, or None if no server answered
+        or it was overloaded.
+
+    Raises:
+        LatexExpandError: If the server failed to flatten the document, or
+            the directory of the default socket is unsafe.
+    """
+    socket_path = socket_path or _default_socket_path()
+    request = {
+        "incremental": True,
+        "input": os.path.abspath(input_file),
+        "output": os.path.abspath(output_file),
+        "config": {
+            **asdict(config),
+            # The server resolves paths from its own working directory
+            "root_directory": os.path.abspath(config.root_directory),
+            "manifest_file": config.manifest_file
+            and os.path.abspath(config.manifest_file),
+            "trace_file": config.trace_file and os.path.abspath(config.trace_file),
+        },
+    }
+    try:
+        response = request_flatten(request, socket_path)
+    except (OSError, ValueError) as e:
+        logger.info("No flatten server on %s (%s), flattening here", socket_path, e)
+        return None
+    if response.get("overloaded"):
+        logger.info("%s, flattening here", response["error"])
+        return None
+    if not response.get("ok"):
+        raise LatexExpandError(response.get("error", "Flatten server failed"))
+    return FlattenStats(**response["stats"])
+
+
+def _run_server(args: "argparse.Namespace") -> None:
+    """Run the --serve command line mode until interrupted.
+
+    Args:
+        args: Parsed command line arguments.
+    """
+    try:
+        server = FlattenServer(
+            args.socket, args.serve_workers, args.max_pending, args.request_timeout
+        )
+        print(f"Serving on {server.socket_path}, press Ctrl+C to stop")
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Stopped serving")
+    except LatexExpandError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
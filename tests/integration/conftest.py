@@ -0,0 +1,19 @@
+"""Shared fixtures for the integration tests."""
+
+import os
+import tempfile
+from typing import Iterator
+
+import pytest
+
+
+@pytest.fixture
+def project_dir() -> Iterator[str]:
+    """Run the test inside an empty temporary directory, removed afterwards."""
+    original_cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.chdir(temp_dir)
+        try:
+            yield temp_dir
+        finally:
+            os.chdir(original_cwd)
@@ -0,0 +1,160 @@
+"""Integration tests for the asyncio API."""
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Set
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander, LatexExpandError
+
+
+class TestAsyncFlatten:
+    """Integration tests for aflatten_latex."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a document with nested includes and graphics."""
+        os.makedirs("chapters")
+        os.makedirs("output")
+        main = "\\begin{document}\n"
+        for i in range(8):
+            main += f"\\input{{chapters/ch{i}}}\n"
+            self._write(
+                f"chapters/ch{i}.tex",
+                f"Chapter {i}.\n"
+                f"\\input{{chapters/sec{i}}}\n"
+                f"\\includegraphics{{fig{i}}}\n",
+            )
+            self._write(f"chapters/sec{i}.tex", f"Section {i}.\n")
+            with open(f"fig{i}.png", "wb") as f:
+                f.write(f"figure {i}".encode())
+        main += "\\end{document}\n"
+        self._write("main.tex", main)
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_same_output_as_flatten_latex(self) -> None:
+        """Test that the async API produces the synchronous output."""
+        expander = LatexExpander(LatexExpandConfig(root_directory="."))
+        expected = expander.flatten_latex("main.tex", "output/sync.tex")
+
+        result = asyncio.run(expander.aflatten_latex("main.tex", "output/async.tex"))
+
+        assert result == expected
+        with open("output/async.tex") as f:
+            assert f.read() == expected
+        assert os.path.exists("output/fig7.png")
+
+    def test_includes_are_read_concurrently(self) -> None:
+        """Test that sibling includes are read at the same time."""
+        lock = threading.Lock()
+        active: List[int] = [0, 0]  # current, maximum
+        original_read = LatexExpander._read_file
+
+        def slow_read(expander: LatexExpander, file_path: str) -> str:
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+            return original_read(expander, file_path)
+
+        expander = LatexExpander(LatexExpandConfig(root_directory="."))
+        with patch.object(LatexExpander, "_read_file", slow_read):
+            result = asyncio.run(expander.aflatten_latex("main.tex", ""))
+
+        assert active[1] > 1
+        assert "Section 7." in result
+
+    def test_event_loop_is_not_blocked(self) -> None:
+        """Test that other coroutines run while a document is flattened."""
+        original_read = LatexExpander._read_file
+
+        def slow_read(expander: LatexExpander, file_path: str) -> str:
+            time.sleep(0.01)
+            return original_read(expander, file_path)
+
+        async def run() -> int:
+            ticks = 0
+            expander = LatexExpander(LatexExpandConfig(root_directory="."))
+            task = asyncio.ensure_future(expander.aflatten_latex("main.tex", ""))
+            while not task.done():
+                ticks += 1
+                await asyncio.sleep(0.001)
+            await task
+            return ticks
+
+        with patch.object(LatexExpander, "_read_file", slow_read):
+            assert asyncio.run(run()) > 5
+
+    def test_concurrent_requests_share_expander(self) -> None:
+        """Test that concurrent calls on one expander do not interfere."""
+        expander = LatexExpander(LatexExpandConfig(root_directory="."))
+        expected = expander.flatten_latex("main.tex", "")
+
+        async def run() -> List[str]:
+            return list(
+                await asyncio.gather(
+                    *(expander.aflatten_latex("main.tex", "") for _ in range(10))
+                )
+            )
+
+        assert asyncio.run(run()) == [expected] * 10
+
+    def test_calls_share_the_default_executor(self) -> None:
+        """Test that reads and copies run in the loop's executor, no pool."""
+        threads: Set[str] = set()
+        original_read = LatexExpander._read_file
+        original_copy = LatexExpander._copy_graphics_file
+
+        def tracking_read(expander: LatexExpander, file_path: str) -> str:
+            threads.add(threading.current_thread().name)
+            return original_read(expander, file_path)
+
+        def tracking_copy(expander: LatexExpander, *args: Any) -> None:
+            threads.add(threading.current_thread().name)
+            original_copy(expander, *args)
+
+        config = LatexExpandConfig(
+            root_directory=".", discovery_workers=8, copy_workers=4
+        )
+        expander = LatexExpander(config)
+
+        async def run() -> None:
+            asyncio.get_running_loop().set_default_executor(
+                ThreadPoolExecutor(max_workers=2, thread_name_prefix="loop")
+            )
+            await asyncio.gather(
+                *(
+                    expander.aflatten_latex("main.tex", f"output/doc{i}.tex", False)
+                    for i in range(10)
+                )
+            )
+
+        with (
+            patch.object(LatexExpander, "_read_file", tracking_read),
+            patch.object(LatexExpander, "_copy_graphics_file", tracking_copy),
+        ):
+            asyncio.run(run())
+
+        assert threads and all(name.startswith("loop_") for name in threads)
+        for i in range(10):
+            with open(f"output/doc{i}.tex") as f:
+                assert "Section 7." in f.read()
+        assert os.path.exists("output/fig7.png")
+
+    def test_missing_input_raises(self) -> None:
+        """Test that errors surface as LatexExpandError."""
+        expander = LatexExpander()
+
+        with pytest.raises(LatexExpandError):
+            asyncio.run(expander.aflatten_latex("missing.tex", ""))
@@ -0,0 +1,170 @@
+"""Integration tests for batch flattening."""
+
+import json
+import os
+from typing import List
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from flatexpy.flatexpy_batch import BatchJob, flatten_batch, load_batch_manifest
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpandError,
+    main,
+)
+
+
+class TestBatch:
+    """Integration tests for flattening many documents at once."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create three papers, each with its own chapter and figure."""
+        self.temp_dir = project_dir
+
+        for name in ("paper1", "paper2", "paper3"):
+            os.makedirs(os.path.join(name, "chapters"))
+            self._write(
+                os.path.join(name, "main.tex"),
+                "\\begin{document}\n"
+                "\\input{chapters/body}\n"
+                "\\includegraphics{figure}\n"
+                "\\end{document}\n",
+            )
+            self._write(
+                os.path.join(name, "chapters", "body.tex"), f"Body of {name}.\n"
+            )
+            with open(os.path.join(name, "figure.png"), "wb") as f:
+                f.write(name.encode())
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _read(path: str) -> str:
+        with open(path) as f:
+            return f.read()
+
+    def _jobs(self) -> List[BatchJob]:
+        return [
+            BatchJob(os.path.join(name, "main.tex"), os.path.join("out", name))
+            for name in ("paper1", "paper2", "paper3")
+        ]
+
+    @pytest.mark.parametrize("processes", [1, 2])
+    def test_flatten_batch(self, processes: int) -> None:
+        """Test that every document is flattened from its own directory."""
+        results = flatten_batch(self._jobs(), LatexExpandConfig(), processes)
+
+        assert [result.ok for result in results] == [True, True, True]
+        for name, result in zip(("paper1", "paper2", "paper3"), results):
+            assert result.input_file == os.path.join(name, "main.tex")
+            assert result.output_file == os.path.join("out", name, "main_flattened.tex")
+            assert f"Body of {name}." in self._read(result.output_file)
+            assert self._read(os.path.join("out", name, "figure.png")) == name
+
+    def test_failing_document_does_not_stop_batch(self) -> None:
+        """Test that errors are reported per document."""
+        jobs = self._jobs()
+        jobs.insert(1, BatchJob("missing/main.tex", "out/missing"))
+
+        results = flatten_batch(jobs, LatexExpandConfig(), 2)
+
+        assert [result.ok for result in results] == [True, False, True, True]
+        assert results[1].error is not None
+        assert "main.tex" in results[1].error
+
+    def test_existing_output_dir_requires_overwrite(self) -> None:
+        """Test that output directories are not reused unless allowed."""
+        os.makedirs(os.path.join("out", "paper1"))
+
+        results = flatten_batch(self._jobs(), LatexExpandConfig(), 1)
+        assert [result.ok for result in results] == [False, True, True]
+
+        results = flatten_batch(self._jobs(), LatexExpandConfig(), 1, overwrite=True)
+        assert [result.ok for result in results] == [True, True, True]
+
+    def test_shared_manifest_file_rejected(self) -> None:
+        """Test that one dependency manifest cannot serve a whole batch."""
+        with pytest.raises(ValueError, match="manifest_file"):
+            flatten_batch(self._jobs(), LatexExpandConfig(manifest_file="m.json"))
+
+    def test_load_batch_manifest(self) -> None:
+        """Test that manifest paths are relative to the manifest."""
+        os.makedirs("jobs")
+        self._write(
+            "jobs/batch.json",
+            json.dumps(
+                [
+                    {"input": "../paper1/main.tex", "output": "../out/paper1"},
+                    {"input": "../paper2/main.tex"},
+                ]
+            ),
+        )
+
+        jobs = load_batch_manifest("jobs/batch.json")
+
+        base_dir = os.path.join(self.temp_dir, "jobs")
+        assert jobs == [
+            BatchJob(
+                os.path.join(base_dir, "../paper1/main.tex"),
+                os.path.join(base_dir, "../out/paper1"),
+            ),
+            BatchJob(
+                os.path.join(base_dir, "../paper2/main.tex"),
+                os.path.join(base_dir, "../paper2", "flattened"),
+            ),
+        ]
+
+    def test_load_invalid_batch_manifest(self) -> None:
+        """Test that a malformed manifest raises LatexExpandError."""
+        self._write("batch.json", json.dumps({"input": "paper1/main.tex"}))
+
+        with pytest.raises(LatexExpandError, match="Invalid batch manifest"):
+            load_batch_manifest("batch.json")
+
+    def test_main_batch_report(self) -> None:
+        """Test the --batch command line with a JSON report."""
+        self._write(
+            "batch.json",
+            json.dumps(
+                [
+                    {"input": "paper1/main.tex", "output": "out/paper1"},
+                    {"input": "missing.tex", "output": "out/missing"},
+                ]
+            ),
+        )
+        argv = ["flatexpy", "--batch", "batch.json", "--jobs", "2"]
+        argv += ["--report", "report.json"]
+
+        with (
+            patch("sys.argv", argv),
+            patch("builtins.print") as mock_print,
+            pytest.raises(SystemExit) as excinfo,
+        ):
+            main()
+
+        assert excinfo.value.code == 1
+        mock_print.assert_called_with("Flattened 1 of 2 documents")
+        with open("report.json") as f:
+            report = json.load(f)
+        assert (report["documents"], report["succeeded"], report["failed"]) == (
+            2,
+            1,
+            1,
+        )
+        assert report["results"][0]["ok"] is True
+        assert report["results"][1]["error"]
+
+    @patch("sys.argv", ["flatexpy", "input.tex", "--batch", "batch.json"])
+    @patch("flatexpy.flatexpy_batch.flatten_batch")
+    def test_main_batch_with_input_file(self, mock_batch: MagicMock) -> None:
+        """Test that --batch and input_file are mutually exclusive."""
+        with pytest.raises(SystemExit) as excinfo:
+            main()
+
+        assert excinfo.value.code == 2
+        mock_batch.assert_not_called()
@@ -0,0 +1,127 @@
+"""Integration tests for the benchmark corpus generator and runner."""
+
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+from benchmarks.corpus import CORPORA, generate
+from benchmarks.run import compare, count_calls, measure
+from benchmarks.startup import (
+    DEFERRED_MODULES,
+    MODULE,
+    STARTUP_BUDGET_MS,
+    import_times,
+    measure_startup,
+)
+
+
+@pytest.mark.usefixtures("project_dir")
+class TestBenchmarks:
+    """Integration tests for the benchmark suite at a small scale."""
+
+    @staticmethod
+    def _read_tree(directory: str) -> Dict[str, bytes]:
+        tree = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(root, name)
+                with open(path, "rb") as f:
+                    tree[os.path.relpath(path, directory)] = f.read()
+        return tree
+
+    def test_generator_is_reproducible(self) -> None:
+        """Test that the same seed generates the same corpus."""
+        generate("figures", "first", scale=0.1, seed=3)
+        generate("figures", "second", scale=0.1, seed=3)
+        generate("figures", "other", scale=0.1, seed=4)
+
+        assert self._read_tree("first") == self._read_tree("second")
+        assert self._read_tree("first") != self._read_tree("other")
+
+    @pytest.mark.parametrize("kind", sorted(CORPORA))
+    def test_corpus_flattens(self, kind: str, project_dir: str) -> None:
+        """Test that every corpus flattens and is measured."""
+        result = measure(kind, scale=0.05, repeat=1, min_seconds=0)
+
+        assert result["files"] >= 1
+        assert result["output_bytes"] > 0
+        assert result["mb_per_s"] > 0
+        assert result["calls"]["open"] >= result["files"]
+        assert os.getcwd() == project_dir
+
+    def test_count_calls_restores_functions(self) -> None:
+        """Test that counting calls leaves the wrapped functions untouched."""
+        stat = os.stat
+        with count_calls() as counts:
+            os.stat(".")
+            with open("file.txt", "w"):
+                pass
+
+        assert counts["stat"] == 1
+        assert counts["open"] == 1
+        assert os.stat is stat
+
+    def test_compare_flags_regressions(self) -> None:
+        """Test that slower, bigger or chattier runs are regressions."""
+        base = {
+            "corpus": "wide",
+            "scale": 1.0,
+            "mb_per_s": 10.0,
+            "files_per_s": 1000.0,
+            "peak_rss_kb": 1000,
+            "calls": {"open": 100, "stat": 200},
+        }
+        baseline = {"results": [base]}
+        within = dict(base, mb_per_s=8.0, calls={"open": 105, "stat": 200})
+        regressed = dict(
+            base,
+            files_per_s=500.0,
+            peak_rss_kb=2000,
+            calls={"open": 100, "stat": 400},
+        )
+        other_scale = dict(regressed, scale=0.5)
+
+        assert compare([within], baseline, 0.3, 0.1) == []
+        assert compare([other_scale], baseline, 0.3, 0.1) == []
+        regressions = compare([regressed], baseline, 0.3, 0.1)
+        assert len(regressions) == 3
+        assert any("files_per_s" in regression for regression in regressions)
+        assert any("peak_rss_kb" in regression for regression in regressions)
+        assert any("stat calls" in regression for regression in regressions)
+
+
+class TestStartup:
+    """Tests for the import time of flatexpy."""
+
+    def test_deferred_modules_are_not_imported(self) -> None:
+        """Test that importing flatexpy leaves command specific modules out."""
+        times = import_times()
+
+        assert MODULE in times
+        assert [name for name in DEFERRED_MODULES if name in times] == []
+
+    def test_import_attaches_no_log_handler(self) -> None:
+        """Test that logging is only configured by the command line."""
+        code = (
+            "import logging, flatexpy.flatexpy_core as m; "
+            "print(len(logging.getLogger(m.__name__).handlers))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.dirname(os.path.dirname(__file__))),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+
+        assert output.strip() == "0"
+
+    @pytest.mark.slow
+    def test_import_is_within_budget(self) -> None:
+        """Test that importing flatexpy stays within the startup budget."""
+        times = measure_startup(repeat=3)
+
+        assert times[MODULE] / 1000 <= STARTUP_BUDGET_MS
@@ -0,0 +1,150 @@
+"""Integration tests running the batch and server modes as a command."""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import pytest
+
+from flatexpy.flatexpy_server import FlattenServer, request_flatten
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Ways of running the command line: as a module and as a script
+INVOCATIONS = (
+    ["-m", "flatexpy.flatexpy_core"],
+    [os.path.join(REPO_ROOT, "flatexpy", "flatexpy_core.py")],
+)
+
+
+class TestCliModes:
+    """Integration tests for --batch, --serve and --connect in a subprocess."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project including one chapter."""
+        self.temp_dir = project_dir
+
+        self._write(
+            "main.tex",
+            "\\begin{document}\n\\input{chapter}\n\\end{document}\n",
+        )
+        self._write("chapter.tex", "Chapter.\n")
+        self.socket_path = os.path.join(self.temp_dir, "flatexpy.sock")
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @pytest.fixture(params=INVOCATIONS, ids=["module", "script"], autouse=True)
+    def invocation(self, request: pytest.FixtureRequest) -> None:
+        """Run every test as a module and as a script."""
+        self.invocation_args: List[str] = request.param
+
+    def _command(self, *args: str) -> List[str]:
+        return [sys.executable, *self.invocation_args, *args]
+
+    @staticmethod
+    def _env() -> Dict[str, str]:
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(
+            filter(None, [REPO_ROOT, env.get("PYTHONPATH")])
+        )
+        return env
+
+    def _run(self, *args: str) -> "subprocess.CompletedProcess[str]":
+        return subprocess.run(
+            self._command(*args),
+            env=self._env(),
+            capture_output=True,
+            text=True,
+            timeout=60,
+        )
+
+    def _wait_for_socket(self) -> None:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(self.socket_path):
+            assert time.monotonic() < deadline, "server did not start"
+            time.sleep(0.05)
+
+    def test_batch(self) -> None:
+        """Test that --batch flattens the documents of a manifest."""
+        self._write(
+            "batch.json",
+            json.dumps(
+                [
+                    {"input": "main.tex", "output": "out/ok"},
+                    {"input": "missing.tex", "output": "out/missing"},
+                ]
+            ),
+        )
+
+        completed = self._run("--batch", "batch.json", "--jobs", "2")
+
+        assert completed.returncode == 1
+        assert "Flattened 1 of 2 documents" in completed.stdout
+        assert "Traceback" not in completed.stderr
+        with open(os.path.join("out", "ok", "main_flattened.tex")) as f:
+            assert "Chapter." in f.read()
+
+    def test_serve(self) -> None:
+        """Test that --serve answers requests and reports failures."""
+        server = subprocess.Popen(
+            self._command("--serve", "--socket", self.socket_path),
+            env=self._env(),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        try:
+            self._wait_for_socket()
+            flattened = request_flatten(
+                {
+                    "input": os.path.abspath("main.tex"),
+                    "output": os.path.abspath("flat.tex"),
+                    "return_content": True,
+                },
+                self.socket_path,
+                timeout=30,
+            )
+            missing = request_flatten(
+                {"input": os.path.abspath("missing.tex"), "output": ""},
+                self.socket_path,
+                timeout=30,
+            )
+        finally:
+            server.terminate()
+            _, stderr = server.communicate(timeout=30)
+
+        assert flattened["ok"] and "Chapter." in flattened["content"]
+        assert not missing["ok"] and "missing.tex" in missing["error"]
+        assert "Traceback" not in stderr
+
+    def test_connect(self) -> None:
+        """Test that --connect flattens through a server and reports errors."""
+        server = FlattenServer(self.socket_path)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            self._wait_for_socket()
+            flattened = self._run(
+                "main.tex", "-o", "flat", "--connect", "--socket", self.socket_path
+            )
+            missing = self._run(
+                "missing.tex", "-o", "none", "--connect", "--socket", self.socket_path
+            )
+        finally:
+            server.shutdown()
+            thread.join()
+
+        assert flattened.returncode == 0, flattened.stderr
+        with open(os.path.join("flat", "main_flattened.tex")) as f:
+            assert "Chapter." in f.read()
+        assert missing.returncode == 1
+        assert "Error:" in missing.stdout and "missing.tex" in missing.stdout
+        assert "Traceback" not in missing.stderr
@@ -174,7 +174,7 @@ class TestCommentsIntegration:
 
                 # Verify chapter is included and inline comments preserved
                 assert "Chapter content" in result
-                # assert "% This includes chapter content" in result % FIXME :: currently it does not work
+                assert "% This includes chapter content" in result
                 assert "% inline comment here" in result
 
             finally:
@@ -0,0 +1,120 @@
+"""Integration tests for the parallel discovery phase."""
+
+import os
+import threading
+import time
+from typing import Dict, Iterator, List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    _DirectoryListing,
+    _FlattenContext,
+)
+
+
+class TestDiscovery:
+    """Integration tests for reading the include tree before rendering."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> Iterator[None]:
+        """Create a wide and deep include tree with graphics."""
+        os.makedirs("chapters")
+        os.makedirs("figures")
+        os.makedirs("output")
+        main = "\\graphicspath{{figures/}}\n"
+        for i in range(6):
+            main += f"\\include{{chapters/ch{i}}}\n"
+            self._write(
+                f"chapters/ch{i}.tex",
+                f"Chapter {i}.\n\\input{{chapters/sec{i}}}\n",
+            )
+            self._write(
+                f"chapters/sec{i}.tex",
+                f"Section {i}.\n\\includegraphics{{fig{i}}}\n",
+            )
+            with open(f"figures/fig{i}.png", "wb") as f:
+                f.write(f"figure {i}".encode())
+        # Shared and missing includes are handled as in the rendering pass
+        main += "\\input{chapters/sec0}\n\\input{chapters/missing}\n"
+        self._write("main.tex", main)
+
+        self.lock = threading.Lock()
+        self.active: List[int] = [0, 0]  # current, maximum
+        self.reads: Dict[str, int] = {}
+        original_read = LatexExpander._read_file
+
+        def slow_read(expander: LatexExpander, file_path: str) -> str:
+            with self.lock:
+                self.active[0] += 1
+                self.active[1] = max(self.active)
+                name = os.path.relpath(file_path)
+                self.reads[name] = self.reads.get(name, 0) + 1
+            time.sleep(0.02)
+            with self.lock:
+                self.active[0] -= 1
+            return original_read(expander, file_path)
+
+        self.read_patch = patch.object(LatexExpander, "_read_file", slow_read)
+        self.read_patch.start()
+
+        yield
+        self.read_patch.stop()
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _flatten(discovery_workers: int) -> str:
+        config = LatexExpandConfig(
+            root_directory=".", discovery_workers=discovery_workers
+        )
+        return LatexExpander(config).flatten_latex("main.tex", "output/main.tex")
+
+    def test_files_are_read_concurrently_once(self) -> None:
+        """Test that discovery reads siblings in parallel and each file once."""
+        result = self._flatten(discovery_workers=8)
+
+        assert self.active[1] > 1
+        assert len(self.reads) == 13
+        assert set(self.reads.values()) == {1}
+        assert "\\includegraphics{fig5.png}" in result
+        assert os.path.exists("output/fig5.png")
+
+    def test_same_output_as_sequential_reads(self) -> None:
+        """Test that discovery does not change the rendered document."""
+        parallel = self._flatten(discovery_workers=8)
+        sequential = self._flatten(discovery_workers=1)
+
+        assert parallel == sequential
+        assert self.active[1] > 1
+
+    def test_discovery_can_be_disabled(self) -> None:
+        """Test that one discovery worker reads files one at a time."""
+        self._flatten(discovery_workers=1)
+
+        assert self.active[1] == 1
+        assert len(self.reads) == 13
+
+    def test_graphics_directories_listed_during_discovery(self) -> None:
+        """Test that rendering resolves graphics from the warmed index."""
+        listed_by: List[str] = []
+        original_list = LatexExpander._list_directory
+
+        def tracking_list(
+            expander: LatexExpander, ctx: _FlattenContext, directory: str
+        ) -> _DirectoryListing:
+            if os.path.normpath(directory) not in ctx.dir_index:
+                listed_by.append(threading.current_thread().name)
+            return original_list(expander, ctx, directory)
+
+        with patch.object(LatexExpander, "_list_directory", tracking_list):
+            self._flatten(discovery_workers=8)
+
+        assert listed_by
+        assert all(name.startswith("flatexpy-discover") for name in listed_by)
@@ -0,0 +1,157 @@
+"""Integration tests for incremental flattening with a dependency manifest."""
+
+import json
+import os
+from typing import List, Tuple
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander
+
+
+class TestIncrementalFlatten:
+    """Integration tests for re-flattening with a manifest."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with nested includes and a figure."""
+        os.makedirs("chapters")
+        os.makedirs("figures")
+        os.makedirs("output")
+        self._write(
+            "main.tex",
+            "\\documentclass{article}\n"
+            "\\graphicspath{{figures/}}\n"
+            "\\begin{document}\n"
+            "\\input{chapters/intro}\n"
+            "\\include{chapters/results}\n"
+            "\\end{document}\n",
+        )
+        self._write("chapters/intro.tex", "Introduction text.\n")
+        self._write(
+            "chapters/results.tex",
+            "Results:\n\\includegraphics{plot}\n\\input{chapters/table}\n",
+        )
+        self._write("chapters/table.tex", "A table.\n")
+        with open("figures/plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _flatten(manifest: bool = True) -> str:
+        config = LatexExpandConfig(
+            root_directory=".",
+            manifest_file="output/manifest.json" if manifest else None,
+        )
+        return LatexExpander(config).flatten_latex("main.tex", "output/main.tex")
+
+    def _flatten_reading(self) -> Tuple[str, List[str]]:
+        """Flatten with the manifest and report which files were read."""
+        read_files: List[str] = []
+        original_read = LatexExpander._read_file
+
+        def tracking_read(expander: LatexExpander, file_path: str) -> str:
+            read_files.append(os.path.relpath(file_path))
+            return original_read(expander, file_path)
+
+        with patch.object(LatexExpander, "_read_file", tracking_read):
+            result = self._flatten()
+        return result, read_files
+
+    def test_manifest_is_written(self) -> None:
+        """Test that the manifest records every file of the include tree."""
+        self._flatten()
+
+        with open("output/manifest.json") as f:
+            manifest = json.load(f)
+        assert manifest["root"] == os.path.abspath("main.tex")
+        assert sorted(os.path.relpath(path) for path in manifest["files"]) == [
+            os.path.join("chapters", "intro.tex"),
+            os.path.join("chapters", "results.tex"),
+            os.path.join("chapters", "table.tex"),
+            "main.tex",
+        ]
+        assert list(manifest["graphics"]) == [os.path.join("figures", "plot.png")]
+
+    def test_unchanged_project_is_not_read_again(self) -> None:
+        """Test that a second run reuses the whole tree."""
+        first = self._flatten()
+        os.remove("output/plot.png")
+
+        result, read_files = self._flatten_reading()
+
+        assert read_files == []
+        assert result == first
+        # graphics of reused files are still copied
+        assert os.path.exists("output/plot.png")
+
+    def test_modified_file_reads_only_its_branch(self) -> None:
+        """Test that editing a leaf re-reads only the files above it."""
+        self._flatten()
+        self._write("chapters/table.tex", "An updated table.\n")
+
+        result, read_files = self._flatten_reading()
+
+        assert sorted(read_files) == [
+            os.path.join("chapters", "results.tex"),
+            os.path.join("chapters", "table.tex"),
+            "main.tex",
+        ]
+        assert "An updated table." in result
+        assert result == self._flatten(manifest=False)
+
+    def test_new_graphics_file_invalidates_lookup(self) -> None:
+        """Test that a graphic shadowing a resolved one is picked up."""
+        self._flatten()
+        with open("plot.pdf", "wb") as f:
+            f.write(b"fake PDF data")
+
+        result, read_files = self._flatten_reading()
+
+        assert os.path.join("chapters", "results.tex") in read_files
+        assert os.path.join("chapters", "intro.tex") not in read_files
+        assert "\\includegraphics{plot.pdf}" in result
+
+    def test_new_include_target_invalidates_lookup(self) -> None:
+        """Test that creating a missing include target is picked up."""
+        self._write("chapters/intro.tex", "Intro.\n\\input{chapters/extra}\n")
+        first = self._flatten()
+        assert "\\input{chapters/extra}" in first
+
+        self._write("chapters/extra.tex", "Extra text.\n")
+        result, read_files = self._flatten_reading()
+
+        assert os.path.join("chapters", "intro.tex") in read_files
+        assert "Extra text." in result
+
+    def test_manifest_for_other_config_is_ignored(self) -> None:
+        """Test that records are not reused under a different configuration."""
+        self._flatten()
+
+        config = LatexExpandConfig(
+            root_directory=".",
+            ignore_commented_lines=False,
+            manifest_file="output/manifest.json",
+        )
+        with patch.object(
+            LatexExpander, "_read_file", autospec=True, return_value="Fresh.\n"
+        ) as mock_read:
+            result = LatexExpander(config).flatten_latex("main.tex", "output/main.tex")
+
+        assert mock_read.called
+        assert result == "Fresh.\n"
+
+    def test_corrupt_manifest_is_ignored(self) -> None:
+        """Test that an unreadable manifest falls back to a full run."""
+        self._write("output/manifest.json", "{not json")
+
+        result = self._flatten()
+
+        assert result == self._flatten(manifest=False)
+        with open("output/manifest.json") as f:
+            assert json.load(f)["files"]
@@ -0,0 +1,232 @@
+"""Integration tests for flattening memory-mapped source files."""
+
+import errno
+import json
+import os
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander, main
+
+
+class TestMappedFiles:
+    """Integration tests comparing mapped files with decoded ones."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with figures and a data file."""
+        os.makedirs("figures")
+        os.makedirs("output")
+        with open("figures/plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+        self._write(
+            "data.tex",
+            "x y\r\n1 2\r\n% \\input{hidden}\r\n3 4\rend\n".encode("utf-8"),
+        )
+
+    @staticmethod
+    def _write(path: str, content: bytes) -> None:
+        with open(path, "wb") as f:
+            f.write(content)
+
+    @staticmethod
+    def _flatten(mmap_threshold: int, encoding: str = "utf-8") -> str:
+        config = LatexExpandConfig(
+            root_directory=".",
+            output_encoding=encoding,
+            mmap_threshold=mmap_threshold,
+        )
+        result = LatexExpander(config).flatten_with_stats("main.tex", "output/main.tex")
+        assert result.stats.files_mapped == (2 if mmap_threshold else 0)
+        return result.content
+
+    @pytest.mark.parametrize("chunk", [1, 7, 1 << 20])
+    def test_output_matches_decoded_files(self, chunk: int) -> None:
+        """Test that mapping changes nothing, even with chunks splitting text."""
+        self._write(
+            "main.tex",
+            (
+                "Équations — \\graphicspath{{figures/}}\r\n"
+                "\\input{data}\r\n"
+                "\u00a0% \\includegraphics{hidden}\n"
+                "\\includegraphics[width=0.5\\textwidth, alt=été]{plot}\r"
+                "après \\input{missing}\n"
+                "end"
+            ).encode("utf-8"),
+        )
+        expected = self._flatten(0)
+
+        with patch("flatexpy.flatexpy_core._MAPPED_CHUNK", chunk):
+            assert self._flatten(1) == expected
+        assert "alt=été]{plot.png}" in expected
+        assert "% >>> input{data} >>>\nx y\n1 2\n" in expected
+
+    def test_latin1_file(self) -> None:
+        """Test that single byte encodings are mapped as well."""
+        self._write("main.tex", "Caf\u00e9\n\\input{data}\n".encode("latin-1"))
+
+        assert self._flatten(1, "latin-1") == self._flatten(0, "latin-1")
+
+    def test_small_files_are_not_mapped(self) -> None:
+        """Test that files below the threshold are read as before."""
+        self._write("main.tex", b"\\input{data}\n")
+        config = LatexExpandConfig(root_directory=".", mmap_threshold=1 << 20)
+
+        result = LatexExpander(config).flatten_with_stats("main.tex", "output/main.tex")
+
+        assert result.stats.files_mapped == 0
+        assert "1 2" in result.content
+
+    def test_other_encodings_are_not_mapped(self) -> None:
+        """Test that encodings whose bytes may hide commands are decoded."""
+        self._write("main.tex", "\\input{data}\n".encode("utf-16"))
+        self._write("data.tex", "Data.\n".encode("utf-16"))
+        config = LatexExpandConfig(
+            root_directory=".", output_encoding="utf-16", mmap_threshold=1
+        )
+
+        result = LatexExpander(config).flatten_with_stats("main.tex", "output/main.tex")
+
+        assert result.stats.files_mapped == 0
+        assert "Data." in result.content
+
+    def test_cli_mmap_threshold(self) -> None:
+        """Test that --mmap-threshold maps the files above it."""
+        self._write("main.tex", b"\\input{data}\n")
+        argv = ["flatexpy", "main.tex", "-f", "--mmap-threshold", "20"]
+        argv += ["--stats-format", "json"]
+
+        with patch("sys.argv", argv), patch("builtins.print") as mock_print:
+            main()
+
+        stats = json.loads(mock_print.call_args_list[-1].args[0])
+        assert (stats["files_read"], stats["files_mapped"]) == (2, 1)
+
+    def test_negative_threshold_is_rejected(self) -> None:
+        """Test that the threshold cannot be negative."""
+        with pytest.raises(ValueError, match="mmap_threshold"):
+            LatexExpandConfig(mmap_threshold=-1)
+
+
+class TestPassthrough:
+    """Integration tests for copying spans of mapped files unchanged."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with a large data file."""
+        os.makedirs("output")
+        with open("plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+        with open("main.tex", "wb") as f:
+            f.write("Début\n\\input{data}\nFin \\includegraphics{plot}\n".encode())
+        with open("data.tex", "wb") as f:
+            f.write("1 2 é\n".encode() * 5000 + b"\\includegraphics{plot}\n")
+            f.write(b"3 4\r\n" * 10 + b"5 6\n" * 5000)
+
+    @staticmethod
+    def _flatten(mmap_threshold: int = 1) -> int:
+        """Flatten to output/main.tex, returning the bytes passed through."""
+        config = LatexExpandConfig(root_directory=".", mmap_threshold=mmap_threshold)
+        result = LatexExpander(config).flatten_with_stats(
+            "main.tex", "output/main.tex", return_content=False
+        )
+        return result.stats.bytes_passed_through
+
+    @staticmethod
+    def _output() -> bytes:
+        with open("output/main.tex", "rb") as f:
+            return f.read()
+
+    def _expected(self) -> bytes:
+        assert self._flatten(0) == 0
+        return self._output()
+
+    @pytest.mark.parametrize("kernel_copy_min", [1, 1 << 16, 1 << 30])
+    def test_output_matches_decoded_files(self, kernel_copy_min: int) -> None:
+        """Test that passing spans through, in any way, changes nothing."""
+        expected = self._expected()
+
+        with patch("flatexpy.flatexpy_core._KERNEL_COPY_MIN", kernel_copy_min):
+            passed_through = self._flatten()
+
+        assert self._output() == expected
+        assert b"% >>> input{data} >>>\n1 2" in expected
+        # The span with carriage returns is translated, not passed through
+        translated = len(b"\n" + b"3 4\r\n" * 10 + b"5 6\n" * 5000)
+        commands = len(b"\\includegraphics{plot}") * 2 + len(b"\\input{data}\n")
+        sources = os.path.getsize("main.tex") + os.path.getsize("data.tex")
+        assert passed_through == sources - commands - translated
+
+    def test_small_queue_limits(self) -> None:
+        """Test that the write queue keeps the order when flushed often."""
+        expected = self._expected()
+
+        with patch("flatexpy.flatexpy_core._IOV_MAX", 2), patch(
+            "flatexpy.flatexpy_core._SINK_FLUSH_BYTES", 3
+        ):
+            self._flatten()
+
+        assert self._output() == expected
+
+    @pytest.mark.parametrize(
+        "failing", [("copy_file_range",), ("copy_file_range", "sendfile")]
+    )
+    def test_unsupported_kernel_copies_fall_back(self, failing: tuple) -> None:
+        """Test that spans are still written when kernel copies fail."""
+        expected = self._expected()
+
+        def unsupported(*args: object) -> int:
+            raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+        patches = [patch(f"os.{name}", unsupported, create=True) for name in failing]
+        with patch("flatexpy.flatexpy_core._KERNEL_COPY_MIN", 1):
+            for active in patches:
+                active.start()
+            try:
+                self._flatten()
+            finally:
+                for active in patches:
+                    active.stop()
+
+        assert self._output() == expected
+
+    def test_returned_content_is_decoded(self) -> None:
+        """Test that spans are decoded when the content is returned as well."""
+        expected = self._expected()
+        config = LatexExpandConfig(root_directory=".", mmap_threshold=1)
+
+        result = LatexExpander(config).flatten_with_stats("main.tex", "output/main.tex")
+
+        assert result.stats.bytes_passed_through == 0
+        assert result.content.encode() == expected == self._output()
+
+    def test_incremental_runs_pass_spans_through(self) -> None:
+        """Test that recorded spans are passed through, when written and reused."""
+        expected = self._expected()
+        config = LatexExpandConfig(
+            root_directory=".",
+            mmap_threshold=1,
+            manifest_file="manifest.json",
+        )
+
+        first = LatexExpander(config).flatten_with_stats(
+            "main.tex", "output/main.tex", return_content=False
+        )
+        second = LatexExpander(config).flatten_with_stats(
+            "main.tex", "output/main.tex", return_content=False
+        )
+        with open("manifest.json") as f:
+            pieces = json.load(f)["files"][os.path.abspath("data.tex")]["pieces"]
+        decoded = LatexExpander(config).flatten_with_stats(
+            "main.tex", "output/main.tex"
+        )
+
+        assert self._output() == expected
+        assert first.stats.bytes_passed_through > 0
+        assert second.stats.files_reused == 2
+        assert second.stats.bytes_passed_through == first.stats.bytes_passed_through
+        assert sum("span" in piece for piece in pieces if isinstance(piece, dict)) == 1
+        # Recorded spans are decoded when the content is returned
+        assert decoded.stats.files_reused == 2
+        assert decoded.content.encode() == expected
@@ -1,7 +1,11 @@
 """Integration tests for performance and system limits."""
 
+import logging
 import os
+import sys
 import tempfile
+import time
+from typing import Tuple
 
 import pytest
 
@@ -102,6 +106,48 @@ class TestPerformance:
             finally:
                 os.chdir(original_cwd)
 
+    @staticmethod
+    def _flatten_nested_chain(depth: int) -> Tuple[str, float]:
+        """Flatten a chain of nested includes and time the flattening."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for i in range(depth):
+                content = f"Level {i:05d} content.\n"
+                if i < depth - 1:
+                    content += f"\\input{{level{i+1:05d}}}\n"
+                with open(os.path.join(temp_dir, f"level{i:05d}.tex"), "w") as f:
+                    f.write(content)
+
+            config = LatexExpandConfig(root_directory=temp_dir)
+            expander = LatexExpander(config)
+            start = time.perf_counter()
+            result = expander.flatten_latex(
+                os.path.join(temp_dir, "level00000.tex"),
+                os.path.join(temp_dir, "main_flat.tex"),
+            )
+            return result, time.perf_counter() - start
+
+    @pytest.mark.slow
+    def test_very_deep_includes_scale_linearly(self) -> None:
+        """Test that include depth is not bounded by the recursion limit."""
+        depth = 10000
+        assert depth > sys.getrecursionlimit()
+
+        logging.disable(logging.INFO)
+        try:
+            result, elapsed = self._flatten_nested_chain(depth)
+            _, elapsed_quarter = self._flatten_nested_chain(depth // 4)
+        finally:
+            logging.disable(logging.NOTSET)
+
+        assert "Level 00000 content." in result
+        assert f"Level {depth - 1:05d} content." in result
+        assert result.count(">>> input{") == depth - 1
+        assert result.count("<<< input{") == depth - 1
+
+        # Linear time: 4x the depth should take about 4x as long, a quadratic
+        # walker would take about 16x.
+        assert elapsed < 10 * elapsed_quarter + 0.5
+
     def test_large_file_content(self) -> None:
         """Test flattening with large file content."""
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -0,0 +1,292 @@
+"""Integration tests for the persistent scan cache."""
+
+import json
+import os
+import threading
+import time
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_batch import BatchJob, flatten_batch
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    main,
+)
+
+
+class TestScanCache:
+    """Integration tests for sharing scans of source files across runs."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with an include and a figure."""
+        os.makedirs("chapters")
+        os.makedirs("figures")
+        os.makedirs("output")
+        self._write(
+            "main.tex",
+            "\\documentclass{article}\n"
+            "\\graphicspath{{figures/}}\n"
+            "\\begin{document}\n"
+            "\\input{chapters/intro}\n"
+            "\\end{document}\n",
+        )
+        self._write("chapters/intro.tex", "Intro.\n\\includegraphics{plot}\n")
+        with open("figures/plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _expander(**kwargs: object) -> LatexExpander:
+        # Cache the small files of the test project too, unless asked otherwise
+        options = {"root_directory": ".", "cache_dir": "cache", "cache_min_bytes": 0}
+        options.update(kwargs)
+        config = LatexExpandConfig(**options)
+        return LatexExpander(config)
+
+    def _flatten_scanning(self, **kwargs: object) -> List[str]:
+        """Flatten with a fresh expander and report the scanned buffers."""
+        scanned: List[str] = []
+        original_scan = LatexExpander._scan_commands
+
+        def tracking_scan(expander: LatexExpander, text: str) -> object:
+            scanned.append(text)
+            return original_scan(expander, text)
+
+        with patch.object(LatexExpander, "_scan_commands", tracking_scan):
+            self._expander(**kwargs).flatten_latex("main.tex", "output/main.tex")
+        return scanned
+
+    @staticmethod
+    def _cache_entries() -> List[str]:
+        return [
+            os.path.join(root, name)
+            for root, _, names in os.walk("cache")
+            for name in names
+            if name.endswith(".json")
+        ]
+
+    def test_second_run_reuses_scans(self) -> None:
+        """Test that a new expander finds the scans of the first one."""
+        first = self._flatten_scanning()
+        assert len(first) == 2
+        assert len(self._cache_entries()) == 2
+
+        assert self._flatten_scanning() == []
+
+    def test_output_matches_uncached_run(self) -> None:
+        """Test that a run from the cache produces the same document."""
+        expected = LatexExpander(LatexExpandConfig(root_directory=".")).flatten_latex(
+            "main.tex", "output/main.tex"
+        )
+        self._expander().flatten_latex("main.tex", "output/main.tex")
+        cached = self._expander().flatten_latex("main.tex", "output/main.tex")
+
+        assert cached == expected
+        assert os.path.exists("output/plot.png")
+
+    def test_modified_file_is_scanned_again(self) -> None:
+        """Test that a file whose size or mtime changed misses the cache."""
+        self._flatten_scanning()
+        self._write("chapters/intro.tex", "Updated intro.\n")
+
+        scanned = self._flatten_scanning()
+
+        assert scanned == ["Updated intro.\n"]
+
+    def test_other_configuration_does_not_share_entries(self) -> None:
+        """Test that scans depending on the configuration are not mixed up."""
+        self._flatten_scanning()
+
+        scanned = self._flatten_scanning(ignore_commented_lines=False)
+
+        assert len(scanned) == 2
+
+    def test_stale_entry_is_scanned_again(self) -> None:
+        """Test that an entry whose offsets do not match falls back to a scan."""
+        self._flatten_scanning()
+        for entry_path in self._cache_entries():
+            with open(entry_path) as f:
+                entry = json.load(f)
+            entry["offsets"] = [offset + 1 for offset in entry["offsets"]]
+            with open(entry_path, "w") as f:
+                json.dump(entry, f)
+
+        scanned = self._flatten_scanning()
+
+        assert len(scanned) == 2
+
+    def test_corrupt_entry_is_ignored(self) -> None:
+        """Test that an unreadable entry is treated as a miss."""
+        self._flatten_scanning()
+        for entry_path in self._cache_entries():
+            self._write(entry_path, "{not json")
+
+        result = self._expander().flatten_latex("main.tex", "output/main.tex")
+
+        assert "Intro." in result
+
+    def test_entries_over_size_limit_are_evicted(self) -> None:
+        """Test that the least recently used entries are evicted first."""
+        self._flatten_scanning()
+        old_entries = self._cache_entries()
+        limit = sum(os.path.getsize(entry_path) for entry_path in old_entries)
+        # Older than the interval at which the last use of an entry is updated
+        past = time.time() - 2 * 60 * 60
+        for entry_path in old_entries:
+            os.utime(entry_path, (past, past))
+
+        # The new scan of intro.tex is smaller than the one it replaces
+        self._write("chapters/intro.tex", "Updated intro.\n")
+        self._flatten_scanning(cache_max_bytes=limit)
+
+        remaining = self._cache_entries()
+        assert len(remaining) == 2
+        assert len(set(remaining) & set(old_entries)) == 1
+        assert self._flatten_scanning() == []
+
+    def test_hits_only_read_recently_used_entries(self) -> None:
+        """Test that a hit does not write the last use time on every run."""
+        self._flatten_scanning()
+        recent = time.time() - 10 * 60
+        for entry_path in self._cache_entries():
+            os.utime(entry_path, (recent, recent))
+
+        assert self._flatten_scanning() == []
+
+        for entry_path in self._cache_entries():
+            assert os.path.getmtime(entry_path) == recent
+
+    def test_small_files_bypass_the_cache(self) -> None:
+        """Test that files below cache_min_bytes are scanned, not looked up."""
+        self._write("chapters/intro.tex", "Intro.\n" * 200)
+
+        scanned = self._flatten_scanning(cache_min_bytes=1024)
+
+        assert len(scanned) == 2
+        assert len(self._cache_entries()) == 1
+
+    def test_expired_entries_are_evicted(self) -> None:
+        """Test that entries unused for longer than the maximum age go away."""
+        self._flatten_scanning()
+        past = time.time() - 2 * 24 * 60 * 60
+        for entry_path in self._cache_entries():
+            os.utime(entry_path, (past, past))
+
+        self._write("chapters/intro.tex", "Updated intro.\n")
+        self._flatten_scanning(cache_max_age_days=1)
+
+        # main.tex was used again, only the old scan of intro.tex expired
+        assert len(self._cache_entries()) == 2
+
+    def test_stats_count_hits_and_misses(self) -> None:
+        """Test that the statistics describe the directory and the lookups."""
+        first = self._expander()
+        first.flatten_latex("main.tex", "output/main.tex")
+        second = self._expander()
+        second.flatten_latex("main.tex", "output/main.tex")
+
+        stats = second.scan_cache_stats()
+        assert (stats.entries, stats.hits, stats.misses, stats.stores) == (2, 2, 0, 0)
+        assert stats.total_bytes > 0
+        assert stats.hit_rate == 1.0
+        assert first.scan_cache_stats().misses == 2
+
+    def test_concurrent_expanders_scan_each_file_once(self) -> None:
+        """Test that jobs missing the same entry wait for the one scanning it."""
+        expanders = [self._expander(discovery_workers=1) for _ in range(4)]
+        barrier = threading.Barrier(len(expanders))
+
+        def run(expander: LatexExpander) -> None:
+            barrier.wait()
+            expander.flatten_latex("main.tex", "")
+
+        threads = [
+            threading.Thread(target=run, args=(expander,)) for expander in expanders
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = [expander.scan_cache_stats() for expander in expanders]
+        assert sum(stat.misses for stat in stats) == 2
+        assert sum(stat.hits for stat in stats) == 6
+        assert len(self._cache_entries()) == 2
+        assert not any(
+            name.endswith(".lock") for _, _, names in os.walk("cache") for name in names
+        )
+
+    def test_misses_leave_no_lock_files(self) -> None:
+        """Test that the lock of an entry is removed once the entry is stored."""
+        self._flatten_scanning(discovery_workers=1)
+        self._flatten_scanning(discovery_workers=4)
+
+        files = [name for _, _, names in os.walk("cache") for name in names]
+        assert len(files) == 2
+        assert all(name.endswith(".json") for name in files)
+
+    def test_parallel_batch_shares_cache(self) -> None:
+        """Test that worker processes fill one cache without corrupting it."""
+        jobs = []
+        for index in range(4):
+            self._write(f"paper{index}.tex", "\\input{chapters/intro}\n")
+            jobs.append(BatchJob(f"paper{index}.tex", f"out{index}"))
+        config = LatexExpandConfig(cache_dir="cache", cache_min_bytes=0)
+
+        results = flatten_batch(jobs, config, processes=4)
+
+        assert all(result.ok for result in results)
+        for entry_path in self._cache_entries():
+            with open(entry_path) as f:
+                assert "offsets" in json.load(f)
+        expander = LatexExpander(config)
+        for job in jobs:
+            expander.flatten_latex(job.input_file, "")
+        assert expander.scan_cache_stats().misses == 0
+
+    def test_clean_removes_leftovers_and_expired_entries(self) -> None:
+        """Test that cleaning evicts entries and files of crashed jobs."""
+        self._flatten_scanning()
+        leftover = os.path.join(os.path.dirname(self._cache_entries()[0]), "x.part")
+        self._write(leftover, "{")
+        past = time.time() - 2 * 24 * 60 * 60
+        for path in [leftover] + self._cache_entries():
+            os.utime(path, (past, past))
+
+        removed = self._expander(cache_max_age_days=1).clean_scan_cache()
+
+        assert removed == 2
+        assert self._cache_entries() == []
+        assert not os.path.exists(leftover)
+
+    def test_cli_cache_uses_default_directory(self) -> None:
+        """Test that --cache before the input file caches in the user cache."""
+        self._write("chapters/intro.tex", "Intro.\n" * 12000)
+        with patch.dict(os.environ, {"XDG_CACHE_HOME": os.path.abspath("xdg")}), patch(
+            "sys.argv", ["flatexpy", "--cache", "main.tex", "-f"]
+        ), patch("builtins.print"):
+            main()
+
+        assert os.path.exists(os.path.join("flat", "main_flattened.tex"))
+        entries = [name for _, _, names in os.walk("xdg/flatexpy") for name in names]
+        assert len(entries) == 1 and entries[0].endswith(".json")
+
+    def test_cli_cache_stats(self) -> None:
+        """Test that --cache-stats reports the entries without an input file."""
+        self._flatten_scanning()
+
+        with patch(
+            "sys.argv", ["flatexpy", "--cache-stats", "--cache-dir", "cache"]
+        ), patch("builtins.print") as mock_print:
+            main()
+
+        printed = [call.args[0] for call in mock_print.call_args_list]
+        assert "Entries: 2" in printed
@@ -0,0 +1,392 @@
+"""Integration tests for the flatten server and its clients."""
+
+import os
+import stat
+import threading
+import time
+from typing import Any, Dict, Iterator, List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    main,
+)
+from flatexpy.flatexpy_server import FlattenServer, request_flatten
+
+
+class TestFlattenServer:
+    """Integration tests for flattening through a Unix domain socket."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> Iterator[None]:
+        """Create a project and start a server in a thread."""
+        self.temp_dir = project_dir
+
+        os.makedirs("chapters")
+        os.makedirs("figures")
+        os.makedirs("output")
+        self._write(
+            "main.tex",
+            "\\documentclass{article}\n"
+            "\\graphicspath{{figures/}}\n"
+            "\\begin{document}\n"
+            "\\input{chapters/intro}\n"
+            "\\end{document}\n",
+        )
+        self._write("chapters/intro.tex", "Intro.\n\\includegraphics{plot}\n")
+        with open("figures/plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+
+        self.socket_path = os.path.join(self.temp_dir, "flatexpy.sock")
+        self.server = FlattenServer(self.socket_path)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        deadline = time.monotonic() + 5
+        while not os.path.exists(self.socket_path):
+            assert time.monotonic() < deadline, "server did not start"
+            time.sleep(0.01)
+
+        yield
+        self.server.shutdown()
+        self.thread.join()
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    def _request(
+        self, incremental: bool = True, return_content: bool = True, **config: Any
+    ) -> Dict[str, Any]:
+        return request_flatten(
+            {
+                "input": os.path.abspath("main.tex"),
+                "output": os.path.abspath("output/main.tex"),
+                "config": {"root_directory": self.temp_dir, **config},
+                "return_content": return_content,
+                "incremental": incremental,
+            },
+            self.socket_path,
+            timeout=10,
+        )
+
+    def _request_reading(self) -> List[str]:
+        """Send a request and report which files the server read."""
+        read_files: List[str] = []
+        original_read = LatexExpander._read_file
+
+        def tracking_read(expander: LatexExpander, file_path: str) -> str:
+            read_files.append(os.path.relpath(file_path))
+            return original_read(expander, file_path)
+
+        with patch.object(LatexExpander, "_read_file", tracking_read):
+            assert self._request()["ok"]
+        return read_files
+
+    def test_flatten_matches_in_process(self) -> None:
+        """Test that the server produces the document flattened locally."""
+        expected = LatexExpander(LatexExpandConfig(root_directory=".")).flatten_latex(
+            "main.tex", ""
+        )
+
+        response = self._request()
+
+        assert response["ok"]
+        assert response["content"] == expected
+        with open("output/main.tex") as f:
+            assert f.read() == expected
+        assert os.path.exists("output/plot.png")
+
+    def test_ping(self) -> None:
+        """Test that a ping reports the server process."""
+        response = request_flatten({"command": "ping"}, self.socket_path, timeout=10)
+
+        assert response == {"ok": True, "pid": os.getpid()}
+
+    def test_unchanged_document_is_not_read_again(self) -> None:
+        """Test that the server reuses the records of its previous request."""
+        self._request()
+
+        assert self._request_reading() == []
+        assert self._request()["stats"]["files_reused"] == 2
+
+        self._write("chapters/intro.tex", "Updated intro.\n")
+        assert sorted(self._request_reading()) == [
+            os.path.join("chapters", "intro.tex"),
+            "main.tex",
+        ]
+
+    def test_records_are_opt_in(self) -> None:
+        """Test that only incremental requests leave records on the server."""
+        self._request(incremental=False)
+
+        assert not self.server._records
+        assert len(self._request_reading()) == 2
+
+    def test_records_are_bounded_by_size(self) -> None:
+        """Test that records beyond the size bound are dropped."""
+        with patch("flatexpy.flatexpy_server._SERVER_MAX_RECORD_CHARS", 10):
+            self._request()
+
+        assert not self.server._records
+        assert not self.server._record_chars
+
+    def test_recorded_mapped_files_are_passed_through(self) -> None:
+        """Test that recorded and reused spans of mapped files skip decoding."""
+        expected = LatexExpander(LatexExpandConfig(root_directory=".")).flatten_latex(
+            "main.tex", ""
+        )
+
+        first = self._request(return_content=False, mmap_threshold=1)
+        second = self._request(return_content=False, mmap_threshold=1)
+
+        assert first["stats"]["bytes_passed_through"] > 0
+        assert second["stats"]["files_reused"] == 2
+        assert second["stats"]["bytes_passed_through"] > 0
+        with open("output/main.tex") as f:
+            assert f.read() == expected
+        recorded = [
+            piece
+            for records in self.server._records.values()
+            for record in records.values()
+            for piece in record.pieces
+        ]
+        assert {"span": [0, 7]} in recorded  # "Intro.\n" of chapters/intro.tex
+
+    def test_new_graphic_invalidates_directory_listing(self) -> None:
+        """Test that a graphic added between requests is found."""
+        self._request()
+        with open("figures/plot.pdf", "wb") as f:
+            f.write(b"fake PDF data")
+
+        response = self._request()
+
+        assert "\\includegraphics{plot.pdf}" in response["content"]
+
+    def test_errors_are_reported(self) -> None:
+        """Test that failures come back as error responses."""
+        missing = request_flatten(
+            {"input": os.path.abspath("missing.tex"), "output": ""},
+            self.socket_path,
+            timeout=10,
+        )
+        invalid = self._request(graphics_mode="teleport")
+        malformed = request_flatten({"output": ""}, self.socket_path, timeout=10)
+
+        assert not missing["ok"] and "missing.tex" in missing["error"]
+        assert not invalid["ok"] and "graphics_mode" in invalid["error"]
+        assert not malformed["ok"] and "Invalid request" in malformed["error"]
+
+    def test_expanders_are_bounded(self) -> None:
+        """Test that the least recently used configurations are dropped."""
+        with patch("flatexpy.flatexpy_server._SERVER_MAX_CONFIGURATIONS", 2):
+            first, _ = self.server._expander(LatexExpandConfig(copy_workers=1))
+            second, _ = self.server._expander(LatexExpandConfig(copy_workers=2))
+            self.server._expander(LatexExpandConfig(copy_workers=1))
+            third, _ = self.server._expander(LatexExpandConfig(copy_workers=3))
+
+        assert list(self.server._expanders) == [first, third]
+        assert second not in self.server._expanders
+
+    def test_second_server_on_socket_is_refused(self) -> None:
+        """Test that a live socket is not taken over."""
+        with pytest.raises(Exception, match="already listening"):
+            FlattenServer(self.socket_path).serve_forever()
+
+    def test_cli_connect_uses_server(self) -> None:
+        """Test that --connect hands the document over to the server."""
+        with patch(
+            "sys.argv",
+            ["flatexpy", "--connect", "main.tex", "-f", "--socket", self.socket_path],
+        ), patch.object(
+            LatexExpander, "flatten_latex", side_effect=AssertionError
+        ), patch(
+            "builtins.print"
+        ):
+            main()
+
+        assert os.path.exists(os.path.join("flat", "main_flattened.tex"))
+
+    def test_cli_connect_falls_back_in_process(self) -> None:
+        """Test that --connect flattens locally when no server answers."""
+        with patch(
+            "sys.argv",
+            ["flatexpy", "main.tex", "-f", "--connect", "--socket", "missing.sock"],
+        ), patch("builtins.print"):
+            main()
+
+        assert os.path.exists(os.path.join("flat", "main_flattened.tex"))
+
+
+class TestServerSocket:
+    """Integration tests for where the server socket lives."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> Iterator[None]:
+        """Use an empty temporary directory without a runtime directory."""
+        self.temp_dir = project_dir
+        self.patchers = [
+            patch.dict(os.environ),
+            patch("tempfile.tempdir", self.temp_dir),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        os.environ.pop("XDG_RUNTIME_DIR", None)
+        self.socket_dir = os.path.join(self.temp_dir, f"flatexpy-{os.getuid()}")
+
+        yield
+        for patcher in reversed(self.patchers):
+            patcher.stop()
+
+    def test_default_socket_is_in_private_directory(self) -> None:
+        """Test that the default socket directory is created for the user only."""
+        server = FlattenServer()
+
+        assert server.socket_path == os.path.join(self.socket_dir, "flatexpy.sock")
+        assert stat.S_IMODE(os.stat(self.socket_dir).st_mode) == 0o700
+
+    def test_runtime_directory_is_preferred(self) -> None:
+        """Test that $XDG_RUNTIME_DIR holds the socket when it is set."""
+        os.environ["XDG_RUNTIME_DIR"] = self.temp_dir
+
+        server = FlattenServer()
+
+        assert server.socket_path == os.path.join(self.temp_dir, "flatexpy.sock")
+        assert not os.path.exists(self.socket_dir)
+
+    @pytest.mark.parametrize("unsafe", ["open", "symlink"])
+    def test_unsafe_socket_directory_is_refused(self, unsafe: str) -> None:
+        """Test that a directory others can access or replace is not used."""
+        if unsafe == "open":
+            os.mkdir(self.socket_dir, 0o700)
+            os.chmod(self.socket_dir, 0o777)
+        else:
+            os.mkdir("elsewhere", 0o700)
+            os.symlink("elsewhere", self.socket_dir)
+
+        with pytest.raises(LatexExpandError, match="only you can access"):
+            FlattenServer()
+        with pytest.raises(LatexExpandError, match="only you can access"):
+            request_flatten({"command": "ping"})
+
+    def test_stale_socket_that_cannot_be_removed(self) -> None:
+        """Test that a socket left behind and not removable is an error."""
+        with open("stale.sock", "w"):
+            pass
+
+        with patch("os.unlink", side_effect=PermissionError("not yours")), patch(
+            "sys.argv", ["flatexpy", "--serve", "--socket", "stale.sock"]
+        ), patch("builtins.print") as mock_print, pytest.raises(SystemExit):
+            main()
+
+        mock_print.assert_called_with("Error: Cannot remove stale socket: not yours")
+
+
+class TestServerBackpressure:
+    """Integration tests for coalescing, overload rejection and timeouts."""
+
+    def setup_method(self) -> None:
+        """Create a server whose flattens block until released."""
+        self.release = threading.Event()
+        self.calls: List[str] = []
+        self.threads: List[threading.Thread] = []
+        self.server = FlattenServer("unused.sock", workers=1, max_pending=2)
+
+        def blocking_flatten(request: Dict[str, Any]) -> Dict[str, Any]:
+            self.calls.append(request["input"])
+            assert self.release.wait(10)
+            return {"ok": True, "output": "", "content": "x" * 1000}
+
+        self.patcher = patch.object(self.server, "flatten", blocking_flatten)
+        self.patcher.start()
+
+    def teardown_method(self) -> None:
+        """Release blocked flattens and stop the workers."""
+        self.release.set()
+        self.server._executor.shutdown(wait=True)
+        self.patcher.stop()
+
+    def _start(self, input_file: str, **request: Any) -> List[Dict[str, Any]]:
+        """Send a request from a thread; its response is appended to the list."""
+        responses: List[Dict[str, Any]] = []
+
+        def send() -> None:
+            responses.append(self.server.handle({"input": input_file, **request}))
+
+        thread = threading.Thread(target=send)
+        thread.start()
+        self.threads.append(thread)
+        return responses
+
+    def _wait_for(self, condition: Any) -> None:
+        deadline = time.monotonic() + 5
+        while not condition():
+            assert time.monotonic() < deadline, "condition not reached"
+            time.sleep(0.01)
+
+    def _join(self) -> None:
+        self.release.set()
+        for thread in self.threads:
+            thread.join()
+
+    def test_identical_requests_share_one_flatten(self) -> None:
+        """Test that concurrent identical requests are flattened once."""
+        responses = [self._start("/doc/main.tex") for _ in range(3)]
+        self._wait_for(
+            lambda: sum(f.waiters for f in self.server._flights.values()) == 3
+        )
+
+        self._join()
+
+        assert self.calls == ["/doc/main.tex"]
+        results = [response[0] for response in responses]
+        assert all(result["ok"] for result in results)
+        assert sorted(result["coalesced"] for result in results) == [
+            False,
+            True,
+            True,
+        ]
+        # Later requests flatten again
+        self.server.handle({"input": "/doc/main.tex"})
+        assert len(self.calls) == 2
+
+    def test_requests_over_limit_are_rejected(self) -> None:
+        """Test that distinct requests beyond max_pending are turned away."""
+        self._start("/doc/a.tex")
+        self._start("/doc/b.tex")
+        self._wait_for(lambda: len(self.server._flights) == 2)
+
+        rejected = self.server.handle({"input": "/doc/c.tex"})
+        # An identical request adds no work and is still accepted
+        coalesced = self._start("/doc/a.tex")
+        self._join()
+
+        assert not rejected["ok"] and rejected["overloaded"]
+        assert coalesced[0]["ok"]
+        assert "/doc/c.tex" not in self.calls
+
+    def test_request_times_out(self) -> None:
+        """Test that a request stops waiting after its timeout."""
+        running = self._start("/doc/a.tex")
+        self._wait_for(lambda: self.calls)
+
+        queued = self.server.handle({"input": "/doc/b.tex", "timeout": 0.05})
+
+        assert not queued["ok"] and queued["timeout"]
+        # Nobody waits for the queued flatten any more, so it was dropped
+        assert len(self.server._flights) == 1
+        self._join()
+        assert running[0]["ok"]
+        assert self.calls == ["/doc/a.tex"]
+
+    def test_default_timeout_applies(self) -> None:
+        """Test that the server timeout applies to requests without one."""
+        self.server.request_timeout = 0.05
+
+        response = self.server.handle({"input": "/doc/a.tex"})
+
+        assert response["timeout"]
@@ -0,0 +1,99 @@
+"""Integration tests for flatten statistics."""
+
+import json
+import os
+from typing import List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander, main
+
+
+class TestFlattenStats:
+    """Integration tests for counting and timing the stages of a flatten."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with a missing include and a missing figure."""
+        os.makedirs("figures")
+        os.makedirs("output")
+        with open("main.tex", "w") as f:
+            f.write(
+                "\\graphicspath{{figures/}}\n"
+                "\\input{intro}\n"
+                "\\input{missing}\n"
+                "\\includegraphics{absent}\n"
+            )
+        with open("intro.tex", "w") as f:
+            f.write("Intro.\n\\includegraphics{plot}\n")
+        with open("figures/plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+
+    @pytest.mark.parametrize("workers", [1, 4])
+    def test_stages_are_counted(self, workers: int) -> None:
+        """Test that every stage reports its work, with or without pools."""
+        config = LatexExpandConfig(
+            root_directory=".", copy_workers=workers, discovery_workers=workers
+        )
+
+        result = LatexExpander(config).flatten_with_stats("main.tex", "output/main.tex")
+
+        stats = result.stats
+        assert result.output_file == "output/main.tex"
+        assert (stats.files_read, stats.files_scanned) == (2, 2)
+        assert stats.bytes_read == os.path.getsize("main.tex") + os.path.getsize(
+            "intro.tex"
+        )
+        assert (stats.includes_resolved, stats.includes_missing) == (1, 1)
+        assert (stats.graphics_lookups, stats.graphics_missing) == (2, 1)
+        assert stats.directory_scans > 0
+        assert (stats.graphics_copied, stats.bytes_copied) == (1, 13)
+        assert stats.chars_written == len(result.content)
+        assert stats.output_writes > 0
+        assert stats.total_time >= stats.read_time > 0
+
+    def test_up_to_date_graphics_are_counted(self) -> None:
+        """Test that graphics skipped as up to date are told apart."""
+        expander = LatexExpander(LatexExpandConfig(root_directory="."))
+        expander.flatten_latex("main.tex", "output/main.tex")
+
+        stats = expander.flatten_with_stats("main.tex", "output/main.tex").stats
+
+        assert (stats.graphics_copied, stats.graphics_up_to_date) == (0, 1)
+
+    def test_summary_lists_every_stage(self) -> None:
+        """Test that the text report has a line per stage."""
+        stats = (
+            LatexExpander(LatexExpandConfig(root_directory="."))
+            .flatten_with_stats("main.tex", "")
+            .stats
+        )
+
+        summary = stats.summary()
+
+        for stage in ("Total", "File reads", "Scanning", "Graphics copies"):
+            assert stage in summary
+        assert "2 files" in summary
+
+    @pytest.mark.parametrize(
+        "options, output_format",
+        [
+            (["--stats"], "text"),
+            (["--stats-format", "text"], "text"),
+            (["--stats", "--stats-format", "json"], "json"),
+        ],
+    )
+    def test_cli_stats(self, options: List[str], output_format: str) -> None:
+        """Test that --stats prints the statistics after flattening."""
+        # The flag comes before the input file, which it must not swallow
+        with patch("sys.argv", ["flatexpy", *options, "main.tex", "-f"]), patch(
+            "builtins.print"
+        ) as mock_print:
+            main()
+
+        report = mock_print.call_args_list[-1].args[0]
+        if output_format == "json":
+            assert json.loads(report)["files_read"] == 2
+        else:
+            assert report.startswith("Total")
@@ -0,0 +1,152 @@
+"""Integration tests for Chrome trace event export."""
+
+import asyncio
+import json
+import os
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_batch import BatchJob, flatten_batch
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    main,
+)
+
+
+class TestTrace:
+    """Integration tests for tracing a flatten."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project with nested includes and two figures."""
+        os.makedirs("chapters")
+        os.makedirs("output")
+        self._write("main.tex", "\\input{chapters/one}\n\\includegraphics{a}\n")
+        self._write("chapters/one.tex", "One.\n\\input{chapters/two}\n")
+        self._write("chapters/two.tex", "Two.\n\\includegraphics{b}\n")
+        for name in ("a.png", "b.png"):
+            with open(name, "wb") as f:
+                f.write(b"fake PNG data")
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _spans(category: str) -> List[Dict[str, Any]]:
+        with open("trace.json") as f:
+            trace = json.load(f)
+        return [
+            event
+            for event in trace["traceEvents"]
+            if event["ph"] == "X" and event["cat"] == category
+        ]
+
+    @staticmethod
+    def _flatten(**kwargs: Any) -> str:
+        config = LatexExpandConfig(
+            root_directory=".", trace_file="trace.json", **kwargs
+        )
+        return LatexExpander(config).flatten_latex("main.tex", "output/main.tex")
+
+    def test_file_spans_nest_by_include_depth(self) -> None:
+        """Test that every file has a span enclosing the files it includes."""
+        self._flatten()
+
+        files = {event["name"]: event for event in self._spans("file")}
+        assert {name: event["args"]["depth"] for name, event in files.items()} == {
+            "main.tex": 0,
+            "one.tex": 1,
+            "two.tex": 2,
+        }
+        for outer, inner in (("main.tex", "one.tex"), ("one.tex", "two.tex")):
+            start = files[outer]["ts"]
+            end = start + files[outer]["dur"]
+            assert start <= files[inner]["ts"]
+            assert files[inner]["ts"] + files[inner]["dur"] <= end
+            assert files[outer]["tid"] == files[inner]["tid"]
+        assert len(self._spans("flatten")) == 1
+
+    def test_graphics_spans_on_copy_threads(self) -> None:
+        """Test that lookups and copies are traced, copies on pool threads."""
+        self._flatten(copy_workers=2)
+
+        with open("trace.json") as f:
+            events = json.load(f)["traceEvents"]
+        names = {
+            event["tid"]: event["args"]["name"]
+            for event in events
+            if event["ph"] == "M" and event["name"] == "thread_name"
+        }
+        graphics = self._spans("graphics")
+        lookups = [event for event in graphics if event["name"].startswith("lookup")]
+        copies = [event for event in graphics if event["name"].startswith("copy")]
+        assert sorted(event["name"] for event in lookups) == ["lookup a", "lookup b"]
+        assert sorted(event["name"] for event in copies) == ["copy a.png", "copy b.png"]
+        assert all(names[event["tid"]].startswith("flatexpy-copy") for event in copies)
+
+    def test_failed_flatten_still_writes_trace(self) -> None:
+        """Test that a trace shows how far a failing call went."""
+        with patch.object(
+            LatexExpander, "_copy_to_destination", side_effect=OSError("disk full")
+        ), pytest.raises(LatexExpandError):
+            self._flatten(copy_workers=1)
+
+        assert len(self._spans("flatten")) == 1
+        assert [event["name"] for event in self._spans("graphics")] == [
+            "lookup b",
+            "copy b.png",
+        ]
+
+    def test_asyncio_call_traces_prefetch_and_copies(self) -> None:
+        """Test that aflatten_latex traces its reads, scans and graphics copies."""
+        config = LatexExpandConfig(root_directory=".", trace_file="trace.json")
+
+        asyncio.run(LatexExpander(config).aflatten_latex("main.tex", "output/main.tex"))
+
+        assert len(self._spans("discovery")) == 1
+        assert len(self._spans("flatten")) == 1
+        read = [event["args"]["path"] for event in self._spans("io")]
+        scanned = [event["args"]["path"] for event in self._spans("scan")]
+        assert sorted(read) == sorted(scanned)
+        assert {os.path.basename(path) for path in read} == {
+            "main.tex",
+            "one.tex",
+            "two.tex",
+        }
+        copies = [
+            event["name"]
+            for event in self._spans("graphics")
+            if event["name"].startswith("copy")
+        ]
+        assert sorted(copies) == ["copy a.png", "copy b.png"]
+        prefetch = self._spans("discovery")[0]
+        assert all(event["ts"] >= prefetch["ts"] for event in self._spans("io"))
+
+    def test_reused_subtree_is_traced(self) -> None:
+        """Test that incremental runs show the reused parts of the tree."""
+        self._flatten(manifest_file="output/manifest.json")
+        self._flatten(manifest_file="output/manifest.json")
+
+        assert [event["name"] for event in self._spans("file")] == ["reuse main.tex"]
+
+    def test_batch_rejects_shared_trace_file(self) -> None:
+        """Test that documents of a batch cannot overwrite one trace."""
+        config = LatexExpandConfig(trace_file="trace.json")
+
+        with pytest.raises(ValueError, match="trace_file"):
+            flatten_batch([BatchJob("main.tex", "output")], config)
+
+    def test_cli_trace(self) -> None:
+        """Test that --trace writes the trace next to the flattened file."""
+        with patch(
+            "sys.argv", ["flatexpy", "main.tex", "-f", "--trace", "trace.json"]
+        ), patch("builtins.print"):
+            main()
+
+        assert len(self._spans("file")) == 3
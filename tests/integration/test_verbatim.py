@@ -0,0 +1,169 @@
+"""Integration tests for splicing included data files verbatim."""
+
+import asyncio
+import json
+import os
+from typing import Any
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import (
+    FlattenResult,
+    LatexExpandConfig,
+    LatexExpander,
+    main,
+)
+
+DATA = (
+    "x y\n"
+    "1 2 % \\input{not-an-include}\n"
+    "\\includegraphics{not-a-figure}\n"
+    "3 4 été\n"
+)
+
+
+class TestVerbatimIncludes:
+    """Integration tests for included files spliced without scanning."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> None:
+        """Create a project including a data table and a chapter."""
+        os.makedirs("data")
+        os.makedirs("output")
+        self._write(
+            "main.tex",
+            "\\begin{document}\n"
+            "\\input{data/table}\n"
+            "\\input{chapter}\n"
+            "\\end{document}\n",
+        )
+        self._write("data/table.tex", DATA)
+        self._write("chapter.tex", "Chapter.\n\\input{data/table}\n")
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+    @staticmethod
+    def _flatten(return_content: bool = True, **options: Any) -> FlattenResult:
+        config = LatexExpandConfig(root_directory=".", **options)
+        return LatexExpander(config).flatten_with_stats(
+            "main.tex", "output/main.tex", return_content
+        )
+
+    @staticmethod
+    def _output() -> str:
+        with open("output/main.tex", encoding="utf-8") as f:
+            return f.read()
+
+    @pytest.mark.parametrize("workers", [1, 8])
+    def test_matching_files_are_not_scanned(self, workers: int) -> None:
+        """Test that a verbatim file is spliced as is, between markers."""
+        result = self._flatten(
+            verbatim_patterns=["data/*.tex"], discovery_workers=workers
+        )
+
+        assert (
+            "% >>> input{data/table} >>>\n" + DATA + "% <<< input{data/table} <<<\n"
+        ) in result.content
+        stats = result.stats
+        assert (stats.files_read, stats.files_verbatim) == (3, 1)
+        assert stats.files_scanned == 2
+        assert (stats.includes_resolved, stats.graphics_lookups) == (3, 0)
+        # Included once, like any other file
+        assert result.content.count("3 4 été") == 1
+
+    def test_size_threshold(self) -> None:
+        """Test that files from verbatim_min_bytes on are spliced as is."""
+        result = self._flatten(verbatim_min_bytes=len(DATA.encode()))
+
+        assert result.stats.files_verbatim == 1
+        assert "\\includegraphics{not-a-figure}\n" in result.content
+
+    @pytest.mark.parametrize(
+        "options", [{}, {"verbatim_min_bytes": len(DATA.encode()) + 1}]
+    )
+    def test_no_patterns_match_no_paths(self, options: Any) -> None:
+        """Test that paths are only made relative when there are patterns."""
+        with patch("os.path.relpath", side_effect=AssertionError):
+            result = self._flatten(**options)
+
+        assert result.stats.files_verbatim == 0
+        assert result.stats.files_scanned == 3
+
+    def test_document_itself_is_never_verbatim(self) -> None:
+        """Test that the input file is expanded even when it matches."""
+        result = self._flatten(verbatim_patterns=["*.tex"], verbatim_min_bytes=1)
+
+        assert result.stats.files_verbatim == 2
+        assert "\\input{chapter}" not in result.content
+
+    def test_asyncio_document_is_never_verbatim(self) -> None:
+        """Test that aflatten_latex expands the input file when it matches."""
+        config = LatexExpandConfig(
+            root_directory=".", verbatim_patterns=["*.tex"], verbatim_min_bytes=1
+        )
+        expander = LatexExpander(config)
+
+        content = asyncio.run(expander.aflatten_latex("main.tex", "output/main.tex"))
+
+        assert content == expander.flatten_latex("main.tex", "")
+        assert "\\input{chapter}" not in content
+        assert "Chapter.\n" in content
+
+    @pytest.mark.parametrize("kernel_copy_min", [1, 1 << 16])
+    def test_output_file_is_copied_from_source(self, kernel_copy_min: int) -> None:
+        """Test that a verbatim file goes to the output file undecoded."""
+        expected = self._flatten(verbatim_patterns=["data/*"]).content
+
+        with patch("flatexpy.flatexpy_core._KERNEL_COPY_MIN", kernel_copy_min):
+            result = self._flatten(False, verbatim_patterns=["data/*"])
+
+        assert self._output() == expected
+        assert result.stats.bytes_passed_through >= len(DATA.encode())
+
+    def test_other_encodings_are_decoded(self) -> None:
+        """Test that verbatim files are read as text in other encodings."""
+        for path in ("main.tex", "data/table.tex", "chapter.tex"):
+            with open(path, encoding="utf-8") as f:
+                content = f.read()
+            with open(path, "w", encoding="utf-16") as f:
+                f.write(content)
+
+        result = self._flatten(
+            False, verbatim_patterns=["data/*"], output_encoding="utf-16"
+        )
+
+        assert result.stats.files_verbatim == 1
+        assert result.stats.bytes_passed_through == 0
+        with open("output/main.tex", encoding="utf-16") as f:
+            assert DATA in f.read()
+
+    def test_incremental_run_reuses_verbatim_file(self) -> None:
+        """Test that verbatim files are recorded in the manifest."""
+        options = {
+            "verbatim_patterns": ["data/*"],
+            "manifest_file": "output/manifest.json",
+        }
+        first = self._flatten(**options)
+
+        second = self._flatten(**options)
+
+        assert second.content == first.content
+        assert second.stats.files_read == 0
+        with open("output/manifest.json") as f:
+            files = json.load(f)["files"]
+        assert os.path.abspath("data/table.tex") in files
+
+    def test_cli_verbatim(self) -> None:
+        """Test that --verbatim can be repeated."""
+        argv = ["flatexpy", "main.tex", "-f", "--verbatim", "data/*"]
+        argv += ["--verbatim", "other/*", "--stats-format", "json"]
+
+        with patch("sys.argv", argv), patch("builtins.print") as mock_print:
+            main()
+
+        stats = json.loads(mock_print.call_args_list[-1].args[0])
+        assert stats["files_verbatim"] == 1
@@ -0,0 +1,104 @@
+"""Integration tests for watch mode."""
+
+import os
+import threading
+import time
+from typing import Callable, Iterator, List
+from unittest.mock import patch
+
+import pytest
+
+from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander
+
+
+class TestWatch:
+    """Integration tests for flattening again on changes."""
+
+    @pytest.fixture(autouse=True)
+    def setup_project(self, project_dir: str) -> Iterator[None]:
+        """Create a project and start watching it."""
+        os.makedirs("chapters")
+        os.makedirs("output")
+        self._write(
+            "main.tex",
+            "\\begin{document}\n"
+            "\\input{chapters/intro}\n"
+            "\\input{chapters/results}\n"
+            "\\includegraphics{plot}\n"
+            "\\end{document}\n",
+        )
+        self._write("chapters/intro.tex", "Introduction text.\n")
+        self._write("chapters/results.tex", "Results text.\n")
+
+        self.read_files: List[str] = []
+        original_read = LatexExpander._read_file
+
+        def tracking_read(expander: LatexExpander, file_path: str) -> str:
+            self.read_files.append(os.path.relpath(file_path))
+            return original_read(expander, file_path)
+
+        self.read_patch = patch.object(LatexExpander, "_read_file", tracking_read)
+        self.read_patch.start()
+
+        self.stop = threading.Event()
+        expander = LatexExpander(LatexExpandConfig(root_directory="."))
+        self.thread = threading.Thread(
+            target=expander.watch,
+            args=("main.tex", "output/main.tex"),
+            kwargs={"poll_interval": 0.01, "debounce": 0.05, "stop": self.stop},
+        )
+        self.thread.start()
+        self._wait_for(lambda: os.path.exists("output/main.tex"))
+
+        yield
+        self.stop.set()
+        self.thread.join(timeout=5)
+        self.read_patch.stop()
+
+    @staticmethod
+    def _write(path: str, content: str) -> None:
+        with open(path, "w") as f:
+            f.write(content)
+
+    @staticmethod
+    def _wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            assert time.monotonic() < deadline, "timed out waiting for a rebuild"
+            time.sleep(0.01)
+
+    @staticmethod
+    def _output() -> str:
+        with open("output/main.tex") as f:
+            return f.read()
+
+    def test_change_rebuilds_only_changed_branch(self) -> None:
+        """Test that editing an included file re-reads it and its includer."""
+        assert "Introduction text." in self._output()
+        self.read_files.clear()
+
+        self._write("chapters/results.tex", "Updated results.\n")
+        self._wait_for(lambda: "Updated results." in self._output())
+
+        assert sorted(self.read_files) == [
+            os.path.join("chapters", "results.tex"),
+            "main.tex",
+        ]
+        assert "Introduction text." in self._output()
+
+    def test_new_graphics_file_rebuilds(self) -> None:
+        """Test that creating a missing graphic is noticed."""
+        assert "\\includegraphics{plot}" in self._output()
+
+        with open("plot.png", "wb") as f:
+            f.write(b"fake PNG data")
+        self._wait_for(lambda: "\\includegraphics{plot.png}" in self._output())
+
+        assert os.path.exists("output/plot.png")
+
+    def test_stop_ends_watch(self) -> None:
+        """Test that setting the stop event ends the watch loop."""
+        self.stop.set()
+        self.thread.join(timeout=5)
+
+        assert not self.thread.is_alive()
@@ -1,5 +1,6 @@
 """Test cases for command line interface functionality."""
 
+import os
 import sys
 from unittest.mock import MagicMock, patch
 
@@ -83,6 +84,47 @@ class TestMainFunction:
         # Verify that LatexExpander was created with custom extensions
         mock_flatten.assert_called_once()
 
+    @patch(
+        "sys.argv",
+        ["flatexpy.py", "input.tex", "--graphics-mode", "hardlink", "-f"],
+    )
+    @patch("flatexpy.flatexpy_core.LatexExpander")
+    @patch("flatexpy.flatexpy_core._create_output_dir")
+    def test_main_graphics_mode(
+        self, mock_create_output: MagicMock, mock_expander: MagicMock
+    ) -> None:
+        """Test main function with a graphics mode."""
+        main()
+
+        config = mock_expander.call_args[0][0]
+        assert config.graphics_mode == "hardlink"
+
+    @patch(
+        "sys.argv",
+        ["flatexpy.py", "input.tex", "-f", "--watch", "--poll-interval", "0.1"],
+    )
+    @patch("flatexpy.flatexpy_core.LatexExpander.watch")
+    @patch("flatexpy.flatexpy_core.LatexExpander.flatten_latex")
+    @patch("flatexpy.flatexpy_core._create_output_dir")
+    @patch("builtins.print")
+    def test_main_watch(
+        self,
+        mock_print: MagicMock,
+        mock_create_output: MagicMock,
+        mock_flatten: MagicMock,
+        mock_watch: MagicMock,
+    ) -> None:
+        """Test that watch mode hands over to the watch loop until interrupted."""
+        mock_watch.side_effect = KeyboardInterrupt
+
+        main()
+
+        mock_flatten.assert_not_called()
+        mock_watch.assert_called_once_with(
+            "input.tex", os.path.join("flat", "input_flattened.tex"), 0.1
+        )
+        mock_print.assert_called_with("Stopped watching")
+
     @patch("sys.argv", ["flatexpy.py", "input.tex", "--ignore-comments", "-f"])
     @patch("flatexpy.flatexpy_core.LatexExpander.flatten_latex")
     @patch("flatexpy.flatexpy_core._create_output_dir")
@@ -189,6 +231,29 @@ class TestMainFunction:
             main()
         assert excinfo.value.code == 2  # Argument error should exit with code 2
 
+    @pytest.mark.parametrize(
+        "modes",
+        [
+            ["--batch", "batch.json", "--serve"],
+            ["--batch", "batch.json", "--connect"],
+            ["--serve", "--connect"],
+        ],
+    )
+    @patch("flatexpy.flatexpy_batch.flatten_batch")
+    @patch("flatexpy.flatexpy_server.FlattenServer")
+    def test_main_conflicting_modes(
+        self, mock_server: MagicMock, mock_batch: MagicMock, modes: list
+    ) -> None:
+        """Test that --batch, --serve and --connect exclude each other."""
+        with patch("sys.argv", ["flatexpy.py", *modes]), pytest.raises(
+            SystemExit
+        ) as excinfo:
+            main()
+
+        assert excinfo.value.code == 2
+        mock_batch.assert_not_called()
+        mock_server.assert_not_called()
+
     def test_argument_parser_configuration(self) -> None:
         """Test that argument parser is configured correctly."""
         import argparse
@@ -15,6 +15,19 @@ class TestLatexExpandConfig:
         assert config.ignore_commented_lines is True
         assert config.root_directory == "."
         assert config.output_encoding == "utf-8"
+        assert config.copy_workers == 4
+        assert config.graphics_mode == "copy"
+        assert config.skip_unchanged == "mtime"
+        assert config.manifest_file is None
+        assert config.discovery_workers == 1
+        assert config.cache_dir is None
+        assert config.cache_min_bytes == 64 * 1024
+        assert config.cache_max_bytes == 64 * 1024 * 1024
+        assert config.cache_max_age_days == 30.0
+        assert config.trace_file is None
+        assert config.mmap_threshold == 0
+        assert config.verbatim_patterns == []
+        assert config.verbatim_min_bytes == 0
 
     def test_custom_values(self) -> None:
         """Test that custom configuration values are set correctly."""
@@ -48,3 +61,13 @@ class TestLatexExpandConfig:
         # Verify modification
         assert len(config.graphic_extensions) == len(original_extensions) + 1
         assert ".svg" in config.graphic_extensions
+
+    def test_invalid_graphics_mode(self) -> None:
+        """Test that an unknown graphics mode is rejected."""
+        with pytest.raises(ValueError, match="graphics_mode should be one of"):
+            LatexExpandConfig(graphics_mode="move")
+
+    def test_invalid_skip_unchanged(self) -> None:
+        """Test that an unknown up-to-date check is rejected."""
+        with pytest.raises(ValueError, match="skip_unchanged should be one of"):
+            LatexExpandConfig(skip_unchanged="size")
@@ -2,7 +2,11 @@
 
 import pytest
 
-from flatexpy.flatexpy_core import GraphicsNotFoundError, LatexExpandError
+from flatexpy.flatexpy_core import (
+    GraphicsCopyError,
+    GraphicsNotFoundError,
+    LatexExpandError,
+)
 
 
 class TestExceptions:
@@ -21,6 +25,16 @@ class TestExceptions:
         assert str(exc_info.value) == "Graphics not found"
         assert issubclass(GraphicsNotFoundError, LatexExpandError)
 
+    def test_graphics_copy_error(self) -> None:
+        """Test GraphicsCopyError groups every failed copy."""
+        failures = [("a.png", IOError("Disk full")), ("b.pdf", IOError("Denied"))]
+        error = GraphicsCopyError(failures)  # type: ignore[arg-type]
+        assert error.failures == failures
+        assert "Failed to copy 2 graphics file(s)" in str(error)
+        assert "a.png: Disk full" in str(error)
+        assert "b.pdf: Denied" in str(error)
+        assert isinstance(error, LatexExpandError)
+
     def test_exception_inheritance(self) -> None:
         """Test that custom exceptions inherit from base exception."""
         # Test that LatexExpandError is an Exception
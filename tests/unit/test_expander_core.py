@@ -1,8 +1,14 @@
 """Test cases for core LatexExpander functionality."""
 
+import io
 import os
+import stat
+import sys
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import List
 from unittest.mock import MagicMock, mock_open, patch
 
 import pytest
@@ -13,6 +19,9 @@ from flatexpy.flatexpy_core import (
     LatexExpander,
     LatexExpandError,
     _create_output_dir,
+    _DirectoryListing,
+    _FlattenContext,
+    _IncludeFrame,
     main,
 )
 
@@ -24,6 +33,23 @@ class TestLatexExpanderCore:
         """Set up test fixtures."""
         self.config = LatexExpandConfig()
         self.expander = LatexExpander(self.config)
+        self.ctx = _FlattenContext(".", "output")
+
+    def _expand(self, text: str) -> str:
+        """Expand commands in text and collect the streamed output."""
+        chunks: List[str] = []
+        self.ctx.write = chunks.append
+        self.expander._expand_commands(self.ctx, text)
+        return "".join(chunks)
+
+    def _flatten(self, file_path: str, root_dir: str, output_dir: str) -> str:
+        """Flatten a file and collect the streamed output."""
+        chunks: List[str] = []
+        self.ctx.root_dir = root_dir
+        self.ctx.output_dir = output_dir
+        self.ctx.write = chunks.append
+        self.expander._flatten_file(self.ctx, file_path)
+        return "".join(chunks)
 
     def test_init_with_config(self) -> None:
         """Test initialization with custom config."""
@@ -38,27 +64,42 @@ class TestLatexExpanderCore:
         assert expander.config.ignore_commented_lines is True
 
     def test_initial_state(self) -> None:
-        """Test that expander starts with clean state."""
-        assert len(self.expander._visited_files) == 0
-        assert len(self.expander._graphics_paths) == 0
-        assert len(self.expander._collected_graphics) == 0
+        """Test that a flatten context starts with clean state."""
+        assert len(self.ctx.visited_files) == 0
+        assert len(self.ctx.graphics_paths) == 0
+        assert len(self.ctx.collected_graphics) == 0
+        assert not hasattr(self.expander, "_visited_files")
 
     def test_compiled_patterns(self) -> None:
-        """Test that regex patterns are compiled correctly."""
-        # Test input pattern
-        assert self.expander._input_pattern.pattern == r"\\(input|include)\{([^}]+)\}"
-
-        # Test graphicspath pattern
-        assert (
-            self.expander._graphicspath_pattern.pattern
-            == r"\\graphicspath\{((\{[^}]+\})+)\}"
-        )
-
-        # Test includegraphics pattern
-        assert (
-            self.expander._includegraphics_pattern.pattern
-            == r"\\includegraphics(?:\[[^\]]*\])?\{([^}]+)\}"
-        )
+        """Test that the single command pattern recognizes every command."""
+        pattern = self.expander._command_pattern
+
+        # Input / include
+        match = pattern.search("\\input{chapter}")
+        assert match is not None
+        assert match.lastgroup == "include"
+        assert match.group("cmd", "include") == ("input", "chapter")
+
+        match = pattern.search("\\include{chapter}")
+        assert match is not None
+        assert match.group("cmd") == "include"
+
+        # Graphics path
+        match = pattern.search("\\graphicspath{{figures/}{images/}}")
+        assert match is not None
+        assert match.lastgroup == "graphicspath"
+        assert match.group("graphicspath") == "{figures/}{images/}"
+
+        # Include graphics, with and without options
+        match = pattern.search("\\includegraphics[width=5cm]{plot}")
+        assert match is not None
+        assert match.lastgroup == "graphic"
+        assert match.group("graphic") == "plot"
+
+        # Several commands on one line are found in order
+        line = "\\includegraphics{a}\\input{b} \\graphicspath{{c/}}"
+        kinds = [m.lastgroup for m in pattern.finditer(line)]
+        assert kinds == ["graphic", "include", "graphicspath"]
 
     def test_is_line_commented(self) -> None:
         """Test comment line detection."""
@@ -70,31 +111,47 @@ class TestLatexExpanderCore:
         assert not self.expander._is_line_commented("")
         assert not self.expander._is_line_commented("   ")
 
+    def test_scan_commands_whole_buffer(self) -> None:
+        """Test scanning a whole buffer skips commands on commented lines."""
+        text = (
+            "\\input{first}\n"
+            "  % \\input{commented}\n"
+            "Text \\includegraphics{fig} % \\input{inline}\n"
+            "%\\graphicspath{{figures/}}"
+        )
+        matches = list(self.expander._scan_commands(text))
+        assert [m.group(0) for m in matches] == [
+            "\\input{first}",
+            "\\includegraphics{fig}",
+            "\\input{inline}",
+        ]
+
+        # Commented lines are scanned when configured so
+        expander = LatexExpander(LatexExpandConfig(ignore_commented_lines=False))
+        assert len(list(expander._scan_commands(text))) == 5
+
     def test_extract_graphics_paths(self) -> None:
         """Test graphics path extraction."""
         # Single path
-        line1 = "\\graphicspath{{figures/}}"
-        paths1 = self.expander._extract_graphics_paths(line1)
+        paths1 = self.expander._extract_graphics_paths("{figures/}")
         assert paths1 == ["figures"]
 
         # Multiple paths
-        line2 = "\\graphicspath{{figures/}{images/}}"
-        paths2 = self.expander._extract_graphics_paths(line2)
+        paths2 = self.expander._extract_graphics_paths("{figures/}{images/}")
         assert paths2 == ["figures", "images"]
 
         # Path with parent directory
-        line3 = "\\graphicspath{{../graphics/}}"
-        paths3 = self.expander._extract_graphics_paths(line3)
+        paths3 = self.expander._extract_graphics_paths("{../graphics/}")
         assert paths3 == ["../graphics"]
 
         # No graphics path
-        line4 = "No graphics path here"
-        paths4 = self.expander._extract_graphics_paths(line4)
+        paths4 = self.expander._extract_graphics_paths("")
         assert paths4 == []
 
         # Complex paths
-        line5 = "\\graphicspath{{./figures/}{../images/}{/abs/path/}}"
-        paths5 = self.expander._extract_graphics_paths(line5)
+        paths5 = self.expander._extract_graphics_paths(
+            "{./figures/}{../images/}{/abs/path/}"
+        )
         assert paths5 == ["figures", "../images", "/abs/path"]
 
     def test_add_extension_to_filename(self) -> None:
@@ -114,22 +171,22 @@ class TestLatexExpanderCore:
     def test_update_graphics_path(self) -> None:
         """Test updating graphics paths."""
         # Initially empty
-        assert len(self.expander._graphics_paths) == 0
+        assert len(self.ctx.graphics_paths) == 0
 
-        # Add first path
+        # Add first path, the command itself is kept
         line1 = "\\graphicspath{{figures/}}"
-        self.expander._update_graphics_path(line1)
-        assert self.expander._graphics_paths == ["figures"]
+        assert self._expand(line1) == line1
+        assert self.ctx.graphics_paths == ["figures"]
 
         # Add second path
         line2 = "\\graphicspath{{images/}}"
-        self.expander._update_graphics_path(line2)
-        assert self.expander._graphics_paths == ["figures", "images"]
+        self._expand(line2)
+        assert self.ctx.graphics_paths == ["figures", "images"]
 
         # Add duplicate path (should not add)
         line3 = "\\graphicspath{{figures/}}"
-        self.expander._update_graphics_path(line3)
-        assert self.expander._graphics_paths == ["figures", "images"]
+        self._expand(line3)
+        assert self.ctx.graphics_paths == ["figures", "images"]
 
     def test_show_config(self) -> None:
         """Test configuration display."""
@@ -137,16 +194,7 @@ class TestLatexExpanderCore:
         self.expander.show_config()  # Should not raise any exception
 
     def test_state_reset_in_flatten_latex(self) -> None:
-        """Test that state is reset when starting new flatten operation."""
-        # Add some state
-        self.expander._visited_files.add("/some/file.tex")
-        self.expander._graphics_paths.append("some/path")
-        self.expander._collected_graphics.add("some/graphic.png")
-
-        # Create temporary test files
-        import os
-        import tempfile
-
+        """Test that every flatten_latex call starts from fresh state."""
         with tempfile.TemporaryDirectory() as temp_dir:
             input_file = os.path.join(temp_dir, "test.tex")
             output_dir = os.path.join(temp_dir, "output")
@@ -157,12 +205,45 @@ class TestLatexExpanderCore:
 
             os.makedirs(output_dir)
 
-            # Call flatten_latex - this should reset state
-            self.expander.flatten_latex(input_file, output_file)
+            # A second call must not see the input file as already included
+            first = self.expander.flatten_latex(input_file, output_file)
+            second = self.expander.flatten_latex(input_file, output_file)
+            assert "Test" in first
+            assert second == first
+
+    def test_concurrent_calls_share_expander(self) -> None:
+        """Test that one expander serves concurrent flatten calls."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            jobs = []
+            for i in range(16):
+                doc_dir = os.path.join(temp_dir, f"doc{i}")
+                os.makedirs(doc_dir)
+                with open(os.path.join(doc_dir, "main.tex"), "w") as f:
+                    f.write("\\input{body}\n\\includegraphics{plot}\n")
+                with open(os.path.join(doc_dir, "body.tex"), "w") as f:
+                    f.write(f"Body {i}\n" * 50)
+                with open(os.path.join(doc_dir, "plot.png"), "wb") as f:
+                    f.write(b"fake PNG")
+                jobs.append(doc_dir)
+
+            # Every call reads its own include tree from the context's root
+            expander = LatexExpander(LatexExpandConfig(copy_workers=1))
+
+            def flatten(doc_dir: str) -> str:
+                ctx = _FlattenContext(doc_dir, os.path.join(doc_dir, "out"))
+                os.makedirs(ctx.output_dir)
+                return expander._flatten_latex(
+                    ctx, os.path.join(doc_dir, "main.tex"), "", True
+                )
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(flatten, jobs))
 
-            # State should be reset and then populated with new operation
-            # At minimum, the input file should be in visited files
-            assert len(self.expander._visited_files) >= 1
+            for i, (doc_dir, result) in enumerate(zip(jobs, results)):
+                assert result.count(f"Body {i}\n") == 50
+                assert "Body" not in result.replace(f"Body {i}", "")
+                assert "\\includegraphics{plot.png}" in result
+                assert os.path.exists(os.path.join(doc_dir, "out", "plot.png"))
 
     @patch("pathlib.Path.exists")
     def test_resolve_file_path_exists(self, mock_exists: MagicMock) -> None:
@@ -193,27 +274,25 @@ class TestLatexExpanderCore:
         with pytest.raises(FileNotFoundError):
             self.expander._resolve_file_path("nonexistent.tex")
 
-    @patch("os.path.exists")
-    @patch("os.path.join")
-    def test_find_graphics_file_found(
-        self, mock_join: MagicMock, mock_exists: MagicMock
-    ) -> None:
+    def test_find_graphics_file_found(self) -> None:
         """Test finding graphics file when it exists."""
-        mock_exists.return_value = True
-        mock_join.return_value = "figures/image.png"
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.return_value = _DirectoryListing(frozenset({"image.png"}))
 
-        result = self.expander._find_graphics_file("image", "figures")
-        assert result == "figures/image.png"
+            result = self.expander._find_graphics_file(self.ctx, "image", "figures")
+            assert result == os.path.join("figures", "image.png")
 
-    @patch("os.path.exists")
-    def test_find_graphics_file_not_found(self, mock_exists: MagicMock) -> None:
+    def test_find_graphics_file_not_found(self) -> None:
         """Test finding graphics file when it doesn't exist."""
-        mock_exists.return_value = False
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.return_value = _DirectoryListing(frozenset())
 
-        result = self.expander._find_graphics_file("nonexistent", "figures")
-        assert result is None
+            result = self.expander._find_graphics_file(
+                self.ctx, "nonexistent", "figures"
+            )
+            assert result is None
 
-    @patch("shutil.copy2")
+    @patch.object(LatexExpander, "_replace_with_copy")
     @patch("os.path.basename")
     @patch("os.path.join")
     def test_copy_graphics_file_success(
@@ -223,17 +302,17 @@ class TestLatexExpanderCore:
         mock_basename.return_value = "image.png"
         mock_join.return_value = "output/image.png"
 
-        self.expander._copy_graphics_file("source/image.png", "output")
+        self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
         mock_copy.assert_called_once_with("source/image.png", "output/image.png")
-        assert "source/image.png" in self.expander._collected_graphics
+        assert "source/image.png" in self.ctx.collected_graphics
 
     @patch("shutil.copy2")
     def test_copy_graphics_file_already_copied(self, mock_copy: MagicMock) -> None:
         """Test that already copied graphics are skipped."""
-        self.expander._collected_graphics.add("source/image.png")
+        self.ctx.collected_graphics.add("source/image.png")
 
-        self.expander._copy_graphics_file("source/image.png", "output")
+        self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
         mock_copy.assert_not_called()
 
@@ -249,7 +328,7 @@ class TestLatexExpanderCore:
         mock_copy.side_effect = IOError("Permission denied")
 
         with pytest.raises(LatexExpandError):
-            self.expander._copy_graphics_file("source/image.png", "output")
+            self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
     def test_process_includegraphics_found(self) -> None:
         """Test processing includegraphics when file is found."""
@@ -261,7 +340,7 @@ class TestLatexExpanderCore:
             mock_find.return_value = "path/to/image.png"
 
             line = "\\includegraphics{image}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
             assert "image.png" in result
             mock_copy.assert_called_once()
@@ -272,35 +351,53 @@ class TestLatexExpanderCore:
             mock_find.return_value = None
 
             line = "\\includegraphics{missing}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
             assert result == line
 
     def test_process_includegraphics_no_match(self) -> None:
         """Test processing line without includegraphics command."""
         line = "This is just text"
-        result = self.expander._process_includegraphics(line, ".", "output")
+        result = self._expand(line)
         assert result == line
 
     def test_process_input_include_found(self) -> None:
         """Test processing input/include commands when file is found."""
         with (
             patch.object(self.expander, "_resolve_file_path") as mock_resolve,
-            patch.object(self.expander, "_flatten_file") as mock_flatten,
+            patch.object(self.expander, "_open_file_frame") as mock_open_frame,
         ):
 
             mock_resolve.return_value = Path("included.tex")
-            mock_flatten.return_value = "Included content\n"
+            mock_open_frame.side_effect = lambda ctx, path, closing: _IncludeFrame(
+                "Included content\n", iter(()), closing
+            )
 
-            line = "\\input{included}"
-            result, was_processed = self.expander._process_input_include(
-                line, ".", "output"
+            line = "\\input{included}\n"
+            result = self._expand(line)
+
+            assert result == (
+                "% >>> input{included} >>>\n"
+                "Included content\n"
+                "% <<< input{included} <<<\n"
             )
 
-            assert was_processed
-            assert ">>> input{included} >>>" in result
-            assert "Included content" in result
-            assert "<<< input{included} <<<" in result
+    def test_process_input_include_keeps_rest_of_line(self) -> None:
+        """Test that text around an input command is preserved."""
+        with (
+            patch.object(self.expander, "_resolve_file_path") as mock_resolve,
+            patch.object(self.expander, "_open_file_frame") as mock_open_frame,
+        ):
+            mock_resolve.return_value = Path("included.tex")
+            mock_open_frame.side_effect = lambda ctx, path, closing: _IncludeFrame(
+                "Included content\n", iter(()), closing
+            )
+
+            line = "\\input{included} % trailing comment\n"
+            result = self._expand(line)
+
+            assert "Included content\n" in result
+            assert result.endswith("<<< input{included} <<<\n % trailing comment\n")
 
     def test_process_input_include_not_found(self) -> None:
         """Test processing input/include commands when file is not found."""
@@ -308,21 +405,15 @@ class TestLatexExpanderCore:
             mock_resolve.side_effect = FileNotFoundError("File not found")
 
             line = "\\input{missing}"
-            result, was_processed = self.expander._process_input_include(
-                line, ".", "output"
-            )
+            result = self._expand(line)
 
-            assert not was_processed
             assert result == line
 
     def test_process_input_include_no_match(self) -> None:
         """Test processing line without input/include commands."""
         line = "This is just text"
-        result, was_processed = self.expander._process_input_include(
-            line, ".", "output"
-        )
+        result = self._expand(line)
 
-        assert not was_processed
         assert result == line
 
     @patch("builtins.open", new_callable=mock_open, read_data="Line 1\nLine 2\n")
@@ -335,7 +426,7 @@ class TestLatexExpanderCore:
         mock_abspath.return_value = "/abs/path/file.tex"
         mock_dirname.return_value = "/abs/path"
 
-        result = self.expander._flatten_file("file.tex", ".", "output")
+        result = self._flatten("file.tex", ".", "output")
 
         assert "Line 1\nLine 2\n" == result
 
@@ -346,9 +437,9 @@ class TestLatexExpanderCore:
     ) -> None:
         """Test that already visited files are skipped."""
         mock_abspath.return_value = "/abs/path/file.tex"
-        self.expander._visited_files.add("/abs/path/file.tex")
+        self.ctx.visited_files.add("/abs/path/file.tex")
 
-        result = self.expander._flatten_file("file.tex", ".", "output")
+        result = self._flatten("file.tex", ".", "output")
 
         assert result == ""
 
@@ -358,7 +449,7 @@ class TestLatexExpanderCore:
         mock_open_func.side_effect = IOError("Permission denied")
 
         with pytest.raises(LatexExpandError):
-            self.expander._flatten_file("file.tex", ".", "output")
+            self._flatten("file.tex", ".", "output")
 
     def test_flatten_latex_integration(self) -> None:
         """Test full LaTeX flattening integration."""
@@ -383,3 +474,112 @@ class TestLatexExpanderCore:
             with open(output_file, "r") as f:
                 content = f.read()
                 assert content == result
+
+    def test_flatten_latex_without_returning_content(self) -> None:
+        """Test that content can be streamed to the output file only."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            output_file = os.path.join(temp_dir, "main_flat.tex")
+
+            with open(input_file, "w") as f:
+                f.write("Hello World\n")
+
+            result = self.expander.flatten_latex(
+                input_file, output_file, return_content=False
+            )
+
+            assert result == ""
+            with open(output_file, "r") as f:
+                assert f.read() == "Hello World\n"
+
+    def test_flatten_latex_failure_keeps_no_partial_output(self) -> None:
+        """Test that a failed flatten leaves no partially written output."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            output_file = os.path.join(temp_dir, "main_flat.tex")
+
+            with open(input_file, "w") as f:
+                f.write("Hello World\n")
+
+            with (
+                patch.object(self.expander, "_walk") as mock_walk,
+                pytest.raises(LatexExpandError),
+            ):
+                mock_walk.side_effect = IOError("Disk full")
+                self.expander.flatten_latex(input_file, output_file)
+
+            assert os.listdir(temp_dir) == ["main.tex"]
+
+    def test_concurrent_calls_write_one_output(self) -> None:
+        """Test that calls writing the same output use distinct temporary files."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            output_file = os.path.join(temp_dir, "main_flat.tex")
+            with open(input_file, "w") as f:
+                f.write("Hello World\n")
+
+            # Both calls finish rendering before either renames its output
+            barrier = threading.Barrier(2)
+            original_render = LatexExpander._render
+
+            def render(expander: LatexExpander, *args: object) -> str:
+                content = original_render(expander, *args)  # type: ignore[arg-type]
+                barrier.wait(10)
+                return content
+
+            with (
+                patch.object(LatexExpander, "_render", render),
+                ThreadPoolExecutor(max_workers=2) as executor,
+            ):
+                results = list(
+                    executor.map(
+                        lambda _: self.expander.flatten_latex(input_file, output_file),
+                        range(2),
+                    )
+                )
+
+            assert results == ["Hello World\n"] * 2
+            assert sorted(os.listdir(temp_dir)) == ["main.tex", "main_flat.tex"]
+
+    @pytest.mark.skipif(sys.platform == "win32", reason="POSIX permissions")
+    def test_output_permissions(self) -> None:
+        """Test that the output gets the mode of a new or of the replaced file."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            output_file = os.path.join(temp_dir, "main_flat.tex")
+            with open(input_file, "w") as f:
+                f.write("Hello World\n")
+
+            # The umask is applied by the kernel, never read by changing it
+            with patch("os.umask", side_effect=AssertionError):
+                self.expander.flatten_latex(input_file, output_file)
+            assert stat.S_IMODE(os.stat(output_file).st_mode) == stat.S_IMODE(
+                os.stat(input_file).st_mode
+            )
+
+            os.chmod(output_file, 0o640)
+            self.expander.flatten_latex(input_file, output_file)
+            assert stat.S_IMODE(os.stat(output_file).st_mode) == 0o640
+
+    def test_flatten_latex_to_stream(self) -> None:
+        """Test flattening into an arbitrary writable stream."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            chapter_file = os.path.join(temp_dir, "chapter.tex")
+
+            with open(input_file, "w") as f:
+                f.write("Start\n\\input{chapter}\nEnd\n")
+            with open(chapter_file, "w") as f:
+                f.write("Chapter\n")
+
+            expander = LatexExpander(LatexExpandConfig(root_directory=temp_dir))
+            stream = io.StringIO()
+            expander.flatten_latex_to_stream(input_file, stream, temp_dir)
+
+            assert stream.getvalue() == (
+                "Start\n"
+                "% >>> input{chapter} >>>\n"
+                "Chapter\n"
+                "% <<< input{chapter} <<<\n"
+                "End\n"
+            )
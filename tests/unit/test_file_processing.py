@@ -3,11 +3,17 @@
 import os
 import tempfile
 from pathlib import Path
+from typing import List
 from unittest.mock import MagicMock, mock_open, patch
 
 import pytest
 
-from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander, LatexExpandError
+from flatexpy.flatexpy_core import (
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    _FlattenContext,
+)
 
 
 class TestFileProcessing:
@@ -17,6 +23,16 @@ class TestFileProcessing:
         """Set up test fixtures."""
         self.config = LatexExpandConfig()
         self.expander = LatexExpander(self.config)
+        self.ctx = _FlattenContext(".", "output")
+
+    def _flatten(self, file_path: str, root_dir: str, output_dir: str) -> str:
+        """Flatten a file and collect the streamed output."""
+        chunks: List[str] = []
+        self.ctx.root_dir = root_dir
+        self.ctx.output_dir = output_dir
+        self.ctx.write = chunks.append
+        self.expander._flatten_file(self.ctx, file_path)
+        return "".join(chunks)
 
     @patch("pathlib.Path.exists")
     def test_resolve_file_path_exists(self, mock_exists: MagicMock) -> None:
@@ -68,7 +84,7 @@ class TestFileProcessing:
     def test_read_file_success(self, mock_file: MagicMock) -> None:
         """Test successful file reading."""
         result = self.expander._read_file("test.tex")
-        assert result == ["Line 1\n", "Line 2\n"]
+        assert result == "Line 1\nLine 2\n"
         mock_file.assert_called_once_with("test.tex", "r", encoding="utf-8")
 
     @patch("builtins.open")
@@ -91,7 +107,7 @@ class TestFileProcessing:
                 f.write(test_content)
 
             result = self.expander._read_file(test_file)
-            assert result == test_content.splitlines(keepends=True)
+            assert result == test_content
 
     @patch("builtins.open", new_callable=mock_open, read_data="Line 1\nLine 2\n")
     @patch("os.path.abspath")
@@ -101,7 +117,7 @@ class TestFileProcessing:
         """Test basic file flattening."""
         mock_abspath.return_value = "/abs/path/file.tex"
 
-        result = self.expander._flatten_file("file.tex", ".", "output")
+        result = self._flatten("file.tex", ".", "output")
         assert "Line 1\nLine 2\n" == result
 
     @patch("builtins.open", new_callable=mock_open, read_data="Line 1\nLine 2\n")
@@ -111,9 +127,9 @@ class TestFileProcessing:
     ) -> None:
         """Test that already visited files are skipped."""
         mock_abspath.return_value = "/abs/path/file.tex"
-        self.expander._visited_files.add("/abs/path/file.tex")
+        self.ctx.visited_files.add("/abs/path/file.tex")
 
-        result = self.expander._flatten_file("file.tex", ".", "output")
+        result = self._flatten("file.tex", ".", "output")
         assert result == ""
         # File should not be opened since it was already visited
         mock_file.assert_not_called()
@@ -128,7 +144,7 @@ class TestFileProcessing:
                 f.write(test_content)
 
             # Test with comment ignoring enabled (default)
-            result = self.expander._flatten_file(test_file, temp_dir, temp_dir)
+            result = self._flatten(test_file, temp_dir, temp_dir)
             assert "% This is a comment" in result
             assert "% Another comment" in result
             assert "Hello" in result
@@ -147,5 +163,8 @@ class TestFileProcessing:
             config = LatexExpandConfig(output_encoding="utf-8")
             expander = LatexExpander(config)
 
-            result = expander._flatten_file(test_file, temp_dir, temp_dir)
+            chunks: List[str] = []
+            ctx = _FlattenContext(temp_dir, temp_dir, chunks.append)
+            expander._flatten_file(ctx, test_file)
+            result = "".join(chunks)
             assert "ñáéíóú" in result
@@ -1,12 +1,22 @@
 """Unit test cases for graphics processing functionality."""
 
 import os
+import shutil
 import tempfile
+import threading
+from typing import List, Tuple
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from flatexpy.flatexpy_core import LatexExpandConfig, LatexExpander, LatexExpandError
+from flatexpy.flatexpy_core import (
+    GraphicsCopyError,
+    LatexExpandConfig,
+    LatexExpander,
+    LatexExpandError,
+    _DirectoryListing,
+    _FlattenContext,
+)
 
 
 class TestGraphicsUnit:
@@ -16,70 +26,136 @@ class TestGraphicsUnit:
         """Set up test fixtures."""
         self.config = LatexExpandConfig()
         self.expander = LatexExpander(self.config)
+        self.ctx = _FlattenContext(".", "output")
 
-    @patch("os.path.exists")
-    @patch("os.path.join")
-    def test_find_graphics_file_found(
-        self, mock_join: MagicMock, mock_exists: MagicMock
-    ) -> None:
+    def _expand(self, text: str) -> str:
+        """Expand commands in text and collect the streamed output."""
+        chunks: List[str] = []
+        self.ctx.write = chunks.append
+        self.expander._expand_commands(self.ctx, text)
+        return "".join(chunks)
+
+    def test_find_graphics_file_found(self) -> None:
         """Test finding graphics file when it exists."""
-        mock_exists.return_value = True
-        mock_join.return_value = "figures/image.png"
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.return_value = _DirectoryListing(frozenset({"image.png"}))
 
-        result = self.expander._find_graphics_file("image", "figures")
-        assert result == "figures/image.png"
+            result = self.expander._find_graphics_file(self.ctx, "image", "figures")
+            assert result == os.path.join("figures", "image.png")
 
-    @patch("os.path.exists")
-    def test_find_graphics_file_not_found(self, mock_exists: MagicMock) -> None:
+    def test_find_graphics_file_not_found(self) -> None:
         """Test finding graphics file when it doesn't exist."""
-        mock_exists.return_value = False
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.return_value = _DirectoryListing(frozenset())
 
-        result = self.expander._find_graphics_file("nonexistent", "figures")
-        assert result is None
+            result = self.expander._find_graphics_file(
+                self.ctx, "nonexistent", "figures"
+            )
+            assert result is None
 
-    @patch("os.path.exists")
-    def test_find_graphics_file_with_extension(self, mock_exists: MagicMock) -> None:
+    def test_find_graphics_file_with_extension(self) -> None:
         """Test finding graphics file that already has extension."""
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.return_value = _DirectoryListing(
+                frozenset({"image.png", "image.pdf"})
+            )
 
-        def exists_side_effect(path: str) -> bool:
-            return path == "figures/image.png"
-
-        mock_exists.side_effect = exists_side_effect
+            result = self.expander._find_graphics_file(self.ctx, "image.png", "figures")
+            assert result == os.path.join("figures", "image.png")
 
-        result = self.expander._find_graphics_file("image.png", "figures")
-        assert result == "figures/image.png"
-
-    @patch("os.path.exists")
-    def test_find_graphics_file_multiple_extensions(
-        self, mock_exists: MagicMock
-    ) -> None:
+    def test_find_graphics_file_multiple_extensions(self) -> None:
         """Test finding graphics file with multiple possible extensions."""
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            # Only .jpg exists
+            mock_list.return_value = _DirectoryListing(frozenset({"image.jpg"}))
 
-        def exists_side_effect(path: str) -> bool:
-            return path == "figures/image.jpg"  # Only .jpg exists
-
-        mock_exists.side_effect = exists_side_effect
-
-        result = self.expander._find_graphics_file("image", "figures")
-        assert result == "figures/image.jpg"
+            result = self.expander._find_graphics_file(self.ctx, "image", "figures")
+            assert result == os.path.join("figures", "image.jpg")
 
-    @patch("os.path.exists")
-    def test_find_graphics_file_with_graphics_paths(
-        self, mock_exists: MagicMock
-    ) -> None:
+    def test_find_graphics_file_with_graphics_paths(self) -> None:
         """Test finding graphics file using graphics paths."""
         # Set up graphics paths
-        self.expander._graphics_paths = ["images", "figures"]
+        self.ctx.graphics_paths = ["images", "figures"]
 
-        def exists_side_effect(path: str) -> bool:
-            return path == "images/chart.png"  # Only exists in images/
+        def list_side_effect(ctx: _FlattenContext, directory: str) -> _DirectoryListing:
+            # Only exists in images/
+            return _DirectoryListing(
+                frozenset({"chart.png"} if directory == "images" else ())
+            )
 
-        mock_exists.side_effect = exists_side_effect
+        with patch.object(self.expander, "_list_directory") as mock_list:
+            mock_list.side_effect = list_side_effect
 
-        result = self.expander._find_graphics_file("chart", ".")
-        assert result == "images/chart.png"
+            result = self.expander._find_graphics_file(self.ctx, "chart", ".")
+            assert result == os.path.join("images", "chart.png")
 
-    @patch("shutil.copy2")
+    def test_find_graphics_file_scans_each_directory_once(self) -> None:
+        """Test that lookups hit the directory index instead of the disk."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            figures_dir = os.path.join(temp_dir, "figures")
+            os.makedirs(figures_dir)
+            for i in range(10):
+                with open(os.path.join(figures_dir, f"fig{i}.pdf"), "wb") as f:
+                    f.write(b"fake PDF")
+            self.ctx.graphics_paths = [figures_dir]
+
+            with patch("os.scandir", wraps=os.scandir) as mock_scandir:
+                for i in range(10):
+                    result = self.expander._find_graphics_file(
+                        self.ctx, f"fig{i}", temp_dir
+                    )
+                    assert result == os.path.join(figures_dir, f"fig{i}.pdf")
+                assert (
+                    self.expander._find_graphics_file(self.ctx, "missing", temp_dir)
+                    is None
+                )
+
+            # temp_dir and figures/ are listed once each
+            assert mock_scandir.call_count == 2
+
+    def test_find_graphics_file_skips_dangling_links(self) -> None:
+        """Test that a symbolic link to a missing file is not a graphic."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with open(os.path.join(temp_dir, "target.png"), "wb") as f:
+                f.write(b"fake PNG")
+            os.symlink("missing.png", os.path.join(temp_dir, "dangling.png"))
+            os.symlink("target.png", os.path.join(temp_dir, "link.png"))
+
+            assert (
+                self.expander._find_graphics_file(self.ctx, "dangling", temp_dir)
+                is None
+            )
+            assert self.expander._find_graphics_file(
+                self.ctx, "link", temp_dir
+            ) == os.path.join(temp_dir, "link.png")
+
+    @pytest.mark.parametrize("exists", [True, False])
+    def test_find_graphics_file_case_variant(self, exists: bool) -> None:
+        """Test that a name differing only in case is left to the file system."""
+        with patch.object(self.expander, "_list_directory") as mock_list, patch(
+            "os.path.exists", return_value=exists
+        ) as mock_exists:
+            mock_list.return_value = _DirectoryListing(frozenset({"Plot.PNG"}))
+
+            result = self.expander._find_graphics_file(self.ctx, "plot", "figures")
+            missing = self.expander._find_graphics_file(self.ctx, "other", "figures")
+
+        # Found as written, as a case-insensitive file system opens it
+        assert result == (os.path.join("figures", "plot.png") if exists else None)
+        assert missing is None
+        mock_exists.assert_called_with(os.path.join("figures", "plot.png"))
+        assert mock_exists.call_count == 1
+
+    def test_find_graphics_file_in_unlistable_directory(self) -> None:
+        """Test that candidates in a directory that cannot be listed are probed."""
+        with patch("os.scandir", side_effect=PermissionError), patch(
+            "os.path.exists", side_effect=lambda path: path.endswith(".jpg")
+        ):
+            result = self.expander._find_graphics_file(self.ctx, "image", "figures")
+
+        assert result == os.path.join("figures", "image.jpg")
+
+    @patch.object(LatexExpander, "_replace_with_copy")
     @patch("os.path.basename")
     @patch("os.path.join")
     def test_copy_graphics_file_success(
@@ -89,17 +165,17 @@ class TestGraphicsUnit:
         mock_basename.return_value = "image.png"
         mock_join.return_value = "output/image.png"
 
-        self.expander._copy_graphics_file("source/image.png", "output")
+        self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
         mock_copy.assert_called_once_with("source/image.png", "output/image.png")
-        assert "source/image.png" in self.expander._collected_graphics
+        assert "source/image.png" in self.ctx.collected_graphics
 
     @patch("shutil.copy2")
     def test_copy_graphics_file_already_copied(self, mock_copy: MagicMock) -> None:
         """Test that already copied graphics are skipped."""
-        self.expander._collected_graphics.add("source/image.png")
+        self.ctx.collected_graphics.add("source/image.png")
 
-        self.expander._copy_graphics_file("source/image.png", "output")
+        self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
         mock_copy.assert_not_called()
 
@@ -115,7 +191,7 @@ class TestGraphicsUnit:
         mock_copy.side_effect = IOError("Permission denied")
 
         with pytest.raises(LatexExpandError):
-            self.expander._copy_graphics_file("source/image.png", "output")
+            self.expander._copy_graphics_file(self.ctx, "source/image.png", "output")
 
     def test_copy_graphics_file_real_files(self) -> None:
         """Test copying real graphics files."""
@@ -131,7 +207,7 @@ class TestGraphicsUnit:
                 f.write(b"fake PNG data")
 
             # Copy file
-            self.expander._copy_graphics_file(source_file, dest_dir)
+            self.expander._copy_graphics_file(self.ctx, source_file, dest_dir)
 
             # Verify file was copied
             dest_file = os.path.join(dest_dir, "test.png")
@@ -142,7 +218,7 @@ class TestGraphicsUnit:
                 assert sf.read() == df.read()
 
             # Verify file is tracked as collected
-            assert source_file in self.expander._collected_graphics
+            assert source_file in self.ctx.collected_graphics
 
     def test_process_includegraphics_found(self) -> None:
         """Test processing includegraphics when file is found."""
@@ -153,7 +229,7 @@ class TestGraphicsUnit:
             mock_find.return_value = "path/to/image.png"
 
             line = "\\includegraphics{image}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
             assert "image.png" in result
             mock_copy.assert_called_once()
@@ -164,14 +240,14 @@ class TestGraphicsUnit:
             mock_find.return_value = None
 
             line = "\\includegraphics{missing}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
             assert result == line
 
     def test_process_includegraphics_no_match(self) -> None:
         """Test processing line without includegraphics command."""
         line = "This is just text"
-        result = self.expander._process_includegraphics(line, ".", "output")
+        result = self._expand(line)
         assert result == line
 
     def test_process_includegraphics_with_options(self) -> None:
@@ -183,7 +259,7 @@ class TestGraphicsUnit:
             mock_find.return_value = "path/to/figure.pdf"
 
             line = "\\includegraphics[width=0.5\\textwidth]{figure}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
             assert "\\includegraphics[width=0.5\\textwidth]{figure.pdf}" in result
             mock_copy.assert_called_once()
@@ -194,15 +270,16 @@ class TestGraphicsUnit:
             patch.object(self.expander, "_find_graphics_file") as mock_find,
             patch.object(self.expander, "_copy_graphics_file") as mock_copy,
         ):
-            # Only the first match will be processed (search() not findall())
-            mock_find.return_value = "path/to/image1.png"
+            # Every command in the line is processed in a single sweep
+            mock_find.side_effect = ["path/to/image1.png", "path/to/image2.pdf"]
 
             line = "\\includegraphics{image1} and \\includegraphics{image2}"
-            result = self.expander._process_includegraphics(line, ".", "output")
+            result = self._expand(line)
 
-            assert "image1.png" in result
-            assert "\\includegraphics{image2}" in result  # Second one unchanged
-            mock_copy.assert_called_once()
+            assert result == (
+                "\\includegraphics{image1.png} and \\includegraphics{image2.pdf}"
+            )
+            assert mock_copy.call_count == 2
 
     def test_find_graphics_file_real_files(self) -> None:
         """Test finding graphics files with real file system."""
@@ -221,16 +298,289 @@ class TestGraphicsUnit:
                 f.write(b"fake JPG")
 
             # Set up graphics paths
-            self.expander._graphics_paths = ["figures"]
+            self.ctx.graphics_paths = ["figures"]
 
             # Test finding file in graphics path
-            result1 = self.expander._find_graphics_file("chart", figures_dir)
+            result1 = self.expander._find_graphics_file(self.ctx, "chart", figures_dir)
             assert result1 == png_file
 
             # Test finding file in search directory
-            result2 = self.expander._find_graphics_file("photo", temp_dir)
+            result2 = self.expander._find_graphics_file(self.ctx, "photo", temp_dir)
             assert result2 == jpg_file
 
             # Test file not found
-            result3 = self.expander._find_graphics_file("missing", temp_dir)
+            result3 = self.expander._find_graphics_file(self.ctx, "missing", temp_dir)
             assert result3 is None
+
+    def test_directory_index_reset_between_runs(self) -> None:
+        """Test that graphics added between two runs are found."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            input_file = os.path.join(temp_dir, "main.tex")
+            output_dir = os.path.join(temp_dir, "output")
+            output_file = os.path.join(output_dir, "main_flat.tex")
+            os.makedirs(output_dir)
+            with open(input_file, "w") as f:
+                f.write("\\includegraphics{plot}\n")
+
+            expander = LatexExpander(LatexExpandConfig(root_directory=temp_dir))
+            result1 = expander.flatten_latex(input_file, output_file)
+            assert "\\includegraphics{plot}" in result1
+
+            with open(os.path.join(temp_dir, "plot.png"), "wb") as f:
+                f.write(b"fake PNG")
+
+            result2 = expander.flatten_latex(input_file, output_file)
+            assert "\\includegraphics{plot.png}" in result2
+
+    def test_graphics_copied_by_worker_pool(self) -> None:
+        """Test that graphics are copied by the pool while parsing goes on."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_dir = os.path.join(temp_dir, "output")
+            os.makedirs(output_dir)
+            content = ""
+            for i in range(20):
+                with open(os.path.join(temp_dir, f"fig{i}.png"), "wb") as f:
+                    f.write(f"figure {i}".encode())
+                content += f"\\includegraphics{{fig{i}}}\n"
+            input_file = os.path.join(temp_dir, "main.tex")
+            with open(input_file, "w") as f:
+                f.write(content)
+
+            config = LatexExpandConfig(root_directory=temp_dir, copy_workers=4)
+            expander = LatexExpander(config)
+            copy_threads = set()
+
+            def copy2(source: str, dest: str) -> None:
+                copy_threads.add(threading.current_thread().name)
+                shutil.copyfile(source, dest)
+
+            with patch("shutil.copy2", side_effect=copy2):
+                result = expander.flatten_latex(
+                    input_file, os.path.join(output_dir, "main_flat.tex")
+                )
+
+            for i in range(20):
+                assert f"\\includegraphics{{fig{i}.png}}" in result
+                with open(os.path.join(output_dir, f"fig{i}.png"), "rb") as f:
+                    assert f.read() == f"figure {i}".encode()
+            assert all(name.startswith("flatexpy-copy") for name in copy_threads)
+
+    def test_graphics_copy_failures_reported_as_group(self) -> None:
+        """Test that every failed background copy is reported at the end."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output_dir = os.path.join(temp_dir, "output")
+            os.makedirs(output_dir)
+            for name in ("a", "b", "c"):
+                with open(os.path.join(temp_dir, f"{name}.png"), "wb") as f:
+                    f.write(b"fake PNG")
+            input_file = os.path.join(temp_dir, "main.tex")
+            with open(input_file, "w") as f:
+                f.write("\\includegraphics{a}\\includegraphics{b}\\includegraphics{c}")
+
+            config = LatexExpandConfig(root_directory=temp_dir, copy_workers=2)
+            expander = LatexExpander(config)
+
+            with (
+                patch("shutil.copy2", side_effect=IOError("Disk full")),
+                pytest.raises(LatexExpandError) as exc_info,
+            ):
+                expander.flatten_latex(
+                    input_file, os.path.join(output_dir, "main_flat.tex")
+                )
+
+            error = exc_info.value.__cause__
+            assert isinstance(error, GraphicsCopyError)
+            assert sorted(os.path.basename(src) for src, _ in error.failures) == [
+                "a.png",
+                "b.png",
+                "c.png",
+            ]
+            assert not os.path.exists(os.path.join(output_dir, "main_flat.tex"))
+
+    def _materialize(self, mode: str, temp_dir: str) -> Tuple[str, str]:
+        """Materialize a fake graphics file with the given mode."""
+        source_dir = os.path.join(temp_dir, "source")
+        dest_dir = os.path.join(temp_dir, "dest")
+        os.makedirs(source_dir)
+        os.makedirs(dest_dir, exist_ok=True)
+        source_file = os.path.join(source_dir, "test.png")
+        with open(source_file, "wb") as f:
+            f.write(b"fake PNG data")
+
+        expander = LatexExpander(LatexExpandConfig(graphics_mode=mode))
+        expander._copy_graphics_file(_FlattenContext(), source_file, dest_dir)
+        return source_file, os.path.join(dest_dir, "test.png")
+
+    def test_graphics_mode_hardlink(self) -> None:
+        """Test hard linking graphics into the output directory."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file, dest_file = self._materialize("hardlink", temp_dir)
+            assert os.path.samefile(source_file, dest_file)
+            assert not os.path.islink(dest_file)
+
+    def test_graphics_mode_hardlink_falls_back_to_copy(self) -> None:
+        """Test that a failing hard link falls back to a copy."""
+        with (
+            tempfile.TemporaryDirectory() as temp_dir,
+            patch("os.link", side_effect=OSError(18, "Invalid cross-device link")),
+        ):
+            source_file, dest_file = self._materialize("hardlink", temp_dir)
+            assert not os.path.samefile(source_file, dest_file)
+            with open(dest_file, "rb") as f:
+                assert f.read() == b"fake PNG data"
+
+    def test_graphics_mode_symlink(self) -> None:
+        """Test symlinking graphics into the output directory."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file, dest_file = self._materialize("symlink", temp_dir)
+            assert os.path.islink(dest_file)
+            assert os.readlink(dest_file) == os.path.abspath(source_file)
+
+    def test_graphics_mode_reflink(self) -> None:
+        """Test cloning graphics, falling back to a copy when unsupported."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file, dest_file = self._materialize("reflink", temp_dir)
+            assert not os.path.islink(dest_file)
+            assert not os.path.samefile(source_file, dest_file)
+            with open(dest_file, "rb") as f:
+                assert f.read() == b"fake PNG data"
+            assert os.stat(dest_file).st_mtime == os.stat(source_file).st_mtime
+
+    def test_graphics_mode_replaces_existing_destination(self) -> None:
+        """Test that links replace a stale file in the output directory."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            os.makedirs(os.path.join(temp_dir, "dest"))
+            with open(os.path.join(temp_dir, "dest", "test.png"), "wb") as f:
+                f.write(b"stale")
+            source_file, dest_file = self._materialize("symlink", temp_dir)
+            with open(dest_file, "rb") as f:
+                assert f.read() == b"fake PNG data"
+
+    def _copy_over_link(self, link_mode: str, temp_dir: str, same_source: bool) -> None:
+        """Copy a graphics file over a link left by a run in link_mode."""
+        for name in ("a", "b"):
+            os.makedirs(os.path.join(temp_dir, name))
+            with open(os.path.join(temp_dir, name, "plot.png"), "wb") as f:
+                f.write(f"{name} PNG data".encode())
+        dest_dir = os.path.join(temp_dir, "out")
+        os.makedirs(dest_dir)
+
+        LatexExpander(LatexExpandConfig(graphics_mode=link_mode))._copy_graphics_file(
+            _FlattenContext(), os.path.join(temp_dir, "a", "plot.png"), dest_dir
+        )
+        source = "a" if same_source else "b"
+        LatexExpander(
+            LatexExpandConfig(graphics_mode="copy", skip_unchanged="never")
+        )._copy_graphics_file(
+            _FlattenContext(), os.path.join(temp_dir, source, "plot.png"), dest_dir
+        )
+
+        dest_file = os.path.join(dest_dir, "plot.png")
+        assert not os.path.islink(dest_file)
+        assert not os.path.samefile(dest_file, os.path.join(temp_dir, "a", "plot.png"))
+        with open(dest_file, "rb") as f:
+            assert f.read() == f"{source} PNG data".encode()
+        # The source the link pointed to is untouched
+        with open(os.path.join(temp_dir, "a", "plot.png"), "rb") as f:
+            assert f.read() == b"a PNG data"
+
+    @pytest.mark.parametrize("link_mode", ["symlink", "hardlink"])
+    def test_copy_replaces_link_to_other_source(self, link_mode: str) -> None:
+        """Test that a copy never writes through a link of a previous run."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._copy_over_link(link_mode, temp_dir, same_source=False)
+
+    @pytest.mark.parametrize("link_mode", ["symlink", "hardlink"])
+    def test_copy_replaces_link_to_same_source(self, link_mode: str) -> None:
+        """Test that a copy over a link to its own source succeeds."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self._copy_over_link(link_mode, temp_dir, same_source=True)
+
+    def test_hardlink_to_source_is_not_an_up_to_date_copy(self) -> None:
+        """Test that a hard link left by hardlink mode is replaced by a copy."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file, dest_file = self._materialize("hardlink", temp_dir)
+            LatexExpander(LatexExpandConfig(graphics_mode="copy"))._copy_graphics_file(
+                _FlattenContext(), source_file, os.path.dirname(dest_file)
+            )
+            assert not os.path.samefile(source_file, dest_file)
+
+    def test_graphics_already_in_output_directory(self) -> None:
+        """Test that a source inside the output directory is left alone."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file = os.path.join(temp_dir, "test.png")
+            with open(source_file, "wb") as f:
+                f.write(b"fake PNG data")
+            for mode in ("copy", "hardlink", "symlink"):
+                LatexExpander(
+                    LatexExpandConfig(graphics_mode=mode, skip_unchanged="never")
+                )._copy_graphics_file(_FlattenContext(), source_file, temp_dir)
+                assert not os.path.islink(source_file)
+                with open(source_file, "rb") as f:
+                    assert f.read() == b"fake PNG data"
+
+    def _copy_twice(
+        self, skip_unchanged: str, temp_dir: str, touch_dest: bool = False
+    ) -> int:
+        """Copy a graphics file twice and count the actual copies."""
+        source_dir = os.path.join(temp_dir, "source")
+        dest_dir = os.path.join(temp_dir, "dest")
+        os.makedirs(source_dir)
+        os.makedirs(dest_dir)
+        source_file = os.path.join(source_dir, "test.png")
+        with open(source_file, "wb") as f:
+            f.write(b"fake PNG data")
+
+        config = LatexExpandConfig(skip_unchanged=skip_unchanged)
+        LatexExpander(config)._copy_graphics_file(
+            _FlattenContext(), source_file, dest_dir
+        )
+        if touch_dest:
+            # Same size and modification time, different content
+            dest_file = os.path.join(dest_dir, "test.png")
+            stat = os.stat(dest_file)
+            with open(dest_file, "wb") as f:
+                f.write(b"fake PNG DATA")
+            os.utime(dest_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        with patch("shutil.copy2", wraps=shutil.copy2) as mock_copy:
+            LatexExpander(config)._copy_graphics_file(
+                _FlattenContext(), source_file, dest_dir
+            )
+            return mock_copy.call_count
+
+    def test_skip_unchanged_by_mtime(self) -> None:
+        """Test that an up-to-date destination is not copied again."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert self._copy_twice("mtime", temp_dir) == 0
+
+    def test_skip_unchanged_never(self) -> None:
+        """Test that graphics can always be copied again."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert self._copy_twice("never", temp_dir) == 1
+
+    def test_skip_unchanged_by_digest(self) -> None:
+        """Test that the digest check catches same size and mtime edits."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert self._copy_twice("mtime", temp_dir, touch_dest=True) == 0
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert self._copy_twice("digest", temp_dir, touch_dest=True) == 1
+        with tempfile.TemporaryDirectory() as temp_dir:
+            assert self._copy_twice("digest", temp_dir) == 0
+
+    def test_skip_unchanged_copies_modified_source(self) -> None:
+        """Test that a modified source is copied again."""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source_file = os.path.join(temp_dir, "test.png")
+            dest_dir = os.path.join(temp_dir, "dest")
+            os.makedirs(dest_dir)
+            with open(source_file, "wb") as f:
+                f.write(b"version 1")
+            self.expander._copy_graphics_file(_FlattenContext(), source_file, dest_dir)
+
+            with open(source_file, "wb") as f:
+                f.write(b"version 22")
+            self.expander._copy_graphics_file(_FlattenContext(), source_file, dest_dir)
+
+            with open(os.path.join(dest_dir, "test.png"), "rb") as f:
+                assert f.read() == b"version 22"